@@ -0,0 +1,140 @@
+"""
+Measures number of storage backend round-trips per acquire of the limiters.
+
+    python -m benchmarks.backend_roundtrips [--redis-url redis://localhost:6379/0] [--calls 1000]
+
+Redis backend uses real Redis server if --redis-url is provided, otherwise fakeredis (if it is installed).
+Every backend is also measured wrapped into LeasingBackend ("+leasing" suffix of the backend name).
+Results are printed as JSON.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import threading as th
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    InMemoryBackend,
+    LeasingBackend,
+    MThreadedBucketTimeRateLimiter,
+    RedisBackend,
+    SharedMemoryBackend,
+    StorageBackendABC,
+)
+
+
+class CountingBackend(StorageBackendABC):
+    """Counts calls of the wrapped backend."""
+
+    def __init__(self, backend: StorageBackendABC) -> None:
+        self.backend = backend
+        self.calls = 0
+
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        self.calls += 1
+        return self.backend.update(key, max_size, recovery_time, cost, mode)
+
+    async def aupdate(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        self.calls += 1
+        return await self.backend.aupdate(key, max_size, recovery_time, cost, mode)
+
+
+def make_backends(redis_url: str) -> List[Tuple[str, StorageBackendABC]]:
+    backends: List[Tuple[str, StorageBackendABC]] = [
+        ("memory", InMemoryBackend()),
+        ("shared_memory", SharedMemoryBackend(tempfile.mkdtemp())),
+    ]
+    if redis_url:
+        import redis
+        import redis.asyncio
+
+        backends.append(
+            ("redis", RedisBackend(redis.Redis.from_url(redis_url), redis.asyncio.Redis.from_url(redis_url)))
+        )
+    else:
+        try:
+            import fakeredis
+
+            server = fakeredis.FakeServer()
+            backends.append(
+                (
+                    "fakeredis",
+                    RedisBackend(fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)),
+                )
+            )
+        except ImportError:
+            pass
+    return backends
+
+
+def run_threads(backend: StorageBackendABC, calls: int, threads: int, max_size: int, name: str) -> None:
+    limiter = MThreadedBucketTimeRateLimiter(max_size=max_size, recovery_time=1.0, backend=backend, name=name)
+
+    def worker() -> None:
+        for _ in range(calls // threads):
+            limiter.acquire()
+
+    workers = [th.Thread(target=worker) for _ in range(threads)]
+    [w.start() for w in workers]
+    [w.join() for w in workers]
+
+
+async def run_asyncio(backend: StorageBackendABC, calls: int, coroutines: int, max_size: int, name: str) -> None:
+    limiter = AsyncioBucketTimeRateLimiter(max_size=max_size, recovery_time=1.0, backend=backend, name=name)
+
+    async def worker() -> None:
+        for _ in range(calls // coroutines):
+            await limiter.acquire()
+
+    await asyncio.gather(*[worker() for _ in range(coroutines)])
+
+
+def measure(name: str, backend: StorageBackendABC, calls: int, leasing: bool) -> List[Dict[str, Any]]:
+    results = []
+    # "unlimited" - the bucket is never empty, "limited" - callers wait for tokens most of the time
+    for scenario, max_size, total in (("unlimited", calls * 10, calls), ("limited", 100, 300)):
+        for model, concurrency in (("threads", 1), ("threads", 16), ("asyncio", 1), ("asyncio", 100)):
+            counting = CountingBackend(backend)
+            measured = LeasingBackend(counting) if leasing else counting
+            key = f"{scenario}-{model}-{concurrency}-{leasing}"  # every run uses its own bucket
+            start = perf_counter()
+            if model == "threads":
+                run_threads(measured, total, concurrency, max_size, key)
+            else:
+                asyncio.run(run_asyncio(measured, total, concurrency, max_size, key))
+            elapsed = perf_counter() - start
+            if isinstance(measured, LeasingBackend):
+                measured.close()  # returning of unused tokens is not counted
+            acquired = total // concurrency * concurrency
+            results.append(
+                {
+                    "backend": name + ("+leasing" if leasing else ""),
+                    "scenario": scenario,
+                    "model": model,
+                    "concurrency": concurrency,
+                    "acquires": acquired,
+                    "round_trips_per_acquire": round(counting.calls / acquired, 3),
+                    "seconds": round(elapsed, 3),
+                }
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="", help="URL of Redis server, fakeredis is used if it is empty")
+    parser.add_argument("--calls", type=int, default=1000, help="number of acquires in unlimited scenario")
+    args = parser.parse_args()
+
+    results = []
+    for name, backend in make_backends(args.redis_url):
+        for leasing in (False, True):
+            results.extend(measure(name, backend, args.calls, leasing))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Measures overhead and scaling of the asyncio and multithreaded limiters in every mode.
+
+    python -m benchmarks.limiter_overhead [--quick] [--output results.json] [--baseline old.json]
+
+Benchmarks:
+    overhead - time of uncontended acquire (and release) in nanoseconds, the bucket is never empty.
+    refill_latency - how late the waiter is woken up after the moment its slot became available, in milliseconds.
+    idle_wakeups - CPU time and context switches per second of the process while waiters wait for a distant
+    refill, there should be (almost) none. Context switches are read from /proc, they are None on other systems.
+    throughput - acquires per second while 1 to 10k coroutines or 1 to 256 threads compete for the bucket
+    with the rate of 20k slots per second, efficiency is the share of the rate the limiter delivers.
+    contention - acquires per second of 1 to 256 threads which hammer the never empty bucket of the multithreaded
+    limiter, one bucket vs striped one. Run it on free-threaded Python (gil_enabled is false) to see the scaling.
+
+Results are printed as JSON (or written to --output) together with the library and Python versions.
+If --baseline file with the results of the previous run is provided, metrics which became worse by more
+than --threshold are reported and the exit code is 1.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import threading as th
+from time import monotonic, perf_counter, process_time, sleep
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bucketratelimiter import AsyncioBucketTimeRateLimiter, InMemoryBackend, MThreadedBucketTimeRateLimiter
+from bucketratelimiter.version import __version__
+
+# name of the mode -> extra params of the limiter
+MODES: Dict[str, Dict[str, Any]] = {
+    "fixed_window": {"algorithm": "fixed_window"},
+    "token_bucket": {"algorithm": "token_bucket"},
+    "sliding_window_counter": {"algorithm": "sliding_window_counter"},
+    "sliding_window_log": {"algorithm": "sliding_window_log"},
+    "gcra": {"algorithm": "gcra"},
+    "leaky_bucket": {"algorithm": "leaky_bucket"},
+    "max_concurrency": {"algorithm": "token_bucket", "max_concurrency": 8},
+    "memory_backend": {"backend": InMemoryBackend()},
+}
+# metrics where lower value is better, for others higher value is better
+LOWER_IS_BETTER = {"ns_per_acquire", "median_ms", "p90_ms", "max_ms", "cpu_seconds_per_second", "wakeups_per_second"}
+# target rate of throughput benchmark
+RATE_SIZE, RATE_TIME = 200, 0.01
+
+
+def limiter_params(mode: str, max_size: int, recovery_time: float) -> Dict[str, Any]:
+    params = dict(MODES[mode], max_size=max_size, recovery_time=recovery_time)
+    if params.get("algorithm") == "leaky_bucket":
+        params["burst"] = max_size  # the same burst as the other buckets, by default it paces every call
+    if "backend" in params:
+        params["name"] = f"{max_size}-{recovery_time}-{monotonic()}"  # fresh bucket for every run
+    return params
+
+
+def context_switches() -> Optional[int]:
+    """Returns number of context switches of all the threads of the process, None if /proc is not available."""
+    paths = glob.glob(f"/proc/{os.getpid()}/task/*/status")
+    if not paths:
+        return None
+    total = 0
+    for path in paths:
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                        total += int(line.split()[1])
+        except OSError:  # the thread has just finished
+            pass
+    return total
+
+
+def percentile(samples: List[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+
+# --- overhead ---
+
+
+async def asyncio_overhead(mode: str, calls: int) -> float:
+    limiter = AsyncioBucketTimeRateLimiter(**limiter_params(mode, calls * 2, 3600.0))
+    limiter.activate()
+    start = perf_counter()
+    for _ in range(calls):
+        await limiter.acquire()
+        limiter.release()
+    elapsed = perf_counter() - start
+    limiter.deactivate()
+    return elapsed
+
+
+def mthreaded_overhead(mode: str, calls: int) -> float:
+    limiter = MThreadedBucketTimeRateLimiter(**limiter_params(mode, calls * 2, 3600.0))
+    limiter.activate()
+    start = perf_counter()
+    for _ in range(calls):
+        limiter.acquire()
+        limiter.release()
+    elapsed = perf_counter() - start
+    limiter.deactivate()
+    return elapsed
+
+
+def bench_overhead(calls: int) -> List[Dict[str, Any]]:
+    results = []
+    for mode in MODES:
+        for model in ("asyncio", "threads"):
+            if model == "asyncio":
+                elapsed = asyncio.run(asyncio_overhead(mode, calls))
+            else:
+                elapsed = mthreaded_overhead(mode, calls)
+            results.append(
+                {"benchmark": "overhead", "model": model, "mode": mode, "ns_per_acquire": round(elapsed / calls * 1e9)}
+            )
+    return results
+
+
+# --- refill latency ---
+
+
+def latency_stats(lateness: List[float]) -> Dict[str, float]:
+    return {
+        "median_ms": round(statistics.median(lateness) * 1000, 3),
+        "p90_ms": round(percentile(lateness, 0.9) * 1000, 3),
+        "max_ms": round(max(lateness) * 1000, 3),
+    }
+
+
+async def asyncio_refill_latency(mode: str, samples: int, recovery_time: float) -> List[float]:
+    limiter = AsyncioBucketTimeRateLimiter(**limiter_params(mode, 1, recovery_time))
+    limiter.activate()
+    lateness = []
+    for _ in range(samples):
+        await limiter.acquire()  # the bucket is empty now
+        ready_at = monotonic() + await limiter.areserve()
+        await limiter.acquire()
+        lateness.append(monotonic() - ready_at)
+        limiter.release()
+        limiter.release()
+    limiter.deactivate()
+    return lateness
+
+
+def mthreaded_refill_latency(mode: str, samples: int, recovery_time: float) -> List[float]:
+    limiter = MThreadedBucketTimeRateLimiter(**limiter_params(mode, 1, recovery_time))
+    limiter.activate()
+    lateness = []
+    for _ in range(samples):
+        limiter.acquire()  # the bucket is empty now
+        ready_at = monotonic() + limiter.reserve()
+        limiter.acquire()
+        lateness.append(monotonic() - ready_at)
+        limiter.release()
+        limiter.release()
+    limiter.deactivate()
+    return lateness
+
+
+def bench_refill_latency(samples: int) -> List[Dict[str, Any]]:
+    results = []
+    for mode in MODES:
+        for model in ("asyncio", "threads"):
+            if model == "asyncio":
+                lateness = asyncio.run(asyncio_refill_latency(mode, samples, 0.02))
+            else:
+                lateness = mthreaded_refill_latency(mode, samples, 0.02)
+            results.append({"benchmark": "refill_latency", "model": model, "mode": mode, **latency_stats(lateness)})
+    return results
+
+
+# --- idle wakeups ---
+
+
+def idle_stats(cpu: float, switches: Optional[int], seconds: float) -> Dict[str, Any]:
+    return {
+        "cpu_seconds_per_second": round(cpu / seconds, 4),
+        "wakeups_per_second": None if switches is None else round(switches / seconds, 1),
+    }
+
+
+async def asyncio_idle(mode: str, waiters: int, seconds: float) -> Tuple[float, Optional[int]]:
+    limiter = AsyncioBucketTimeRateLimiter(**limiter_params(mode, 1, 3600.0))
+    limiter.activate()
+    await limiter.acquire()  # the next slot is available in an hour
+    tasks = [asyncio.ensure_future(limiter.acquire()) for _ in range(waiters)]
+    await asyncio.sleep(0.1)  # all the waiters are queued
+    cpu, switches = process_time(), context_switches()
+    await asyncio.sleep(seconds)
+    cpu, end_switches = process_time() - cpu, context_switches()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    limiter.deactivate()
+    return cpu, None if switches is None or end_switches is None else end_switches - switches
+
+
+def mthreaded_idle(mode: str, waiters: int, seconds: float) -> Tuple[float, Optional[int]]:
+    limiter = MThreadedBucketTimeRateLimiter(**limiter_params(mode, 1, 3600.0))
+    limiter.activate()
+    limiter.acquire()  # the next slot is available in an hour
+    # blocked threads can not be cancelled, daemon threads are left sleeping until the process exits
+    for _ in range(waiters):
+        th.Thread(target=limiter.acquire, daemon=True).start()
+    sleep(0.1)  # all the waiters are queued
+    cpu, switches = process_time(), context_switches()
+    sleep(seconds)
+    cpu, end_switches = process_time() - cpu, context_switches()
+    return cpu, None if switches is None or end_switches is None else end_switches - switches
+
+
+def bench_idle_wakeups(seconds: float, waiters: List[int]) -> List[Dict[str, Any]]:
+    results = []
+    for mode in MODES:
+        for model in ("asyncio", "threads"):
+            for count in waiters:
+                if model == "asyncio":
+                    cpu, switches = asyncio.run(asyncio_idle(mode, count, seconds))
+                else:
+                    cpu, switches = mthreaded_idle(mode, count, seconds)
+                results.append(
+                    {
+                        "benchmark": "idle_wakeups",
+                        "model": model,
+                        "mode": mode,
+                        "waiters": count,
+                        **idle_stats(cpu, switches, seconds),
+                    }
+                )
+    return results
+
+
+# --- throughput ---
+
+
+async def asyncio_throughput(mode: str, waiters: int, calls: int) -> float:
+    limiter = AsyncioBucketTimeRateLimiter(**limiter_params(mode, RATE_SIZE, RATE_TIME))
+    limiter.activate()
+
+    async def worker() -> None:
+        for _ in range(calls // waiters):
+            await limiter.acquire()
+            limiter.release()
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(waiters)))
+    elapsed = perf_counter() - start
+    limiter.deactivate()
+    return elapsed
+
+
+def mthreaded_throughput(mode: str, waiters: int, calls: int) -> float:
+    limiter = MThreadedBucketTimeRateLimiter(**limiter_params(mode, RATE_SIZE, RATE_TIME))
+    limiter.activate()
+
+    def worker() -> None:
+        for _ in range(calls // waiters):
+            limiter.acquire()
+            limiter.release()
+
+    threads = [th.Thread(target=worker) for _ in range(waiters)]
+    start = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = perf_counter() - start
+    limiter.deactivate()
+    return elapsed
+
+
+# name of the mode -> params of the multithreaded limiter in contention benchmark
+CONTENTION_MODES: Dict[str, Dict[str, Any]] = {
+    "token_bucket": {"algorithm": "token_bucket"},
+    "striped": {"algorithm": "token_bucket", "stripes": os.cpu_count() or 1},
+}
+
+
+def mthreaded_contention(mode: str, waiters: int, calls: int) -> float:
+    limiter = MThreadedBucketTimeRateLimiter(max_size=calls * 2, recovery_time=3600.0, **CONTENTION_MODES[mode])
+    barrier = th.Barrier(waiters + 1)
+
+    def worker() -> None:
+        barrier.wait()
+        for _ in range(calls // waiters):
+            limiter.acquire()
+
+    threads = [th.Thread(target=worker) for _ in range(waiters)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = perf_counter()
+    for t in threads:
+        t.join()
+    return perf_counter() - start
+
+
+def bench_contention(calls: int, threads: List[int]) -> List[Dict[str, Any]]:
+    results = []
+    for mode in CONTENTION_MODES:
+        for waiters in threads:
+            total = max(calls, waiters) // waiters * waiters
+            elapsed = mthreaded_contention(mode, waiters, total)
+            results.append(
+                {
+                    "benchmark": "contention",
+                    "model": "threads",
+                    "mode": mode,
+                    "waiters": waiters,
+                    "acquires_per_second": round(total / elapsed),
+                }
+            )
+    return results
+
+
+def bench_throughput(calls: int, coroutines: List[int], threads: List[int]) -> List[Dict[str, Any]]:
+    results = []
+    rate = RATE_SIZE / RATE_TIME
+    for mode in MODES:
+        for model, levels in (("asyncio", coroutines), ("threads", threads)):
+            for waiters in levels:
+                total = max(calls, waiters) // waiters * waiters
+                if model == "asyncio":
+                    elapsed = asyncio.run(asyncio_throughput(mode, waiters, total))
+                else:
+                    elapsed = mthreaded_throughput(mode, waiters, total)
+                # the first RATE_SIZE slots are taken at once, the rest come at the rate
+                expected = max(total - RATE_SIZE, 0) / rate
+                results.append(
+                    {
+                        "benchmark": "throughput",
+                        "model": model,
+                        "mode": mode,
+                        "waiters": waiters,
+                        "acquires_per_second": round(total / elapsed),
+                        "efficiency": round(expected / elapsed, 3),
+                    }
+                )
+    return results
+
+
+# --- comparison ---
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[Any, ...]:
+    return result["benchmark"], result["model"], result["mode"], result.get("waiters")
+
+
+def regressions(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Returns descriptions of the metrics which became worse than the baseline by more than threshold share."""
+    old = {result_key(result): result for result in baseline["results"]}
+    found = []
+    for result in current["results"]:
+        previous = old.get(result_key(result))
+        if previous is None:
+            continue
+        for metric, value in result.items():
+            before = previous.get(metric)
+            if metric in ("benchmark", "model", "mode", "waiters") or value is None or not before:
+                continue
+            if metric in LOWER_IS_BETTER:
+                change = value / before - 1
+            else:
+                change = before / value - 1 if value else 1.0
+            if change > threshold:
+                name = " ".join(str(k) for k in result_key(result) if k is not None)
+                found.append(f"{name} {metric}: {before} -> {value}")
+    return found
+
+
+def run(quick: bool) -> List[Dict[str, Any]]:
+    benchmarks: List[Callable[[], List[Dict[str, Any]]]] = [
+        lambda: bench_overhead(2000 if quick else 50000),
+        lambda: bench_refill_latency(5 if quick else 50),
+        lambda: bench_idle_wakeups(0.2 if quick else 1.0, [1, 100] if quick else [1, 100, 1000]),
+        lambda: bench_throughput(
+            1000 if quick else 5000,
+            [1, 100, 1000] if quick else [1, 10, 100, 1000, 10000],
+            [1, 16] if quick else [1, 4, 16, 64, 256],
+        ),
+        lambda: bench_contention(10000 if quick else 200000, [1, 16] if quick else [1, 4, 16, 64, 256]),
+    ]
+    results = []
+    for benchmark in benchmarks:
+        results.extend(benchmark())
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer samples and levels, to check that it works, results are noisy")
+    parser.add_argument("--output", default="", help="file to write the results to, stdout by default")
+    parser.add_argument("--baseline", default="", help="results of the previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="share of change which is regression")
+    args = parser.parse_args()
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "gil_enabled": getattr(sys, "_is_gil_enabled", lambda: True)(),
+        "cpu_count": os.cpu_count(),
+        "results": run(args.quick),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(json.load(f), report, args.threshold)
+        for line in found:
+            print(f"regression: {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
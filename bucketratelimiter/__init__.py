@@ -1,9 +1,55 @@
 from .bucket_rate_limiters import (
+    AcquireTimeoutError,
+    AdaptiveRate,
     AsyncioBucketTimeRateLimiter,
+    AsyncioCompositeRateLimiter,
+    AsyncioKeyedRateLimiter,
+    CallCache,
+    CallStats,
+    Clock,
+    HybridBucketTimeRateLimiter,
+    InMemoryBackend,
+    KeyedRateLimiter,
+    LeasingBackend,
+    LimiterOverloadedError,
     MThreadedBucketTimeRateLimiter,
+    MThreadedCompositeRateLimiter,
+    MThreadedKeyedRateLimiter,
+    ProcessBucketTimeRateLimiter,
+    RateLimitedExecutor,
+    RateLimiterError,
+    RedisBackend,
+    RetryPolicy,
+    SharedMemoryBackend,
+    StorageBackendABC,
+    VirtualClock,
+    prometheus_text,
 )
 
 __all__ = [
+    "AcquireTimeoutError",
+    "AdaptiveRate",
     "AsyncioBucketTimeRateLimiter",
+    "AsyncioCompositeRateLimiter",
+    "AsyncioKeyedRateLimiter",
+    "CallCache",
+    "CallStats",
+    "Clock",
+    "HybridBucketTimeRateLimiter",
+    "InMemoryBackend",
+    "KeyedRateLimiter",
+    "LeasingBackend",
+    "LimiterOverloadedError",
     "MThreadedBucketTimeRateLimiter",
+    "MThreadedCompositeRateLimiter",
+    "MThreadedKeyedRateLimiter",
+    "ProcessBucketTimeRateLimiter",
+    "RateLimitedExecutor",
+    "RateLimiterError",
+    "RedisBackend",
+    "RetryPolicy",
+    "SharedMemoryBackend",
+    "StorageBackendABC",
+    "VirtualClock",
+    "prometheus_text",
 ]
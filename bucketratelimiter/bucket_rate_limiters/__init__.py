@@ -1,8 +1,44 @@
+from .adaptive import AdaptiveRate
 from .asyncio_bucket import AsyncioBucketTimeRateLimiter
+from .backends import InMemoryBackend, LeasingBackend, RedisBackend, SharedMemoryBackend
+from .bucket_abc import StorageBackendABC
+from .cache import CallCache
+from .clock import Clock, VirtualClock
+from .composite_bucket import AsyncioCompositeRateLimiter, MThreadedCompositeRateLimiter
+from .exceptions import AcquireTimeoutError, LimiterOverloadedError, RateLimiterError
+from .executor import RateLimitedExecutor
+from .hybrid_bucket import HybridBucketTimeRateLimiter
+from .keyed_bucket import AsyncioKeyedRateLimiter, KeyedRateLimiter, MThreadedKeyedRateLimiter
+from .metrics import CallStats, prometheus_text
 from .mthreaded_bucket import MThreadedBucketTimeRateLimiter
+from .process_bucket import ProcessBucketTimeRateLimiter
+from .retry import RetryPolicy
 
 
 __all__ = [
+    "AcquireTimeoutError",
+    "AdaptiveRate",
     "AsyncioBucketTimeRateLimiter",
+    "AsyncioCompositeRateLimiter",
+    "AsyncioKeyedRateLimiter",
+    "CallCache",
+    "CallStats",
+    "Clock",
+    "HybridBucketTimeRateLimiter",
+    "InMemoryBackend",
+    "KeyedRateLimiter",
+    "LeasingBackend",
+    "LimiterOverloadedError",
     "MThreadedBucketTimeRateLimiter",
+    "MThreadedCompositeRateLimiter",
+    "MThreadedKeyedRateLimiter",
+    "ProcessBucketTimeRateLimiter",
+    "RateLimitedExecutor",
+    "RateLimiterError",
+    "RedisBackend",
+    "RetryPolicy",
+    "SharedMemoryBackend",
+    "StorageBackendABC",
+    "VirtualClock",
+    "prometheus_text",
 ]
@@ -0,0 +1,98 @@
+import math
+from typing import Any, Callable, Optional, Tuple, Type, Union
+
+ExceptionTypes = Union[Type[BaseException], Tuple[Type[BaseException], ...]]
+
+
+class AdaptiveRate:
+    """
+    AIMD (additive increase, multiplicative decrease) control of the limiter rate by the upstream feedback,
+    the same way TCP looks for the bandwidth of the network.
+    Every successful call increases the rate by increase / rate, so the rate grows by increase slots per second
+    every second while the calls succeed. Throttled call multiplies the rate by decrease.
+    Calls which started before the last decrease do not decrease the rate again, they were made at the old rate.
+    One instance should be used by one limiter.
+    """
+
+    def __init__(
+        self,
+        min_rate: float = 1.0,
+        max_rate: Optional[float] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        exceptions: ExceptionTypes = (),
+        classifier: Optional[Callable[[Any], bool]] = None,
+        latency_target: Optional[float] = None,
+    ) -> None:
+        """
+        :param min_rate: the rate (slots per second) is never decreased below the value.
+        :param max_rate: the rate is never increased above the value, by default it is max_size / recovery_time
+        of the limiter, the rate starts from the value.
+        :param increase: slots per second the rate grows by every second while the calls succeed.
+        :param decrease: factor the rate is multiplied by when call is throttled, should be between 0 and 1.
+        :param exceptions: exception types which mean the call was throttled, e.g. TooManyRequests (429, 503).
+        Other exceptions do not change the rate.
+        :param classifier: function which receives result of the call and returns True if the call was throttled.
+        :param latency_target: time in seconds, call which lasts longer is considered throttled.
+        """
+        if min_rate <= 0:
+            raise ValueError(f"min_rate should be positive number, got {min_rate}")
+        if max_rate is not None and max_rate < min_rate:
+            raise ValueError(f"max_rate {max_rate} is less than min_rate {min_rate}")
+        if increase < 0:
+            raise ValueError(f"increase should not be negative, got {increase}")
+        if not 0 < decrease < 1:
+            raise ValueError(f"decrease should be between 0 and 1, got {decrease}")
+        self.min_rate: float = min_rate
+        self.max_rate: Optional[float] = max_rate
+        self.increase: float = increase
+        self.decrease: float = decrease
+        self.exceptions: ExceptionTypes = exceptions
+        self.classifier: Optional[Callable[[Any], bool]] = classifier
+        self.latency_target: Optional[float] = latency_target
+        self.rate: float = max_rate if max_rate is not None else math.nan  # current rate, slots per second
+        self.decreased_at: float = -math.inf  # time of the last decrease
+
+    def attach(self, rate: float) -> float:
+        """
+        Is called by the limiter with its configured rate (max_size / recovery_time).
+        :return: initial rate of the limiter.
+        """
+        if self.max_rate is None:
+            self.max_rate = max(rate, self.min_rate)
+        self.rate = self.max_rate
+        return self.rate
+
+    def is_throttled(self, latency: float, exc: Optional[BaseException] = None, result: Any = None) -> Optional[bool]:
+        """:return: True if the call was throttled, False if it succeeded, None if the call says nothing."""
+        if exc is not None:
+            return True if isinstance(exc, self.exceptions) else None
+        if self.classifier is not None and self.classifier(result):
+            return True
+        return self.latency_target is not None and latency > self.latency_target
+
+    def observe(
+        self, started: float, now: float, exc: Optional[BaseException] = None, result: Any = None
+    ) -> Optional[float]:
+        """
+        Updates the rate by the outcome of the call.
+        :param started: time the call was started at.
+        :param now: time the call was finished at.
+        :param exc: exception the call raised.
+        :param result: result the call returned.
+        :return: the new rate, or None if the rate is not changed.
+        """
+        throttled = self.is_throttled(now - started, exc, result)
+        if throttled is None or self.max_rate is None:
+            return None
+        if throttled:
+            if started < self.decreased_at:  # the call was made at the old rate
+                return None
+            self.decreased_at = now
+            rate = max(self.min_rate, self.rate * self.decrease)
+        else:
+            rate = min(self.max_rate, self.rate + self.increase / self.rate)
+        if rate == self.rate:
+            return None
+        self.rate = rate
+        return rate
@@ -0,0 +1,262 @@
+import math
+from collections import deque
+from typing import Deque, List, Optional, Union
+
+# tolerance for float rounding, otherwise waiter can be woken up a "tiny bit" before tokens are available
+EPSILON = 1e-9
+# min time to wait for refill which is already late, so waiters do not spin
+MIN_WAIT_TIME = 0.001
+
+# "fixed_window" - bucket is refilled to full size every recovery_time by background task / thread
+# "token_bucket" - bucket is refilled lazily and continuously, see TokenBucket
+# "sliding_window_counter", "sliding_window_log", "gcra" - see SlidingWindowCounter, SlidingWindowLog, Gcra
+# "leaky_bucket" - calls are paced evenly, see Gcra with burst
+ALGORITHMS = ("fixed_window", "token_bucket", "sliding_window_counter", "sliding_window_log", "gcra", "leaky_bucket")
+# the objects below are not thread safe, it is the responsibility of the caller to synchronize access to them
+
+
+class TokenBucket:
+    """
+    Token bucket which is refilled lazily: available tokens are computed on demand from the time
+    passed since the last call, the bucket is refilled continuously (fractionally), not by portions.
+    Nothing runs in background, hereby the object does not need activation.
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "last")
+
+    def __init__(self, max_size: float, recovery_time: float, now: float) -> None:
+        self.capacity: float = float(max_size)
+        self.rate: float = max_size / recovery_time  # tokens per second
+        self.tokens: float = float(max_size)
+        self.last: float = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.last:
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def available(self, now: float) -> float:
+        """Returns number of tokens available right now, it is negative if tokens were reserved in advance."""
+        self._refill(now)
+        return self.tokens
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Returns time to wait until cost tokens are available, 0.0 means tokens are available right now."""
+        self._refill(now)
+        if self.tokens + EPSILON >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        """Takes cost tokens unconditionally."""
+        self._refill(now)
+        self.tokens -= cost
+
+    def take(self, now: float, cost: float = 1) -> float:
+        """Takes cost tokens if they are available, otherwise returns time to wait for them."""
+        wait = self.wait_time(now, cost)
+        if wait == 0.0:
+            self.tokens -= cost
+        return wait
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        """Returns cost tokens back to the bucket, e.g. if the taken tokens were not used."""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def set_rate(self, now: float, rate: float) -> None:
+        """Changes refill rate (tokens per second), tokens which are refilled till now are counted at old rate."""
+        self._refill(now)
+        self.rate = rate
+
+
+class SlidingWindowCounter:
+    """
+    Sliding window counter: calls are counted in fixed windows of recovery_time, the number of calls
+    in the sliding window is estimated as the count of the current window plus the count of the previous
+    window weighted by its share which is still in the sliding window. Two numbers of state, the estimate
+    assumes that the calls of the previous window were spread evenly, it is accounting of many API gateways.
+    """
+
+    __slots__ = ("capacity", "window", "rate", "start", "previous", "current")
+
+    def __init__(self, max_size: float, recovery_time: float, now: float) -> None:
+        self.capacity: float = float(max_size)
+        self.window: float = recovery_time
+        self.rate: float = max_size / recovery_time  # calls per second on average
+        self.start: float = math.floor(now / recovery_time) * recovery_time  # start of the current window
+        self.previous: float = 0.0  # number of calls in the previous window
+        self.current: float = 0.0  # number of calls in the current window
+
+    def _roll(self, now: float) -> None:
+        start = math.floor(now / self.window) * self.window
+        if start > self.start:
+            self.previous = self.current if start - self.start < self.window * 1.5 else 0.0
+            self.current = 0.0
+            self.start = start
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Returns time to wait until cost calls fit into the sliding window, 0.0 means right now."""
+        self._roll(now)
+        if cost > self.capacity:  # estimate for the calls which do not fit into one window
+            return self.wait_time(now, self.capacity) + (cost - self.capacity) / self.rate
+        weight = 1.0 - (now - self.start) / self.window
+        room = self.capacity - self.current - cost  # room for the calls of the previous window
+        if self.previous * weight <= room + EPSILON:
+            return 0.0
+        if room >= 0:  # wait until enough calls of the previous window slide out
+            return max(self.start + self.window * (1.0 - room / self.previous) - now, 0.0)
+        # the calls of the current window slide out in the next window
+        room = self.capacity - cost
+        end = self.start + self.window
+        if self.current <= room + EPSILON:
+            return end - now
+        return min(end + self.window * (1.0 - room / self.current), end + self.window) - now
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        """Counts cost calls unconditionally."""
+        self._roll(now)
+        self.current += cost
+
+    def take(self, now: float, cost: float = 1) -> float:
+        """Counts cost calls if they fit into the sliding window, otherwise returns time to wait for it."""
+        wait = self.wait_time(now, cost)
+        if wait == 0.0:
+            self.current += cost
+        return wait
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        """Uncounts cost calls, e.g. if the taken slots were not used."""
+        self._roll(now)
+        self.current = max(self.current - cost, 0.0)
+
+
+class SlidingWindowLog:
+    """
+    Sliding window log: keeps the times of the calls of the last recovery_time, a call is allowed
+    if there are less than max_size calls in the window. Exact accounting, the state is up to max_size entries.
+    """
+
+    __slots__ = ("capacity", "window", "rate", "log", "count")
+
+    def __init__(self, max_size: float, recovery_time: float, now: float) -> None:
+        self.capacity: float = float(max_size)
+        self.window: float = recovery_time
+        self.rate: float = max_size / recovery_time  # calls per second on average
+        self.log: Deque[List[float]] = deque()  # [time, cost] of the calls in the window, oldest first
+        self.count: float = 0.0  # total cost of the calls in the log
+
+    def _expire(self, now: float) -> None:
+        log = self.log
+        horizon = now - self.window
+        while log and log[0][0] <= horizon + EPSILON:
+            self.count -= log.popleft()[1]
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Returns time to wait until cost calls fit into the sliding window, 0.0 means right now."""
+        self._expire(now)
+        excess = self.count + cost - self.capacity
+        if excess <= EPSILON:
+            return 0.0
+        for moment, calls in self.log:  # the oldest calls slide out first
+            excess -= calls
+            if excess <= EPSILON:
+                return moment + self.window - now
+        # estimate for the calls which do not fit into one window
+        last = self.log[-1][0] + self.window if self.log else now
+        return last - now + excess / self.rate
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        """Logs cost calls unconditionally."""
+        self._expire(now)
+        if self.log and self.log[-1][0] == now:
+            self.log[-1][1] += cost
+        else:
+            self.log.append([now, cost])
+        self.count += cost
+
+    def take(self, now: float, cost: float = 1) -> float:
+        """Logs cost calls if they fit into the sliding window, otherwise returns time to wait for it."""
+        wait = self.wait_time(now, cost)
+        if wait == 0.0:
+            self.consume(now, cost)
+        return wait
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        """Removes cost newest calls from the log, e.g. if the taken slots were not used."""
+        self._expire(now)
+        log = self.log
+        while log and cost > 0:
+            part = min(log[-1][1], cost)
+            log[-1][1] -= part
+            self.count -= part
+            cost -= part
+            if not log[-1][1]:
+                log.pop()
+
+
+class Gcra:
+    """
+    Generic cell rate algorithm: the only state is the theoretical arrival time (TAT) of the next call.
+    Every call moves TAT by recovery_time / max_size (interval), a call is allowed if TAT is not more than
+    burst intervals ahead of now. By default burst is max_size and accounting is the same as the token bucket
+    of max_size tokens, e.g. it matches upstreams which use GCRA (redis-cell, throttled).
+    With small burst it is leaky bucket (as a meter): calls are paced one per interval, up to burst calls
+    can go together after idle time. Weighted call which costs more than burst is allowed when TAT is not ahead
+    of now, i.e. after idle time, and the following calls wait for its intervals.
+    """
+
+    __slots__ = ("window", "interval", "tat")
+
+    def __init__(self, max_size: float, recovery_time: float, now: float, burst: Optional[float] = None) -> None:
+        self.interval: float = recovery_time / max_size  # emission interval of one call
+        # burst tolerance plus interval
+        self.window: float = recovery_time if burst is None else burst * self.interval
+        self.tat: float = now  # theoretical arrival time
+
+    @property
+    def rate(self) -> float:
+        return 1.0 / self.interval
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """Returns time to wait until cost calls are allowed, 0.0 means right now."""
+        # the call which does not fit into the window waits until TAT is now, otherwise it would never be allowed
+        wait = max(self.tat, now) + min(cost * self.interval, self.window) - self.window - now
+        return wait if wait > EPSILON else 0.0
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        """Moves TAT for cost calls unconditionally."""
+        self.tat = max(self.tat, now) + cost * self.interval
+
+    def take(self, now: float, cost: float = 1) -> float:
+        """Moves TAT for cost calls if they are allowed, otherwise returns time to wait for it."""
+        wait = self.wait_time(now, cost)
+        if wait == 0.0:
+            self.consume(now, cost)
+        return wait
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        """Moves TAT back for cost calls, e.g. if the taken slots were not used."""
+        self.tat = max(self.tat - cost * self.interval, now)
+
+
+# buckets which are refilled lazily, nothing runs in background
+LazyBucket = Union[TokenBucket, SlidingWindowCounter, SlidingWindowLog, Gcra]
+
+
+def lazy_bucket(
+    algorithm: str, max_size: float, recovery_time: float, now: float, burst: Optional[int] = None
+) -> LazyBucket:
+    """
+    Creates the bucket of the algorithm which is refilled lazily, that is any algorithm but "fixed_window".
+    burst is the number of calls leaky bucket lets go together, one by default.
+    """
+    if algorithm == "leaky_bucket":
+        return Gcra(max_size, recovery_time, now, burst or 1)
+    if algorithm == "sliding_window_counter":
+        return SlidingWindowCounter(max_size, recovery_time, now)
+    if algorithm == "sliding_window_log":
+        return SlidingWindowLog(max_size, recovery_time, now)
+    if algorithm == "gcra":
+        return Gcra(max_size, recovery_time, now)
+    return TokenBucket(max_size, recovery_time, now)
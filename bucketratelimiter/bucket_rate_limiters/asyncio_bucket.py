@@ -1,12 +1,69 @@
 import asyncio
-from functools import wraps
-from typing import Any, Awaitable, Callable, Coroutine, Optional, Union
+import inspect
+import math
+from collections import deque
+from functools import partial, wraps
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Deque,
+    Dict,
+    Iterable,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-from .bucket_abc import AsyncTimeRateLimiterABC, BucketTimeRateLimiterABC
+from .adaptive import AdaptiveRate
+from .algorithms import ALGORITHMS, MIN_WAIT_TIME, LazyBucket, TokenBucket, lazy_bucket
+from .backends import BackendBucket
+from .cache import CallCache
+from .bucket_abc import AsyncTimeRateLimiterABC, BucketTimeRateLimiterABC, CostType, StorageBackendABC
+from .clock import REAL_CLOCK, Clock
+from .exceptions import AcquireTimeoutError, LimiterOverloadedError
+from .metrics import CallStats, LimiterMetrics
+from .retry import RetryPolicy
+from .waiters import WaitQueue
 
 AsyncFuncType = Callable[..., Union[Awaitable, Coroutine]]
 
 
+async def _aiterate(iterable: Union[Iterable[Any], AsyncIterable[Any]]) -> AsyncIterator[Any]:
+    """Iterates over sync or async iterable."""
+    if isinstance(iterable, AsyncIterable):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+class _AsyncSlot:
+    """Async context manager which takes slots from the limiter on enter."""
+
+    __slots__ = ("limiter", "cost", "priority", "timeout")
+
+    def __init__(
+        self, limiter: "AsyncioBucketTimeRateLimiter", cost: int, priority: int, timeout: Optional[float]
+    ) -> None:
+        self.limiter = limiter
+        self.cost = cost
+        self.priority = priority
+        self.timeout = timeout
+
+    async def __aenter__(self) -> None:
+        self.limiter.activate()
+        await self.limiter.acquire(self.cost, priority=self.priority, timeout=self.timeout)
+
+    async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.limiter.release()
+
+
 class AsyncioBucketTimeRateLimiter(BucketTimeRateLimiterABC, AsyncTimeRateLimiterABC):
     def __init__(
         self,
@@ -14,45 +71,541 @@ class AsyncioBucketTimeRateLimiter(BucketTimeRateLimiterABC, AsyncTimeRateLimite
         recovery_time: float = 1.0,
         rest_time: float = 0.2,
         callback: Optional[Callable[..., Any]] = None,
+        algorithm: Optional[str] = None,
+        backend: Optional[StorageBackendABC] = None,
+        name: str = "default",
+        max_concurrency: Optional[int] = None,
+        adaptive: Optional[AdaptiveRate] = None,
+        aging: Optional[float] = None,
+        on_call: Optional[Callable[[CallStats], Any]] = None,
+        clock: Optional[Clock] = None,
+        burst: Optional[int] = None,
+        max_waiters: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        retry: Optional[RetryPolicy] = None,
     ) -> None:
+        if algorithm is None:
+            algorithm = "fixed_window" if backend is None and adaptive is None else "token_bucket"
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm!r}, expected one of {ALGORITHMS}")
+        if backend is not None and algorithm != "token_bucket":
+            raise ValueError("Storage backend keeps token buckets, algorithm should be 'token_bucket'")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency should be positive integer number, got {max_concurrency}")
+        if adaptive is not None and (backend is not None or algorithm != "token_bucket"):
+            raise ValueError("Adaptive rate changes the rate of local token bucket, algorithm should be 'token_bucket'")
+        if burst is not None and (algorithm != "leaky_bucket" or not 1 <= burst <= max_size):
+            raise ValueError(f"burst should be from 1 to max_size and requires 'leaky_bucket' algorithm, got {burst}")
+        if max_waiters is not None and max_waiters < 0:
+            raise ValueError(f"max_waiters should be non-negative integer number, got {max_waiters}")
+        if max_wait is not None and (max_wait < 0 or backend is not None):
+            raise ValueError(f"max_wait should be non-negative number and requires local bucket, got {max_wait}")
+        self.clock: Clock = REAL_CLOCK if clock is None else clock
         self.max_size: int = max_size
         self.active_slots: int = max_size  # number of active slots at the moment
         self.recovery_time: float = recovery_time
-        self.rest_time: float = rest_time
+        self.rest_time: float = rest_time  # not used anymore, waiters are woken up by _reactivate_slots
         # used to signal "external" workers that bucket is "empty"
         self.event_bucket_empty: asyncio.Event = asyncio.Event()
         # separate asyncio task to return bucket to full size
         self.reactivate_task: Optional[asyncio.Task[Any]] = None
         self.callback: Optional[Callable[..., Any]] = callback
+        self.algorithm: str = algorithm
+        self.name: str = name  # key of the bucket in the storage backend
+        self._backend: Optional[StorageBackendABC] = backend
+        # lazily refilled bucket, is used instead of self.active_slots and self.reactivate_task
+        self._bucket: Optional[Union[LazyBucket, BackendBucket]] = None
+        if backend is not None:
+            self._bucket = BackendBucket(backend, name, max_size, recovery_time)
+        elif algorithm != "fixed_window":
+            self._bucket = lazy_bucket(algorithm, max_size, recovery_time, self.clock.monotonic(), burst)
+        # queue of coroutines which wait for free slots, every item is (number of slots, future)
+        self._waiters: WaitQueue[Tuple[int, "asyncio.Future[None]"]] = WaitQueue(aging, self.clock.monotonic)
+        self._queued_cost: int = 0  # total number of slots the waiters wait for
+        # local queue of waiters for their turn to take tokens from the storage backend
+        self._backend_waiters: WaitQueue["asyncio.Future[None]"] = WaitQueue(aging, self.clock.monotonic)
+        self._backend_busy: bool = False  # someone waits for tokens of the storage backend
+        # timer which wakes up the first waiter when lazily refilled bucket has tokens for it
+        self._wakeup_handle: Optional[asyncio.TimerHandle] = None
+        self._next_refill: float = math.inf  # time of the next refill by self.reactivate_task
+        self.max_concurrency: Optional[int] = max_concurrency
+        self.in_flight: int = 0  # number of calls in progress, is counted only if max_concurrency is set
+        self.adaptive: Optional[AdaptiveRate] = adaptive
+        self.on_call: Optional[Callable[[CallStats], Any]] = on_call  # can return awaitable
+        self.max_waiters: Optional[int] = max_waiters
+        self.max_wait: Optional[float] = max_wait
+        self.retry: Optional[RetryPolicy] = retry
+        self.metrics: LimiterMetrics = LimiterMetrics()
+        if retry is not None:
+            retry.attach(max_size / recovery_time, max_size, self.clock.monotonic())
+        if adaptive is not None and isinstance(self._bucket, TokenBucket):
+            self._bucket.set_rate(self.clock.monotonic(), adaptive.attach(self._bucket.rate))
+
+    def _decrement(self, cost: int = 1) -> None:
+        if self._bucket is not None:
+            self._bucket.consume(self.clock.monotonic(), cost)
+            return
+        self.active_slots = max(self.active_slots - cost, 0)
+        if self.active_slots == 0:
+            self.event_bucket_empty.clear()
+
+    def _wait_time(self, cost: int = 1) -> float:
+        """Returns time to wait until cost slots are available, 0.0 - right now, inf - limiter is not activated."""
+        if self._bucket is not None:
+            return self._bucket.wait_time(self.clock.monotonic(), cost)
+        if self.event_bucket_empty.is_set() and self.active_slots >= cost:
+            return 0.0
+        # refill can be a bit late, do not let waiters spin
+        return max(self._next_refill - self.clock.monotonic(), MIN_WAIT_TIME)
+
+    def _try_take(self, cost: int = 1) -> float:
+        """Takes cost slots if they are available, otherwise returns time to wait for them."""
+        if self._bucket is not None:
+            return self._bucket.take(self.clock.monotonic(), cost)
+        wait = self._wait_time(cost)
+        if not wait:
+            self._decrement(cost)
+        return wait
+
+    def _try_admit(self, cost: int) -> float:
+        """
+        Takes cost slots and concurrency slot if both are available, otherwise returns time to wait for them.
+        Zero cost takes only concurrency slot.
+        """
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return math.inf  # waiters are woken up by release
+        wait = self._try_take(cost) if cost else 0.0
+        if not wait and self.max_concurrency is not None:
+            self.in_flight += 1
+        return wait
 
-    def _decrement(self) -> None:
-        if self.active_slots > 0:
-            self.active_slots -= 1
+    def _estimate_wait(self, cost: int) -> float:
+        """Returns time to wait until cost slots are refilled, cost can be greater than max_size."""
+        if self._bucket is not None:
+            return self._bucket.wait_time(self.clock.monotonic(), cost)
+        if self.event_bucket_empty.is_set() and self.active_slots >= cost:
+            return 0.0
+        refills = math.ceil(cost / self.max_size)
+        return max(self._next_refill - self.clock.monotonic(), 0.0) + (refills - 1) * self.recovery_time
+
+    def _release_slot(self, cost: int = 1) -> None:
+        """Returns unused slots back to the bucket."""
+        if self._bucket is not None:
+            self._bucket.refund(self.clock.monotonic(), cost)
+        else:
+            self.active_slots = min(self.max_size, self.active_slots + cost)
+            self.event_bucket_empty.set()
+        self._wake_waiters()
+
+    def _schedule_wakeup(self, wait: float) -> None:
+        if self._wakeup_handle is None and wait != math.inf:
+            self._wakeup_handle = asyncio.get_event_loop().call_later(wait, self._on_wakeup)
+
+    def _reschedule_wakeup(self) -> None:
+        """Cancels the timer of the first waiter and hands over free slots again, e.g. the first waiter is changed."""
+        if self._wakeup_handle is not None:
+            self._wakeup_handle.cancel()
+            self._wakeup_handle = None
+        self._wake_waiters()
+
+    def _on_wakeup(self) -> None:
+        self._wakeup_handle = None
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        """Hands over free slots to the waiting coroutines in FIFO order."""
+        while self._waiters:
+            cost, waiter = self._waiters.head()
+            if waiter.done():  # waiter could be cancelled while it was in the queue
+                self._waiters.popleft()
+                continue
+            wait = self._try_admit(cost)
+            if wait:
+                self._schedule_wakeup(wait)
+                return
+            self._waiters.popleft()
+            self._queued_cost -= cost
+            waiter.set_result(None)
 
     async def _reactivate_slots(self) -> None:
         while True:
+            self._next_refill = self.clock.monotonic() + self.recovery_time
             await asyncio.sleep(self.recovery_time)
             self.active_slots = self.max_size
             self.event_bucket_empty.set()
+            self.metrics.refills += 1
+            self._wake_waiters()
+
+    async def acquire(
+        self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None, deadline: Optional[float] = None
+    ) -> None:
+        if cost > self.max_size:
+            raise ValueError(f"cost {cost} is greater than max_size {self.max_size}, it can not be acquired")
+        until = self._deadline(timeout, deadline)
+        if self._backend is None:
+            self.metrics.grant(cost, await self._admit(cost, priority, until))
+            return
+        waited = 0.0
+        if self.max_concurrency is not None:
+            # concurrency slot is taken before tokens of the storage backend
+            waited = await self._admit(0, priority, until)
+        try:
+            waited += await self._acquire_from_backend(self._backend, cost, priority, until)
+        except BaseException:
+            self.release()
+            raise
+        self.metrics.grant(cost, waited)
+
+    def _deadline(self, timeout: Optional[float], deadline: Optional[float]) -> float:
+        """Returns the earlier of deadline and now + timeout, inf if both are None."""
+        if timeout is not None:
+            moment = self.clock.monotonic() + timeout
+            return moment if deadline is None else min(moment, deadline)
+        return math.inf if deadline is None else deadline
+
+    def _shed(self, cost: int, deadline: float, waiters: int) -> None:
+        """
+        Raises if the caller who should wait for cost slots behind waiters others is rejected right away:
+        AcquireTimeoutError - deadline has passed, LimiterOverloadedError - max_waiters or max_wait is exceeded.
+        """
+        if deadline <= self.clock.monotonic():
+            self.metrics.timed_out += 1
+            raise AcquireTimeoutError(f"{cost} slots of limiter {self.name!r} are not available before the deadline")
+        if self.max_waiters is not None and waiters >= self.max_waiters:
+            self.metrics.shed += 1
+            raise LimiterOverloadedError(f"{waiters} callers already wait for slots of limiter {self.name!r}")
+        if self.max_wait is not None:
+            wait = self._estimate_wait(self._queued_cost + cost)
+            if wait > self.max_wait:
+                self.metrics.shed += 1
+                raise LimiterOverloadedError(
+                    f"estimated wait {wait:.3f} is longer than max_wait {self.max_wait} of limiter {self.name!r}"
+                )
+
+    def _expire(self, waiter: "asyncio.Future[None]") -> None:
+        """Is called at the deadline of the waiter."""
+        if not waiter.done():
+            self.metrics.timed_out += 1
+            waiter.set_exception(AcquireTimeoutError(f"slots of limiter {self.name!r} were not acquired in time"))
+
+    async def _admit(self, cost: int, priority: int, deadline: float = math.inf) -> float:
+        """
+        Waits in the queue until cost slots and concurrency slot are available and takes them.
+        :return: time the caller waited, 0.0 if the slots were taken right away.
+        """
+        wait = 0.0
+        if not self._waiters:  # if nobody waits and bucket is not empty do work
+            wait = self._try_admit(cost)
+            if not wait:
+                return 0.0
+        self._shed(cost, deadline, len(self._waiters))
+        if wait:
+            self._schedule_wakeup(wait)
+
+        queued_at = self.clock.monotonic()
+        loop = asyncio.get_event_loop()
+        waiter: "asyncio.Future[None]" = loop.create_future()
+        self._waiters.append((cost, waiter), priority)
+        self._queued_cost += cost
+        if len(self._waiters) > 1 and self._waiters.head()[1] is waiter:
+            self._reschedule_wakeup()  # the waiter overtook the others, it can wait less than the previous first one
+        timer = None if deadline == math.inf else loop.call_at(deadline, self._expire, waiter)
+        try:
+            await waiter
+        except BaseException:  # cancelled or timed out
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # slots were handed over right before cancellation, return them back to the bucket
+                if cost:
+                    self._release_slot(cost)
+                self.release()
+            else:
+                self._queued_cost -= cost
+                if self._waiters.remove((cost, waiter)):  # the first waiter could be removed
+                    self._reschedule_wakeup()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        return self.clock.monotonic() - queued_at
 
-    async def wrap_operation(self, func: AsyncFuncType, *args: Any, **kwargs: Any) -> Any:
+    async def _acquire_from_backend(
+        self, backend: StorageBackendABC, cost: int, priority: int, deadline: float = math.inf
+    ) -> float:
+        """
+        Takes cost tokens from the storage backend with async call. Waiters are queued locally,
+        only the first one calls the backend and sleeps until the backend has tokens for it.
+        AcquireTimeoutError is raised right away if the backend tokens are not refilled before the deadline.
+        :return: time the caller waited, 0.0 if the tokens were taken right away.
+        """
+        key, max_size, recovery_time = self.name, self.max_size, self.recovery_time
+        ready_at = 0.0  # tokens are not available before the time
+        if not self._backend_busy:  # if nobody waits try to take tokens right now
+            wait = await backend.aupdate(key, max_size, recovery_time, cost, "try")
+            if not wait:
+                return 0.0
+            ready_at = self.clock.monotonic() + wait
+        self._shed(cost, deadline, len(self._backend_waiters) + self._backend_busy)
+        queued_at = self.clock.monotonic()
+        if not self._backend_busy:
+            self._backend_busy = True
+        else:
+            loop = asyncio.get_event_loop()
+            waiter: "asyncio.Future[None]" = loop.create_future()
+            self._backend_waiters.append(waiter, priority)
+            timer = None if deadline == math.inf else loop.call_at(deadline, self._expire, waiter)
+            try:
+                await waiter  # _pass_backend_turn gives us the turn
+            except BaseException:  # cancelled or timed out
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    self._pass_backend_turn()
+                else:
+                    self._backend_waiters.remove(waiter)
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+        try:
+            while True:
+                if ready_at > self.clock.monotonic():
+                    if ready_at > deadline:
+                        self.metrics.timed_out += 1
+                        raise AcquireTimeoutError(
+                            f"tokens of limiter {self.name!r} are not refilled in storage backend before the deadline"
+                        )
+                    await asyncio.sleep(ready_at - self.clock.monotonic())
+                wait = await backend.aupdate(key, max_size, recovery_time, cost, "try")
+                if not wait:
+                    return self.clock.monotonic() - queued_at
+                ready_at = self.clock.monotonic() + wait
+        finally:
+            self._pass_backend_turn()
+
+    def _pass_backend_turn(self) -> None:
+        """Gives the turn to take tokens from the storage backend to the next waiter."""
+        while self._backend_waiters:
+            waiter = self._backend_waiters.popleft()
+            if not waiter.done():  # waiter could be cancelled while it was in the queue
+                waiter.set_result(None)
+                return
+        self._backend_busy = False
+
+    def _check_sync_call(self, method: str) -> None:
+        """Sync call to the storage backend would block the event loop, async method should be used instead."""
+        if self._backend is not None:
+            raise RuntimeError(f"{method} of limiter with storage backend blocks the event loop, use a{method}")
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        self._check_sync_call("try_acquire")
+        if not self._waiters and not self._try_admit(cost):
+            self.metrics.grant(cost, 0.0)
+            return True
+        self.metrics.rejected += 1
+        return False
+
+    async def atry_acquire(self, cost: int = 1) -> bool:
+        if self._backend is None:
+            return self.try_acquire(cost)
+        if self._waiters or self._backend_busy or self._try_admit(0):
+            self.metrics.rejected += 1
+            return False
+        if not await self._backend.aupdate(self.name, self.max_size, self.recovery_time, cost, "try"):
+            self.metrics.grant(cost, 0.0)
+            return True
+        self.release()  # concurrency slot
+        self.metrics.rejected += 1
+        return False
+
+    @property
+    def rate(self) -> float:
+        if isinstance(self._bucket, TokenBucket):
+            return self._bucket.rate
+        return self.max_size / self.recovery_time
+
+    def _adapt(self, started: float, exc: Optional[BaseException] = None, result: Any = None) -> None:
+        """Updates the rate by the outcome of the call if adaptive rate is used."""
+        if self.adaptive is None or not isinstance(self._bucket, TokenBucket):
+            return
+        now = self.clock.monotonic()
+        rate = self.adaptive.observe(started, now, exc, result)
+        if rate is None:
+            return
+        self._bucket.set_rate(now, rate)
+        self._reschedule_wakeup()  # the first waiter waits for tokens at the old rate
+
+    def release(self) -> None:
+        if self.max_concurrency is None:
+            return
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.metrics.snapshot()
+        stats.update(
+            name=self.name,
+            waiters=len(self._waiters) + len(self._backend_waiters),
+            queued_slots=self._queued_cost,
+            in_flight=self.in_flight,
+            rate=self.rate,
+        )
+        return stats
+
+    def reserve(self, cost: int = 1) -> float:
+        self._check_sync_call("reserve")
+        return self._estimate_wait(self._queued_cost + cost)
+
+    async def areserve(self, cost: int = 1) -> float:
+        if self._backend is None:
+            return self.reserve(cost)
+        return await self._backend.aupdate(self.name, self.max_size, self.recovery_time, cost, "peek")
+
+    def slot(self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None) -> _AsyncSlot:
+        return _AsyncSlot(self, cost, priority, timeout)
+
+    async def wrap_operation(
+        self,
+        func: AsyncFuncType,
+        *args: Any,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Any:
+        return await self._retry_call(self.retry, func, args, kwargs, cost, priority, acquire_timeout)
+
+    async def _retry_call(
+        self,
+        retry: Optional[RetryPolicy],
+        func: AsyncFuncType,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        cost: CostType,
+        priority: int,
+        acquire_timeout: Optional[float],
+    ) -> Any:
+        """Acquires the slots and makes the call, the failed call is retried by retry policy."""
+        slots = cost(*args, **kwargs) if callable(cost) else cost
+        attempt = 1
         while True:
-            if self.event_bucket_empty.is_set():  # if bucket is not empty do work
-                if self.active_slots == 0:
-                    self.event_bucket_empty.clear()
+            requested = self.clock.monotonic()
+            await self.acquire(slots, priority=priority, timeout=acquire_timeout)
+            try:
+                return await self._call(requested, slots, func, *args, **kwargs)
+            except Exception as exc:
+                if retry is None or not retry.should_retry(attempt, exc, self.clock.monotonic()):
+                    raise
+                delay = retry.backoff(attempt)
+            self.metrics.retried += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _call(self, requested: float, cost: int, func: AsyncFuncType, *args: Any, **kwargs: Any) -> Any:
+        """Makes the call which already got its slots, requested is the time the slots were requested at."""
+        started = self.clock.monotonic()
+        error: Optional[BaseException] = None
+        try:
+            res = await func(*args, **kwargs)
+        except BaseException as exc:
+            error = exc
+            if isinstance(exc, Exception):
+                self._adapt(started, exc=exc)
+            raise
+        finally:
+            self.release()
+            if self.on_call is not None:
+                outcome = self.on_call(CallStats(cost, started - requested, self.clock.monotonic() - started, error))
+                if inspect.isawaitable(outcome):
+                    await outcome
+        self._adapt(started, result=res)
+        if self.callback is not None:
+            self.callback()
+        return res
+
+    def map(
+        self,
+        func: AsyncFuncType,
+        iterable: Union[Iterable[Any], AsyncIterable[Any]],
+        *,
+        concurrency: Optional[int] = None,
+        cost: CostType = 1,
+        priority: int = 0,
+    ) -> AsyncIterator[Any]:
+        return self._pipeline(func, iterable, self._pipeline_limit(concurrency), cost, priority, ordered=True)
+
+    def as_completed(
+        self,
+        func: AsyncFuncType,
+        iterable: Union[Iterable[Any], AsyncIterable[Any]],
+        *,
+        concurrency: Optional[int] = None,
+        cost: CostType = 1,
+        priority: int = 0,
+    ) -> AsyncIterator[Any]:
+        return self._pipeline(func, iterable, self._pipeline_limit(concurrency), cost, priority, ordered=False)
+
+    def _pipeline_limit(self, concurrency: Optional[int]) -> int:
+        limit = concurrency or self.max_concurrency or self.max_size
+        if limit < 1:
+            raise ValueError(f"concurrency should be positive integer number, got {concurrency}")
+        return limit
+
+    async def _pipeline(
+        self,
+        func: AsyncFuncType,
+        iterable: Union[Iterable[Any], AsyncIterable[Any]],
+        limit: int,
+        cost: CostType,
+        priority: int,
+        ordered: bool,
+    ) -> AsyncIterator[Any]:
+        """Runs func for the items with at most limit calls in progress and yields the results."""
+        self.activate()
+        items = _aiterate(iterable)
+        pending: Deque["asyncio.Future[Any]"] = deque()  # calls in the order of the items, or finished calls
+        running: Set["asyncio.Future[Any]"] = set()  # calls which are not finished, is used if not ordered
+        exhausted = False
+        try:
+            while True:
+                # backpressure: the next item is pulled only when the result of the previous one is taken
+                while not exhausted and len(pending) + len(running) < limit:
+                    try:
+                        item = await items.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    call: "asyncio.Future[Any]" = asyncio.ensure_future(
+                        self.wrap_operation(func, item, cost=cost, priority=priority)
+                    )
+                    if ordered:
+                        pending.append(call)
+                    else:
+                        running.add(call)
+                if ordered:
+                    if not pending:
+                        return
+                    yield await pending.popleft()
                 else:
-                    self._decrement()
-                    res = await func(*args, **kwargs)
-                    if self.callback is not None:
-                        self.callback()
-                    return res
-            else:
-                await asyncio.sleep(self.rest_time)
+                    if not running:
+                        return
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    pending.extend(done)
+                    while pending:
+                        yield pending.popleft().result()
+        finally:
+            for call in (*pending, *running):
+                if call.done() and not call.cancelled():
+                    call.exception()  # the result is not needed anymore, do not let asyncio log the exception
+                else:
+                    call.cancel()
 
     def activate(self) -> None:
+        if self._bucket is not None:  # lazily refilled bucket does not need any background task
+            return
         if self.reactivate_task is None:  # prevents creation of several activate tasks
-            self.event_bucket_empty.set()  # set event flag that bucket is ready
+            if self.active_slots > 0:
+                self.event_bucket_empty.set()  # set event flag that bucket is ready
+            self._next_refill = self.clock.monotonic() + self.recovery_time
             self.reactivate_task = asyncio.ensure_future(self._reactivate_slots())
+            self._wake_waiters()  # someone could start to wait before activation
 
     def deactivate(self) -> None:
         if self.reactivate_task is not None:
@@ -61,12 +614,35 @@ class AsyncioBucketTimeRateLimiter(BucketTimeRateLimiterABC, AsyncTimeRateLimite
                     self.reactivate_task.cancel()
                 except asyncio.CancelledError:  # pragma: no cover
                     pass
+            self.reactivate_task = None  # activate can start the task again
+            self._next_refill = math.inf  # the bucket is not refilled anymore
+
+    def __call__(
+        self,
+        f: Optional[AsyncFuncType] = None,
+        *,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        retry: Optional[RetryPolicy] = None,
+        cache: Optional[CallCache] = None,
+    ) -> Any:
+        if f is None:  # decorator is used with params, e.g. @limiter(cost=5)
+            return partial(
+                self.__call__, cost=cost, priority=priority, acquire_timeout=acquire_timeout, retry=retry, cache=cache
+            )
+        if retry is None:
+            retry = self.retry
+        else:
+            retry.attach(self.max_size / self.recovery_time, self.max_size, self.clock.monotonic())
 
-    def __call__(self, f: AsyncFuncType) -> AsyncFuncType:
         @wraps(f)
         async def wrapper(*args: Any, **kwargs: Any) -> Any:
             self.activate()
-            return await self.wrap_operation(f, *args, **kwargs)
+            if cache is None:
+                return await self._retry_call(retry, f, args, kwargs, cost, priority, acquire_timeout)
+            call = partial(self._retry_call, retry, f, args, kwargs, cost, priority, acquire_timeout)
+            return await cache.acall(call, args, kwargs, self.clock.monotonic)
 
         return wrapper
 
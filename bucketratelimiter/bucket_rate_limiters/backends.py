@@ -0,0 +1,362 @@
+import os
+import threading as th
+from typing import Any, Dict, List, Optional, Tuple
+
+from .algorithms import EPSILON, TokenBucket
+from .bucket_abc import StorageBackendABC
+from .clock import REAL_CLOCK, Clock
+from .process_bucket import SharedBucketFile, _file_name, default_directory
+
+
+class InMemoryBackend(StorageBackendABC):
+    """Keeps buckets in memory of the process, can be shared by limiters of the process."""
+
+    def __init__(self, clock: Optional[Clock] = None) -> None:
+        """:param clock: source of time, e.g. VirtualClock in tests, by default the real monotonic clock."""
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.sync_lock = th.Lock()
+        self.clock: Clock = REAL_CLOCK if clock is None else clock
+
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        now = self.clock.monotonic()
+        with self.sync_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(max_size, recovery_time, now)
+            if cost < 0:
+                bucket.refund(now, -cost)
+                return 0.0
+            if mode == "try":
+                return bucket.take(now, cost)
+            wait = bucket.wait_time(now, cost)
+            if mode == "reserve":
+                bucket.tokens -= cost
+            return wait
+
+
+class SharedMemoryBackend(StorageBackendABC):
+    """
+    Keeps buckets in memory mapped files (one file per key), so buckets are shared by all the processes
+    on the host which use the same directory. Requires POSIX file locks (fcntl).
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        """:param directory: directory of the files which keep buckets, /dev/shm or temp directory by default."""
+        self.directory: str = directory or default_directory()
+        self._files: Dict[str, SharedBucketFile] = {}
+        self.sync_lock = th.Lock()
+
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        shared = self._files.get(key)
+        if shared is None:
+            with self.sync_lock:
+                shared = self._files.get(key)
+                if shared is None:
+                    path = os.path.join(self.directory, _file_name(key))
+                    shared = self._files[key] = SharedBucketFile(path, max_size, recovery_time)
+        return shared.update(cost, mode)
+
+    def close(self) -> None:
+        """Closes all the opened files, the files are kept for other processes."""
+        with self.sync_lock:
+            for shared in self._files.values():
+                shared.close()
+            self._files.clear()
+
+
+# KEYS[1] - key of the bucket, ARGV - max_size, number of tokens per second, cost, mode.
+# Time of Redis server is used, so the clock is the same for all the hosts.
+# Float numbers are returned as strings, otherwise Redis truncates them to integers.
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+-- Redis < 5 requires the call to write data after TIME command
+pcall(redis.replicate_commands)
+local max_size = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local mode = ARGV[4]
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(state[1])
+local last = tonumber(state[2])
+if tokens == nil then
+    tokens = max_size
+    last = now
+end
+if now > last then
+    tokens = math.min(max_size, tokens + (now - last) * rate)
+    last = now
+end
+local wait = 0
+if tokens + 1e-9 < cost then
+    wait = (cost - tokens) / rate
+end
+if mode == 'peek' then
+    return tostring(wait)
+end
+if mode == 'reserve' or wait == 0 then
+    tokens = math.min(max_size, tokens - cost)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(last))
+-- the key is not needed when the bucket is full again
+redis.call('PEXPIRE', KEYS[1], math.ceil((max_size - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBackend(StorageBackendABC):
+    """
+    Keeps buckets in Redis, so buckets are shared by all the hosts which use the Redis server.
+    Every update is one round-trip: Lua script refills and takes tokens atomically on Redis server.
+    Works with redis-py clients (pip install redis), sync client is used by sync methods of the limiters,
+    async client (redis.asyncio.Redis) is used by asyncio limiters.
+    """
+
+    def __init__(self, client: Any = None, async_client: Any = None, prefix: str = "bucketratelimiter:") -> None:
+        """
+        :param client: redis.Redis instance or compatible client.
+        :param async_client: redis.asyncio.Redis instance or compatible client.
+        :param prefix: prefix of Redis keys.
+        """
+        if client is None and async_client is None:
+            raise ValueError("At least one of client and async_client is required")
+        self.prefix: str = prefix
+        self.client: Any = client
+        self.async_client: Any = async_client
+        self._script: Any = None if client is None else client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+        self._async_script: Any = None
+        if async_client is not None:
+            self._async_script = async_client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+
+    def _args(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> Dict[str, Any]:
+        return {"keys": [self.prefix + key], "args": [max_size, repr(max_size / recovery_time), cost, mode]}
+
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        if self._script is None:
+            raise RuntimeError("RedisBackend was created without sync client")
+        return float(self._script(**self._args(key, max_size, recovery_time, cost, mode)))
+
+    async def aupdate(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        if self._async_script is None:
+            return self.update(key, max_size, recovery_time, cost, mode)
+        return float(await self._async_script(**self._args(key, max_size, recovery_time, cost, mode)))
+
+
+class _Lease:
+    """Tokens which are leased from the shared backend and are served locally."""
+
+    __slots__ = ("tokens", "expires_at", "size", "max_size", "recovery_time")
+
+    def __init__(self, size: int, max_size: int, recovery_time: float) -> None:
+        self.tokens: int = 0
+        self.expires_at: float = 0.0
+        self.size: int = size  # number of tokens to lease next time
+        self.max_size: int = max_size
+        self.recovery_time: float = recovery_time
+
+
+class LeasingBackend(StorageBackendABC):
+    """
+    Leases tokens from the shared backend (e.g. RedisBackend) in blocks and serves them locally,
+    so most of the calls do not need round-trip to the shared backend.
+    Lease size adapts to the local consumption rate: it is doubled (up to max_lease) when the lease is
+    consumed before it expires and is halved (down to min_lease) when the lease expires with unused tokens.
+    Unused tokens are returned to the shared backend when the lease expires (on the next call for the key)
+    or when close is called. Leased tokens are taken from the shared bucket, so the global limit is never
+    exceeded, other hosts can only wait longer for tokens which are leased but not used yet,
+    at most max_lease tokens per key for lease_ttl seconds.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackendABC,
+        min_lease: int = 1,
+        max_lease: int = 50,
+        lease_ttl: float = 1.0,
+        clock: Optional[Clock] = None,
+    ) -> None:
+        """
+        :param backend: shared backend to lease tokens from.
+        :param min_lease: min number of tokens to lease at once.
+        :param max_lease: max number of tokens to lease at once, it is also limited by max_size of the bucket.
+        :param lease_ttl: time in seconds after which unused leased tokens are returned to the shared backend.
+        :param clock: source of time of the lease expiration, by default the real monotonic clock.
+        """
+        self.backend: StorageBackendABC = backend
+        self.min_lease: int = min_lease
+        self.max_lease: int = max_lease
+        self.lease_ttl: float = lease_ttl
+        self.clock: Clock = REAL_CLOCK if clock is None else clock
+        self._leases: Dict[str, _Lease] = {}
+        self.sync_lock = th.Lock()
+
+    def _serve_locally(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> Tuple[bool, int]:
+        """
+        Serves the call from the local lease if it has enough tokens.
+        :return: (the call is served, number of expired tokens which should be returned to the shared backend).
+        """
+        now = self.clock.monotonic()
+        with self.sync_lock:
+            lease = self._leases.get(key)
+            if lease is None:
+                lease = self._leases[key] = _Lease(self.min_lease, max_size, recovery_time)
+            expired = 0
+            if lease.tokens > 0 and now >= lease.expires_at:
+                expired, lease.tokens = lease.tokens, 0
+                lease.size = max(self.min_lease, lease.size // 2)  # the lease was too big
+            if cost < 0:  # refunded tokens can be used locally
+                lease.tokens -= cost
+                lease.expires_at = now + self.lease_ttl
+                return True, expired
+            if lease.tokens >= cost:
+                if mode != "peek":
+                    lease.tokens -= cost
+                return True, expired
+            return False, expired
+
+    def _plan(self, key: str, max_size: int, cost: int, mode: str) -> Tuple[int, int, int]:
+        """
+        Takes local tokens of the lease for the call which needs more of them, so other calls do not spend
+        them while the call asks the shared backend for the rest. Peek takes nothing.
+        :return: (number of taken local tokens, number of tokens the call needs from the shared backend,
+        number of tokens to lease).
+        """
+        with self.sync_lock:
+            lease = self._leases[key]
+            needed = cost - lease.tokens
+            taken = 0 if mode == "peek" else lease.tokens
+            lease.tokens -= taken
+            return taken, needed, max(needed, min(lease.size, self.max_lease, max_size))
+
+    def _store(self, key: str, leased: int, needed: int, grow: bool) -> None:
+        """
+        Adds leased tokens which are left after the call took needed ones to the local lease.
+        :param grow: the lease was consumed before it expired, so the next one can be bigger.
+        """
+        with self.sync_lock:
+            lease = self._leases[key]
+            if grow:
+                lease.size = min(self.max_lease, lease.size * 2)
+            lease.tokens += leased - needed
+            lease.expires_at = self.clock.monotonic() + self.lease_ttl
+
+    def _give_back(self, key: str, taken: int) -> None:
+        """Returns local tokens which were taken by _plan for the call which did not get the rest of them."""
+        with self.sync_lock:
+            self._leases[key].tokens += taken
+
+    def _available(self, key: str, lease_size: int, needed: int, wait: float, rate: float) -> Tuple[int, float]:
+        """
+        Uses wait time of the failed lease to find out number of tokens in the shared bucket,
+        so the call does not need extra round-trip if there are not enough tokens.
+        The lease size is halved, so the calls do not fail leases while the shared bucket is exhausted.
+        :return: (number of tokens to take from the shared backend, wait time for the needed tokens or 0.0).
+        """
+        with self.sync_lock:
+            lease = self._leases[key]
+            lease.size = max(self.min_lease, lease.size // 2)
+        available = lease_size - wait * rate
+        if available + EPSILON < needed:
+            return needed, (needed - available) / rate
+        return max(needed, int(available + EPSILON)), 0.0
+
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        served, expired = self._serve_locally(key, max_size, recovery_time, cost, mode)
+        if expired:
+            self.backend.update(key, max_size, recovery_time, -expired, "reserve")
+        if served:
+            return 0.0
+        taken, needed, lease_size = self._plan(key, max_size, cost, mode)
+        try:
+            leased = needed
+            if mode == "try":
+                wait = self.backend.update(key, max_size, recovery_time, lease_size, "try")
+                if not wait:
+                    self._store(key, lease_size, needed, grow=True)
+                    return 0.0
+                # not enough tokens for the whole lease, so take only the available ones if the call needs less
+                leased, wait = self._available(key, lease_size, needed, wait, max_size / recovery_time)
+                if wait:
+                    self._give_back(key, taken)
+                    return wait
+            wait = self.backend.update(key, max_size, recovery_time, leased, mode)
+        except BaseException:
+            self._give_back(key, taken)
+            raise
+        return self._finish(key, taken, leased, needed, mode, wait)
+
+    async def aupdate(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        served, expired = self._serve_locally(key, max_size, recovery_time, cost, mode)
+        if expired:
+            await self.backend.aupdate(key, max_size, recovery_time, -expired, "reserve")
+        if served:
+            return 0.0
+        taken, needed, lease_size = self._plan(key, max_size, cost, mode)
+        try:
+            leased = needed
+            if mode == "try":
+                wait = await self.backend.aupdate(key, max_size, recovery_time, lease_size, "try")
+                if not wait:
+                    self._store(key, lease_size, needed, grow=True)
+                    return 0.0
+                # not enough tokens for the whole lease, so take only the available ones if the call needs less
+                leased, wait = self._available(key, lease_size, needed, wait, max_size / recovery_time)
+                if wait:
+                    self._give_back(key, taken)
+                    return wait
+            wait = await self.backend.aupdate(key, max_size, recovery_time, leased, mode)
+        except BaseException:
+            self._give_back(key, taken)
+            raise
+        return self._finish(key, taken, leased, needed, mode, wait)
+
+    def _finish(self, key: str, taken: int, leased: int, needed: int, mode: str, wait: float) -> float:
+        """Keeps the result of the last round-trip to the shared backend and returns its wait time."""
+        if mode == "reserve" or (mode == "try" and not wait):
+            self._store(key, leased, needed, grow=False)
+        else:
+            self._give_back(key, taken)
+        return wait
+
+    def _drain(self) -> List[Tuple[str, _Lease, int]]:
+        with self.sync_lock:
+            drained = [(key, lease, lease.tokens) for key, lease in self._leases.items() if lease.tokens > 0]
+            for _, lease, _ in drained:
+                lease.tokens = 0
+            return drained
+
+    def close(self) -> None:
+        """Returns all unused leased tokens to the shared backend."""
+        for key, lease, tokens in self._drain():
+            self.backend.update(key, lease.max_size, lease.recovery_time, -tokens, "reserve")
+
+    async def aclose(self) -> None:
+        """Returns all unused leased tokens to the shared backend with async calls."""
+        for key, lease, tokens in self._drain():
+            await self.backend.aupdate(key, lease.max_size, lease.recovery_time, -tokens, "reserve")
+
+
+class BackendBucket:
+    """Gives TokenBucket interface to the bucket which is kept in the storage backend."""
+
+    __slots__ = ("backend", "key", "max_size", "recovery_time")
+
+    def __init__(self, backend: StorageBackendABC, key: str, max_size: int, recovery_time: float) -> None:
+        self.backend = backend
+        self.key = key
+        self.max_size = max_size
+        self.recovery_time = recovery_time
+
+    # "now" is not used, the backend uses its own clock
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        return self.backend.update(self.key, self.max_size, self.recovery_time, int(cost), "peek")
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        self.backend.update(self.key, self.max_size, self.recovery_time, int(cost), "reserve")
+
+    def take(self, now: float, cost: float = 1) -> float:
+        return self.backend.update(self.key, self.max_size, self.recovery_time, int(cost), "try")
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        self.backend.update(self.key, self.max_size, self.recovery_time, -int(cost), "reserve")
@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Dict, Optional, Union
+
+# number of slots the call takes, or function which receives call args and kwargs and returns the number
+CostType = Union[int, Callable[..., int]]
 
 
 class BucketTimeRateLimiterABC(ABC):
@@ -10,6 +13,18 @@ class BucketTimeRateLimiterABC(ABC):
         recovery_time: float,
         rest_time: float,
         callback: Optional[Callable[..., Any]],
+        algorithm: Optional[str],
+        backend: Optional["StorageBackendABC"],
+        name: str,
+        max_concurrency: Optional[int],
+        adaptive: Optional[Any],
+        aging: Optional[float],
+        on_call: Optional[Callable[..., Any]],
+        clock: Optional[Any],
+        burst: Optional[int],
+        max_waiters: Optional[int],
+        max_wait: Optional[float],
+        retry: Optional[Any],
     ) -> None:
         """
         BucketRateLimiter is used to limit number of "simultaneous" operations to the specified number.
@@ -21,16 +36,118 @@ class BucketTimeRateLimiterABC(ABC):
         e.g. API allows you to make 4 requests per second, hereby max_size = 4
         :param recovery_time: time in seconds to recover Bucket to full size.
         e.g. API allows to make 4 requests per second, hereby recovery_time = 1.0
-        :param rest_time: time to give "workers" who use bucket to sleep if bucket is empty at the moment.
+        :param rest_time: kept for backward compatibility and is not used anymore.
+        "Workers" who use bucket when it is empty wait in FIFO queue and are woken up right after the refill.
         BucketRateLimiter deliberately does not use any internal pool of workers to make
         it responsibility of user how to implement "workers"
         :param callback: not "awaitable" function which is called when any of workers have finished task.
+        :param algorithm: "fixed_window" - bucket is refilled to full size every recovery_time by background
+        asyncio task or thread, which is started by activate method.
+        "token_bucket" - bucket is refilled lazily and continuously (max_size tokens per recovery_time) when
+        someone tries to use it, nothing runs in background and the instance does not need activation.
+        Both allow up to 2 * max_size calls in recovery_time around the refill (full bucket plus the refill).
+        "sliding_window_log" - not more than max_size calls in any recovery_time, times of the calls are logged.
+        "sliding_window_counter" - the number of calls in the sliding window is estimated by the counts of
+        the current and the previous fixed windows, the calls of the previous window are assumed to be spread evenly.
+        "gcra" - the same limit as "token_bucket" with one timestamp of state.
+        "leaky_bucket" - pacing: one call every recovery_time / max_size, calls are spread evenly instead of
+        going together after the refill, see burst param.
+        These algorithms do not need activation as well.
+        By default "fixed_window" is used, or "token_bucket" if backend is provided.
+        :param backend: storage of the token bucket, e.g. RedisBackend to share the limit between many hosts.
+        By default the bucket is kept in the limiter instance.
+        :param name: key of the bucket in the storage backend, limiters with the same name share the bucket.
+        :param max_concurrency: max number of calls which are in progress at the same time, e.g. upstream allows
+        4 requests per second, but not more than 2 concurrent connections. A call takes one concurrency slot with
+        the bucket slots and releases it when the call is finished (see release method). The same FIFO queue
+        waits for both limits. By default the number of concurrent calls is not limited.
+        :param adaptive: AdaptiveRate instance which changes the rate (max_size / recovery_time at most)
+        by the outcome of the calls made by wrap_operation or decorator: the rate grows while the calls succeed
+        and is cut when upstream throttles the calls. Requires "token_bucket" algorithm, which is used by default
+        if the param is provided. Not supported with storage backend.
+        :param aging: waiters with lower priority value are served first (see acquire method), aging is time
+        in seconds after which priority of the waiter is improved by one, so low priority waiters are not starved.
+        By default priority of the waiter is not changed while it waits.
+        :param on_call: function which receives CallStats (cost, wait time, call time and exception) of every
+        call made by wrap_operation or decorator when the call is finished, the asyncio limiter awaits the result
+        if it is awaitable. By default only the counters of stats method are updated.
+        :param clock: source of time and sleeps, by default the real monotonic clock. VirtualClock runs the limiter
+        in virtual time, which passes instantly, e.g. in tests. asyncio limiter uses timers of the event loop,
+        so it should run in the event loop of the clock (see VirtualClock.run).
+        :param burst: number of calls "leaky_bucket" lets go together after idle time, by default calls are
+        never sent together. Should not be greater than max_size. Weighted call which costs more than burst
+        goes when the bucket is idle, the following calls wait for its intervals.
+        :param max_waiters: load shedding: max number of callers which wait in the queue, acquire of a new caller
+        which should wait raises LimiterOverloadedError right away. By default the queue is not limited.
+        :param max_wait: load shedding: acquire raises LimiterOverloadedError right away if the caller should wait
+        longer than max_wait seconds, the wait is estimated like reserve method does (priority is not taken
+        into account). Not supported with storage backend. By default the wait is not limited.
+        :param retry: RetryPolicy instance which retries the calls made by wrap_operation or decorator when they
+        fail with the listed exceptions, after backoff with jitter. Every retry takes the slots again, retries can
+        be capped by the retry budget of the policy. By default the calls are not retried.
+        """
+        ...
+
+    @abstractmethod
+    def _decrement(self, cost: int) -> None:
+        """Decrements internal counter self.active_slots by cost (one by default)."""
+        ...
+
+    @abstractmethod
+    def try_acquire(self, cost: int) -> bool:
+        """
+        Takes cost slots (one by default) if they are available right now and nobody waits for slots.
+        Never blocks. If max_concurrency is set, concurrency slot is taken as well (see release method).
+        asyncio limiter with storage backend raises RuntimeError, atry_acquire should be used instead.
+        :return: True if slots were taken, otherwise False.
         """
         ...
 
     @abstractmethod
-    def _decrement(self) -> None:
-        """Decrements internal counter self.active_slots by one."""
+    def reserve(self, cost: int) -> float:
+        """
+        Estimates how long a new call would wait for cost slots (one by default), taking into account
+        slots which are already awaited by others. Slots are not taken.
+        asyncio limiter with storage backend raises RuntimeError, areserve should be used instead.
+        :return: time in seconds, 0.0 means the slots are available right now, inf - limiter is not activated.
+        """
+        ...
+
+    @property
+    @abstractmethod
+    def rate(self) -> float:
+        """Current rate of the limiter in slots per second, it is changed by adaptive rate."""
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns snapshot of the limiter counters: granted acquires and slots, acquires which waited,
+        rejected try_acquire calls, timed out and shed acquires, refills, total wait time and cumulative
+        wait time histogram,
+        and current values: number of waiters, slots they wait for, calls in progress and rate.
+        See prometheus_text function to export them.
+        """
+        ...
+
+    @abstractmethod
+    def release(self) -> None:
+        """
+        Returns concurrency slot which was taken by acquire, when the call is finished.
+        wrap_operation, decorator and slot call it for you (even if the call raises).
+        Does nothing if max_concurrency is not set.
+        """
+        ...
+
+    @abstractmethod
+    def slot(self, cost: int, *, priority: int, timeout: Optional[float]) -> Any:
+        """
+        Returns context manager ("async with" for asyncio limiters, "with" for the others) which
+        activates the limiter and takes cost slots (one by default) with priority (0 by default)
+        and timeout (see acquire method) on enter.
+        Allows to limit a block of code without wrapping it into function.
+        Concurrency slot is released on exit.
+        """
         ...
 
     @abstractmethod
@@ -44,8 +161,28 @@ class BucketTimeRateLimiterABC(ABC):
         ...
 
     @abstractmethod
-    def __call__(self, f: Any) -> Any:
-        """The method is created in order to use BucketRateLimiter instance as decorator."""
+    def __call__(
+        self,
+        f: Any,
+        *,
+        cost: CostType,
+        priority: int,
+        acquire_timeout: Optional[float],
+        retry: Optional[Any],
+        cache: Optional[Any],
+    ) -> Any:
+        """
+        The method is created in order to use BucketRateLimiter instance as decorator.
+        Can be used with params as well, e.g. @limiter(cost=lambda items: len(items)).
+        :param f: function we would like to limit.
+        :param cost: number of slots every call takes, or function which receives the call args and kwargs
+        and returns the number.
+        :param priority: priority of the calls, see acquire method.
+        :param acquire_timeout: max time in seconds every call waits for the slots, see acquire method.
+        :param retry: RetryPolicy of the calls, by default the retry policy of the limiter is used.
+        :param cache: CallCache which shares one call between concurrent identical calls (the same args)
+        and keeps the results for ttl, so duplicate calls take no slots. By default every call takes the slots.
+        """
         ...
 
 
@@ -56,17 +193,79 @@ class AsyncTimeRateLimiterABC(ABC):
         ...
 
     @abstractmethod
-    async def wrap_operation(self, func: Any, *args: Any, **kwargs: Any) -> Any:
+    async def atry_acquire(self, cost: int) -> bool:
+        """The same as try_acquire, but tokens of the storage backend are taken with async call."""
+        ...
+
+    @abstractmethod
+    async def areserve(self, cost: int) -> float:
+        """The same as reserve, but the storage backend is asked with async call."""
+        ...
+
+    @abstractmethod
+    async def acquire(
+        self, cost: int, *, priority: int, timeout: Optional[float], deadline: Optional[float]
+    ) -> None:
+        """
+        Waits until cost slots (one by default) are available and takes them.
+        Waiters are served in priority order, lower value first, waiters with the same priority in FIFO order.
+        The first waiter blocks the others until enough slots are available.
+        If max_concurrency is set, concurrency slot is taken as well and should be returned with release method.
+        :param cost: number of slots to take, e.g. 100 for bulk call of 100 items.
+        :param priority: e.g. 0 for user requests and 10 for background jobs, which wait while users wait.
+        :param timeout: max time in seconds to wait for the slots, AcquireTimeoutError is raised when it passes.
+        The waiter leaves the queue and nothing is taken from the bucket. By default the caller waits until
+        the slots are available.
+        :param deadline: the same as timeout, but it is the moment of the limiter clock (clock.monotonic()),
+        e.g. deadline of the request which is passed through several calls. The earlier of both is used.
+        LimiterOverloadedError is raised right away if the call should wait and max_waiters or max_wait is exceeded.
+        """
+        ...
+
+    @abstractmethod
+    async def wrap_operation(
+        self, func: Any, *args: Any, cost: CostType, priority: int, acquire_timeout: Optional[float], **kwargs: Any
+    ) -> Any:
         """
         Wrapper around some async function which is used in "workers".
         It limits number of attempts to a certain maximum number.
+        The failed call is retried if the limiter has retry policy.
         :param func: async function we would like to limit.
         :param args: this async function args.
+        :param cost: number of slots the call takes (one by default), or function which receives args and kwargs
+        and returns the number. The param is not passed to func.
+        :param priority: priority of the call, see acquire method. The param is not passed to func.
+        :param acquire_timeout: max time in seconds to wait for the slots, see timeout param of acquire method.
+        The param is not passed to func.
         :param kwargs: this async function kwargs.
         :return: returns the same result as func is supposed to return.
         """
         ...
 
+    @abstractmethod
+    def map(self, func: Any, iterable: Any, *, concurrency: Optional[int], cost: CostType, priority: int) -> Any:
+        """
+        Calls func for every item of iterable (sync or async) with wrap_operation and yields results
+        in the order of the items: "async for result in limiter.map(fetch, urls, concurrency=10)".
+        Items are pulled lazily, only when there are less than concurrency calls in progress, so large (or endless)
+        iterables are streamed without building task list or queue. If the call raises, the exception is raised
+        by the iterator and the calls in progress are cancelled.
+        :param func: async function which receives the item.
+        :param iterable: iterable or async iterable of items.
+        :param concurrency: max number of calls in progress (and results not yielded yet), by default
+        max_concurrency or max_size.
+        :param cost: number of slots every call takes, see wrap_operation.
+        :param priority: priority of the calls, see acquire method.
+        """
+        ...
+
+    @abstractmethod
+    def as_completed(
+        self, func: Any, iterable: Any, *, concurrency: Optional[int], cost: CostType, priority: int
+    ) -> Any:
+        """The same as map, but yields results in the order the calls are finished."""
+        ...
+
     @abstractmethod
     async def __aenter__(self) -> Any:
         """Implemented to use the BucketRateLimiter instance as context manager."""
@@ -85,17 +284,67 @@ class MThreadedBucketTimeRateLimiterABC(ABC):
         ...
 
     @abstractmethod
-    def wrap_operation(self, func: Any, *args: Any, **kwargs: Any) -> Any:
+    def acquire(self, cost: int, *, priority: int, timeout: Optional[float], deadline: Optional[float]) -> None:
+        """
+        Blocks until cost slots (one by default) are available and takes them.
+        Waiters are served in priority order, lower value first, waiters with the same priority in FIFO order.
+        The first waiter blocks the others until enough slots are available.
+        If max_concurrency is set, concurrency slot is taken as well and should be returned with release method.
+        :param cost: number of slots to take, e.g. 100 for bulk call of 100 items.
+        :param priority: e.g. 0 for user requests and 10 for background jobs, which wait while users wait.
+        :param timeout: max time in seconds to wait for the slots, AcquireTimeoutError is raised when it passes.
+        The waiter leaves the queue and nothing is taken from the bucket. By default the caller waits until
+        the slots are available.
+        :param deadline: the same as timeout, but it is the moment of the limiter clock (clock.monotonic()),
+        e.g. deadline of the request which is passed through several calls. The earlier of both is used.
+        LimiterOverloadedError is raised right away if the call should wait and max_waiters or max_wait is exceeded.
+        """
+        ...
+
+    @abstractmethod
+    def wrap_operation(
+        self, func: Any, *args: Any, cost: CostType, priority: int, acquire_timeout: Optional[float], **kwargs: Any
+    ) -> Any:
         """
         Wrapper around some sync function which is used in "workers".
         It limits number of attempts to a certain maximum number.
+        The failed call is retried if the limiter has retry policy.
         :param func: some sync function we would like to apply rate limit to.
         :param args: the sync function args.
+        :param cost: number of slots the call takes (one by default), or function which receives args and kwargs
+        and returns the number. The param is not passed to func.
+        :param priority: priority of the call, see acquire method. The param is not passed to func.
+        :param acquire_timeout: max time in seconds to wait for the slots, see timeout param of acquire method.
+        The param is not passed to func.
         :param kwargs: the sync function kwargs.
         :return: returns the same result as the func is supposed to return.
         """
         ...
 
+    @abstractmethod
+    def map(self, func: Any, iterable: Any, *, concurrency: Optional[int], cost: CostType, priority: int) -> Any:
+        """
+        Calls func for every item of iterable in pool of threads with wrap_operation and yields results
+        in the order of the items: "for result in limiter.map(fetch, urls, concurrency=10)".
+        Items are pulled lazily, only when there are less than concurrency calls in progress, so large (or endless)
+        iterables are streamed without building task list or queue. If the call raises, the exception is raised
+        by the iterator, the calls which are not started yet are cancelled.
+        :param func: function which receives the item.
+        :param iterable: iterable of items.
+        :param concurrency: number of threads, max number of calls in progress (and results not yielded yet), by default
+        max_concurrency or max_size.
+        :param cost: number of slots every call takes, see wrap_operation.
+        :param priority: priority of the calls, see acquire method.
+        """
+        ...
+
+    @abstractmethod
+    def as_completed(
+        self, func: Any, iterable: Any, *, concurrency: Optional[int], cost: CostType, priority: int
+    ) -> Any:
+        """The same as map, but yields results in the order the calls are finished."""
+        ...
+
     @abstractmethod
     def __enter__(self) -> Any:
         """Implemented to use the BucketRateLimiter instance as context manager."""
@@ -105,3 +354,28 @@ class MThreadedBucketTimeRateLimiterABC(ABC):
     def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
         """Implemented to use the BucketRateLimiter instance as context manager."""
         ...
+
+
+class StorageBackendABC(ABC):
+    """
+    Storage of lazily refilled token buckets (max_size tokens per recovery_time), one bucket per key.
+    Backend can keep buckets in memory of the process, in shared memory of the host or in external storage,
+    e.g. Redis, to share limits between many hosts.
+    """
+
+    @abstractmethod
+    def update(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        """
+        Refills the bucket of the key (creates full bucket if there is no one) and takes cost tokens
+        from it in one atomic step depending on mode:
+        "reserve" - always takes the tokens, bucket can go into debt,
+        "try" - takes the tokens only if they are available right now,
+        "peek" - never takes the tokens.
+        Negative cost returns tokens back to the bucket.
+        :return: time to wait until the tokens are refilled, 0.0 means the tokens are available right now.
+        """
+        ...
+
+    async def aupdate(self, key: str, max_size: int, recovery_time: float, cost: int, mode: str) -> float:
+        """The same as update, is used by asyncio limiters. Backends which do network calls should override it."""
+        return self.update(key, max_size, recovery_time, cost, mode)
@@ -0,0 +1,150 @@
+import asyncio
+import threading as th
+from collections import OrderedDict
+from concurrent import futures
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# function which receives the call args and kwargs and returns key of the call
+KeyFuncType = Callable[..., Hashable]
+
+
+class _Abandoned(Exception):
+    """Is passed to the waiters of the call which was cancelled, they join again and one of them makes the call."""
+
+
+def _default_key(*args: Any, **kwargs: Any) -> Hashable:
+    return args, frozenset(kwargs.items())
+
+
+class CallCache:
+    """
+    Deduplication of identical calls made by decorator of the limiter, the calls are identified by their args.
+    Concurrent identical calls share one call in progress (singleflight), only the first one takes the slots
+    of the limiter, the others wait for its outcome (result or exception). If the call is cancelled, one of
+    the waiters makes the call instead. Results are kept for ttl seconds, so the calls which are repeated
+    in ttl cost no slots at all. Exceptions are not kept.
+    At most max_size results are kept, the least recently used are evicted first.
+    One instance should be used by one function.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1024, key: Optional[KeyFuncType] = None) -> None:
+        """
+        :param ttl: time in seconds the result is kept, 0 - results are not kept, only concurrent calls are shared.
+        :param max_size: max number of kept results and calls in progress.
+        :param key: function which receives the call args and kwargs and returns hashable key of the call.
+        By default the key is made of args and kwargs, the call with unhashable args is made without the cache.
+        """
+        if ttl < 0:
+            raise ValueError(f"ttl should be non-negative number, got {ttl}")
+        if max_size < 1:
+            raise ValueError(f"max_size should be positive integer number, got {max_size}")
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self.key: KeyFuncType = _default_key if key is None else key
+        # key -> (time the result expires at, future of the call), the oldest used first
+        self._entries: "OrderedDict[Hashable, Tuple[float, futures.Future[Any]]]" = OrderedDict()
+        self._lock = th.Lock()  # the cache can be used by threads
+        self.hits: int = 0  # number of calls which got the kept result
+        self.shared: int = 0  # number of calls which waited for identical call in progress
+        self.misses: int = 0  # number of calls which were made
+
+    def _join(self, key: Hashable, now: float) -> Tuple["futures.Future[Any]", bool]:
+        """Returns future of the kept result or of the call in progress, True - the caller should make the call."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, future = entry
+                if not future.done():
+                    self.shared += 1
+                    return future, False
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return future, False
+            future = futures.Future()
+            self._entries[key] = (float("inf"), future)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)  # the call in progress is not affected, its waiters have its future
+            self.misses += 1
+            return future, True
+
+    def _finish(
+        self, key: Hashable, future: "futures.Future[Any]", now: float, res: Any, exc: Optional[BaseException]
+    ) -> None:
+        """
+        Keeps the result of the call for ttl and passes the outcome to the waiters, the exception is not kept.
+        BaseException which is not Exception, e.g. CancelledError, belongs to the caller and is not passed,
+        the waiters join again and one of them makes the call.
+        """
+        with self._lock:
+            if self._entries.get(key, (0.0, None))[1] is future:
+                if exc is None and self.ttl:
+                    self._entries[key] = (now + self.ttl, future)
+                else:
+                    del self._entries[key]
+        if exc is None:
+            future.set_result(res)
+        elif isinstance(exc, Exception):
+            future.set_exception(exc)
+        else:
+            future.set_exception(_Abandoned())
+
+    def call(
+        self, func: Callable[[], Any], args: Tuple[Any, ...], kwargs: Dict[str, Any], now: Callable[[], float]
+    ) -> Any:
+        """Makes the call of func or returns the outcome of identical one, now is the clock of the limiter."""
+        try:
+            key = self.key(*args, **kwargs)
+            future, leader = self._join(key, now())
+        except TypeError:  # unhashable args
+            return func()
+        while not leader:
+            try:
+                return future.result()
+            except _Abandoned:
+                future, leader = self._join(key, now())
+        try:
+            res = func()
+        except BaseException as exc:
+            self._finish(key, future, now(), None, exc)
+            raise
+        self._finish(key, future, now(), res, None)
+        return res
+
+    async def acall(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        now: Callable[[], float],
+    ) -> Any:
+        """The same as call, but for coroutine functions."""
+        try:
+            key = self.key(*args, **kwargs)
+            future, leader = self._join(key, now())
+        except TypeError:  # unhashable args
+            return await func()
+        while not leader:
+            try:
+                # cancellation of the waiter does not cancel the shared call
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _Abandoned:
+                future, leader = self._join(key, now())
+        try:
+            res = await func()
+        except BaseException as exc:
+            self._finish(key, future, now(), None, exc)
+            raise
+        self._finish(key, future, now(), res, None)
+        return res
+
+    def clear(self) -> None:
+        """Drops the kept results, the calls in progress are still shared."""
+        with self._lock:
+            for key in [key for key, (_, future) in self._entries.items() if future.done()]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "shared": self.shared, "misses": self.misses, "size": len(self._entries)}
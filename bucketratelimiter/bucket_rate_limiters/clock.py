@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+import itertools
+import math
+import selectors
+import threading as th
+import time
+from typing import Any, Coroutine, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class Clock:
+    """
+    Source of time of the limiters, the default one is the real monotonic clock.
+    Threads sleep and wait with the clock, asyncio limiters use timers of the running event loop,
+    the loop time should be the clock time (asyncio loops use time.monotonic by default).
+    """
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def wait(self, event: th.Event, timeout: Optional[float] = None) -> None:
+        """Blocks the thread until the event is set or timeout passes, the caller should check what happened."""
+        event.wait(None if timeout == math.inf else timeout)
+
+
+REAL_CLOCK = Clock()  # is used by the limiters by default
+
+
+class VirtualClock(Clock):
+    """
+    Virtual time for tests and simulations: sleeps and waits end instantly in terms of real time,
+    but virtual time passes exactly as it would, so results do not depend on the speed of the machine.
+    Threads: when none of the threads used the clock for autojump_threshold real seconds, that is
+    everybody waits, time jumps to the nearest deadline of the waiting threads. Time can also be moved by advance.
+    asyncio: the code should run in the event loop of the clock (see run and new_event_loop),
+    the loop moves time to its nearest timer when it has nothing else to do.
+    """
+
+    def __init__(self, start: float = 0.0, autojump_threshold: Optional[float] = 0.05) -> None:
+        """
+        :param start: virtual time at the beginning.
+        :param autojump_threshold: time in real seconds without any use of the clock, after which the clock
+        decides that all the threads wait. None - threads wait until time is moved by advance or event loop.
+        """
+        if autojump_threshold is not None and autojump_threshold <= 0:
+            raise ValueError(f"autojump_threshold should be positive number, got {autojump_threshold}")
+        self.autojump_threshold: Optional[float] = autojump_threshold
+        self._now: float = start
+        self._lock = th.Lock()
+        # heap of [deadline, sequence number, event which is set at the deadline or None if nobody waits for it]
+        self._timers: List[List[Any]] = []
+        self._counter = itertools.count()
+        self._last_used: float = time.monotonic()  # real time of the last use of the clock
+        self._jumper: Optional[th.Thread] = None
+
+    def monotonic(self) -> float:
+        self._last_used = time.monotonic()
+        return self._now
+
+    def sleep(self, seconds: float) -> None:  # type: ignore[override]
+        self.wait(th.Event(), seconds)
+
+    def wait(self, event: th.Event, timeout: Optional[float] = None) -> None:
+        self._last_used = time.monotonic()
+        if timeout is None or timeout == math.inf:
+            event.wait()
+            self._last_used = time.monotonic()
+            return
+        with self._lock:
+            if timeout <= 0 or event.is_set():
+                return
+            timer = [self._now + timeout, next(self._counter), event]
+            heapq.heappush(self._timers, timer)
+            if self.autojump_threshold is not None and self._jumper is None:
+                self._jumper = th.Thread(target=self._autojump, name="VirtualClock-autojump", daemon=True)
+                self._jumper.start()
+        event.wait()
+        with self._lock:
+            timer[2] = None  # the timer does not fire anymore
+        self._last_used = time.monotonic()
+
+    def advance(self, seconds: float) -> None:
+        """Moves time forward by seconds, threads whose deadlines have come are woken up."""
+        if seconds < 0:
+            raise ValueError(f"time can not go backwards, got {seconds}")
+        with self._lock:
+            self._advance_to(self._now + seconds)
+
+    def _advance_to(self, moment: float) -> None:
+        """Moves time forward to the moment and fires the timers, the caller must hold self._lock."""
+        if moment > self._now:
+            self._now = moment
+        timers = self._timers
+        while timers and timers[0][0] <= self._now:
+            event = heapq.heappop(timers)[2]
+            if event is not None:
+                event.set()
+        self._last_used = time.monotonic()
+
+    def _next_deadline(self) -> Optional[float]:
+        """Returns the nearest deadline of the waiting threads, the caller must hold self._lock."""
+        timers = self._timers
+        while timers and timers[0][2] is None:
+            heapq.heappop(timers)
+        return timers[0][0] if timers else None
+
+    def _autojump(self) -> None:
+        threshold = self.autojump_threshold or 0.0
+        while True:
+            idle = time.monotonic() - self._last_used
+            if idle < threshold:
+                time.sleep(threshold - idle)
+                continue
+            with self._lock:
+                deadline = self._next_deadline()
+                if deadline is None:  # nobody waits, the thread is started again by the next wait
+                    self._jumper = None
+                    return
+                self._advance_to(deadline)
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        """Returns new asyncio event loop which runs in virtual time of the clock."""
+        return _VirtualTimeEventLoop(self)
+
+    def run(self, main: Coroutine[Any, Any, T]) -> T:
+        """Runs the coroutine in new event loop of the clock like asyncio.run and returns its result."""
+        loop = self.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(main)
+        finally:
+            try:
+                _cancel_all_tasks(loop)
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
+
+def _cancel_all_tasks(loop: asyncio.AbstractEventLoop) -> None:
+    """Cancels tasks which are left in the loop, e.g. background tasks of the limiters."""
+    all_tasks = getattr(asyncio, "all_tasks", None) or getattr(asyncio.Task, "all_tasks")  # Python 3.6
+    tasks = [task for task in all_tasks(loop) if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    """Selector which moves the clock forward instead of sleeping until the next timer of the loop."""
+
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout: Optional[float] = None) -> List[Tuple[selectors.SelectorKey, int]]:
+        ready: List[Tuple[selectors.SelectorKey, int]] = super().select(0)  # real I/O is handled first
+        if ready or (timeout is not None and timeout <= 0):
+            return ready
+        if timeout is None:  # no timers, only I/O or call from another thread can wake up the loop
+            return super().select(None)
+        self._clock.advance(timeout)
+        return []
+
+
+class _VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__(_VirtualTimeSelector(clock))
+        self._clock = clock
+
+    def time(self) -> float:
+        return self._clock.monotonic()
@@ -0,0 +1,151 @@
+import threading as th
+from typing import Any, List, Sequence
+
+from .asyncio_bucket import AsyncioBucketTimeRateLimiter
+from .mthreaded_bucket import MThreadedBucketTimeRateLimiter
+
+
+class AsyncioCompositeRateLimiter(AsyncioBucketTimeRateLimiter):
+    """
+    Combines several limiters (windows), e.g. 10 calls per second AND 1000 calls per minute AND 50k calls per day.
+    Every call takes a slot from all the limiters in one atomic step, so a slot is never burned in one limiter
+    while the call still waits for another one. Waiting call sleeps exactly until all the limiters have
+    a free slot, that is the earliest moment the call can run.
+    Limiters should not be used directly while they are the part of the composite limiter,
+    otherwise their own waiters can be overtaken by the composite limiter waiters.
+    """
+
+    def __init__(self, limiters: Sequence[AsyncioBucketTimeRateLimiter], **kwargs: Any) -> None:
+        """
+        :param limiters: limiters which should be combined.
+        :param kwargs: other AsyncioBucketTimeRateLimiter params, e.g. callback.
+        """
+        if not limiters:
+            raise ValueError("At least one limiter is required")
+        tightest = min(limiters, key=lambda limiter: limiter.max_size / limiter.recovery_time)
+        # call can not take more slots than the smallest limiter has
+        kwargs.setdefault("max_size", min(limiter.max_size for limiter in limiters))
+        kwargs.setdefault("recovery_time", tightest.recovery_time)
+        super().__init__(**kwargs)
+        self.limiters: List[AsyncioBucketTimeRateLimiter] = list(limiters)
+
+    def _decrement(self, cost: int = 1) -> None:
+        for limiter in self.limiters:
+            limiter._decrement(cost)
+
+    def _wait_time(self, cost: int = 1) -> float:
+        return max(limiter._wait_time(cost) for limiter in self.limiters)
+
+    def _try_take(self, cost: int = 1) -> float:
+        wait = self._wait_time(cost)
+        if not wait:
+            self._decrement(cost)
+        return wait
+
+    def _estimate_wait(self, cost: int) -> float:
+        return max(limiter._estimate_wait(cost) for limiter in self.limiters)
+
+    def _release_slot(self, cost: int = 1) -> None:
+        for limiter in self.limiters:
+            limiter._release_slot(cost)
+        self._wake_waiters()
+
+    def activate(self) -> None:
+        for limiter in self.limiters:
+            limiter.activate()
+        self._wake_waiters()  # someone could start to wait before activation
+
+    def deactivate(self) -> None:
+        for limiter in self.limiters:
+            limiter.deactivate()
+
+
+class MThreadedCompositeRateLimiter(MThreadedBucketTimeRateLimiter):
+    """
+    Combines several limiters (windows), e.g. 10 calls per second AND 1000 calls per minute AND 50k calls per day.
+    Every call takes a slot from all the limiters in one atomic step (locks of all the limiters are held),
+    so a slot is never burned in one limiter while the call still waits for another one.
+    Waiting thread sleeps exactly until all the limiters have a free slot, that is the earliest moment
+    the call can run.
+    Limiters should not be used directly while they are the part of the composite limiter,
+    otherwise their own waiters can be overtaken by the composite limiter waiters.
+    """
+
+    def __init__(self, limiters: Sequence[MThreadedBucketTimeRateLimiter], **kwargs: Any) -> None:
+        """
+        :param limiters: limiters which should be combined.
+        :param kwargs: other MThreadedBucketTimeRateLimiter params, e.g. callback.
+        """
+        if not limiters:
+            raise ValueError("At least one limiter is required")
+        if kwargs.get("stripes", 1) != 1:
+            raise ValueError("Composite limiter takes slots from its limiters, it can not be striped")
+        tightest = min(limiters, key=lambda limiter: limiter.max_size / limiter.recovery_time)
+        # call can not take more slots than the smallest limiter has
+        kwargs.setdefault("max_size", min(limiter.max_size for limiter in limiters))
+        kwargs.setdefault("recovery_time", tightest.recovery_time)
+        super().__init__(**kwargs)
+        self.limiters: List[MThreadedBucketTimeRateLimiter] = list(limiters)
+        # locks are always acquired in the same order to prevent deadlocks
+        self._locks: List[th.Lock] = [
+            limiter.sync_lock for limiter in sorted({id(i): i for i in limiters}.values(), key=id)
+        ]
+
+    def _lock_all(self) -> None:
+        for lock in self._locks:
+            lock.acquire()
+
+    def _unlock_all(self) -> None:
+        for lock in reversed(self._locks):
+            lock.release()
+
+    def _take_slot(self, cost: int = 1) -> None:
+        self._lock_all()
+        try:
+            for limiter in self.limiters:
+                limiter._take_slot(cost)
+        finally:
+            self._unlock_all()
+
+    def _wait_time(self, cost: int = 1) -> float:
+        self._lock_all()
+        try:
+            return max(limiter._wait_time(cost) for limiter in self.limiters)
+        finally:
+            self._unlock_all()
+
+    def _estimate_wait(self, cost: int) -> float:
+        self._lock_all()
+        try:
+            return max(limiter._estimate_wait(cost) for limiter in self.limiters)
+        finally:
+            self._unlock_all()
+
+    def _try_take(self, cost: int = 1) -> float:
+        self._lock_all()
+        try:
+            wait = max(limiter._wait_time(cost) for limiter in self.limiters)
+            if not wait:
+                for limiter in self.limiters:
+                    limiter._take_slot(cost)
+            return wait
+        finally:
+            self._unlock_all()
+
+    def _release_slot(self, cost: int = 1) -> None:
+        self._lock_all()
+        try:
+            for limiter in self.limiters:
+                limiter._release_slot(cost)
+        finally:
+            self._unlock_all()
+
+    def activate(self) -> None:
+        for limiter in self.limiters:
+            limiter.activate()
+        with self.sync_lock:
+            self._wake_waiters()  # someone could start to wait before activation
+
+    def deactivate(self) -> None:
+        for limiter in self.limiters:
+            limiter.deactivate()
@@ -0,0 +1,13 @@
+class RateLimiterError(Exception):
+    """Base class of the errors which are raised by the limiters."""
+
+
+class AcquireTimeoutError(RateLimiterError, TimeoutError):
+    """Slots were not acquired before the timeout or the deadline, nothing was taken from the bucket."""
+
+
+class LimiterOverloadedError(RateLimiterError):
+    """
+    The call is rejected right away without waiting (load shedding): the wait queue is full
+    or the estimated wait is longer than the limiter allows, see max_waiters and max_wait params.
+    """
@@ -0,0 +1,129 @@
+import os
+import threading as th
+from collections import deque
+from concurrent import futures
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from .mthreaded_bucket import MThreadedBucketTimeRateLimiter
+
+T = TypeVar("T")
+
+
+class _WorkItem:
+    """Submitted call which waits in the executor queue."""
+
+    __slots__ = ("future", "fn", "args", "kwargs", "submitted")
+
+    def __init__(
+        self,
+        future: "futures.Future[Any]",
+        fn: Callable[..., Any],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        submitted: float,
+    ) -> None:
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted = submitted  # wait time of the call is counted from the time
+
+
+class RateLimitedExecutor(futures.Executor):
+    """
+    concurrent.futures.Executor which runs the submitted calls in pool of threads with the limiter rate.
+    Submitted calls wait in the executor queue, dispatcher thread takes free thread of the pool and then
+    slot of the limiter and only then hands the call over to the thread, so threads of the pool never
+    sleep waiting for the limiter slots and a small pool reaches the full rate.
+    If the limiter sheds load (max_waiters, max_wait), the future of the rejected call gets LimiterOverloadedError,
+    other errors of acquire (e.g. of the storage backend) are set to the future of the call as well.
+    The slot of the call which is cancelled while it waits for the slot is returned to the limiter.
+    """
+
+    def __init__(
+        self,
+        limiter: MThreadedBucketTimeRateLimiter,
+        max_workers: Optional[int] = None,
+        thread_name_prefix: str = "",
+    ) -> None:
+        """
+        :param limiter: limiter every submitted call takes one slot from.
+        :param max_workers: number of threads, by default max_concurrency of the limiter,
+        or the default of ThreadPoolExecutor.
+        :param thread_name_prefix: prefix of the threads names.
+        """
+        if max_workers is None:
+            max_workers = limiter.max_concurrency or min(32, (os.cpu_count() or 1) + 4)
+        if max_workers <= 0:
+            raise ValueError("max_workers must be greater than 0")
+        self.limiter: MThreadedBucketTimeRateLimiter = limiter
+        self._pool = futures.ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix)
+        self._idle_workers = th.Semaphore(max_workers)
+        self._queue: Deque[_WorkItem] = deque()  # FIFO queue of the submitted calls
+        self._condition = th.Condition()
+        self._shutdown = False
+        self._dispatcher = th.Thread(target=self._dispatch, name=f"{thread_name_prefix}dispatcher", daemon=True)
+        self.limiter.activate()
+        self._dispatcher.start()
+
+    # fn is positional-only in the superclass, the syntax is not supported by old Python versions
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "futures.Future[T]":  # type: ignore[override]
+        future: "futures.Future[T]" = futures.Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.append(_WorkItem(future, fn, args, kwargs, self.limiter.clock.monotonic()))
+            self._condition.notify()
+        return future
+
+    def _dispatch(self) -> None:
+        """Hands over the submitted calls to the threads of the pool when both thread and slot are available."""
+        while True:
+            with self._condition:
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+                if not self._queue:  # the executor is shut down and all the calls are dispatched
+                    break
+                item = self._queue.popleft()
+            if item.future.cancelled():
+                item.future.set_running_or_notify_cancel()
+                continue
+            self._idle_workers.acquire()
+            try:
+                self.limiter.acquire()
+            except Exception as exc:  # load is shed by the limiter or its storage backend fails
+                self._idle_workers.release()
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(exc)
+                continue
+            if not item.future.set_running_or_notify_cancel():  # cancelled while it waited for the slot
+                try:
+                    self.limiter._refund()
+                except Exception:  # storage backend fails, the token is lost, but the limit is not exceeded
+                    pass
+                self.limiter.release()
+                self._idle_workers.release()
+                continue
+            self._pool.submit(self._run, item)
+        self._pool.shutdown(wait=False)
+
+    def _run(self, item: _WorkItem) -> None:
+        try:
+            result = self.limiter._call(item.submitted, 1, item.fn, *item.args, **item.kwargs)
+        except BaseException as exc:
+            item.future.set_exception(exc)
+        else:
+            item.future.set_result(result)
+        finally:
+            self._idle_workers.release()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for item in self._queue:
+                    item.future.cancel()
+            self._condition.notify_all()
+        if wait:
+            self._dispatcher.join()
+            self._pool.shutdown(wait=True)
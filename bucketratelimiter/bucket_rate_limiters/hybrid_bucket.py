@@ -0,0 +1,228 @@
+import asyncio
+import inspect
+import math
+import threading as th
+from functools import partial, wraps
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .bucket_abc import CostType
+from .cache import CallCache
+from .exceptions import AcquireTimeoutError
+from .metrics import CallStats
+from .mthreaded_bucket import MThreadedBucketTimeRateLimiter, _Slot, _Ticket
+from .retry import RetryPolicy
+
+
+class _LoopEvent(th.Event):
+    """
+    Event of the coroutine which waits in the waiters queue. It can be set from any thread,
+    the coroutine is woken up in its own event loop by thread safe callback.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__()
+        self.loop = loop
+        self.future: "asyncio.Future[None]" = loop.create_future()
+
+    def set(self) -> None:
+        super().set()
+        try:
+            self.loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:  # pragma: no cover - the loop is closed, nobody waits for the event
+            pass
+
+    def clear(self) -> None:
+        """Is called in the event loop of the coroutine."""
+        super().clear()
+        if self.future.done():
+            self.future = self.loop.create_future()
+
+    def _wake(self) -> None:
+        if self.is_set() and not self.future.done():  # the event could be cleared before the callback is run
+            self.future.set_result(None)
+
+    async def wait_async(self, timeout: float) -> None:
+        """Waits until the event is set or timeout passes, the caller should check what happened."""
+        if timeout == math.inf:
+            await asyncio.shield(self.future)
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _HybridSlot(_Slot):
+    """Context manager which takes slots from the limiter on enter, it can be used with "with" and "async with"."""
+
+    __slots__ = ()
+
+    limiter: "HybridBucketTimeRateLimiter"
+
+    async def __aenter__(self) -> None:
+        self.limiter.activate()
+        await self.limiter.aacquire(self.cost, priority=self.priority, timeout=self.timeout)
+
+    async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.limiter.release()
+
+
+class HybridBucketTimeRateLimiter(MThreadedBucketTimeRateLimiter):
+    """
+    One limiter (one budget) for threads and asyncio event loops: threads block in acquire, coroutines await
+    aacquire, both wait in the same queue. Coroutine waiters are woken up in their own event loop by thread safe
+    callbacks, so the limiter can be shared by threads which run their own loops, and by sync code which is run
+    by asyncio.to_thread, without polling and without blocking the loops. Decorator and slot support
+    both functions and coroutine functions. Blocking methods (acquire, wrap_operation, map) should not be
+    called by coroutines, they block the event loop.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Takes the params of MThreadedBucketTimeRateLimiter, positional or keyword. Storage backend
+        is not supported, its round-trips would block the event loops.
+        """
+        params = inspect.signature(super().__init__).bind(*args, **kwargs).arguments
+        if params.get("backend") is not None:
+            raise ValueError("Storage backend is not supported by hybrid limiter, its calls block the event loop")
+        super().__init__(*args, **kwargs)
+
+    async def aacquire(
+        self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None, deadline: Optional[float] = None
+    ) -> None:
+        """The same as acquire, but waits for the slots without blocking the event loop."""
+        if cost > self.max_size:
+            raise ValueError(f"cost {cost} is greater than max_size {self.max_size}, it can not be acquired")
+        striped = self._striped
+        if striped is not None and not self._waiters and striped.admit(self.clock.monotonic(), cost):
+            return
+        with self.sync_lock:  # the lock is held only for a moment, it does not block the event loop
+            if not self._waiters and not self._try_admit(cost):
+                self.metrics.grant(cost, 0.0)
+                return
+            until = self._deadline(timeout, deadline)
+            self._shed(cost, until)
+            event = _LoopEvent(asyncio.get_event_loop())
+            ticket = _Ticket(cost, event)
+            wait = self._enqueue(ticket, priority)
+
+        try:
+            while wait:
+                await event.wait_async(min(wait, until - self.clock.monotonic()))
+                with self.sync_lock:
+                    event.clear()
+                    wait = self._serve(ticket)
+                    if wait and self.clock.monotonic() >= until:
+                        self._time_out(ticket)
+        except AcquireTimeoutError:
+            raise
+        except BaseException:  # cancelled
+            with self.sync_lock:
+                self._withdraw(ticket)
+            raise
+
+    def slot(self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None) -> _HybridSlot:
+        return _HybridSlot(self, cost, priority, timeout)
+
+    async def awrap_operation(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """The same as wrap_operation, but for coroutine functions."""
+        return await self._aretry_call(self.retry, func, args, kwargs, cost, priority, acquire_timeout)
+
+    async def _aretry_call(
+        self,
+        retry: Optional[RetryPolicy],
+        func: Callable[..., Awaitable[Any]],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        cost: CostType,
+        priority: int,
+        acquire_timeout: Optional[float],
+    ) -> Any:
+        """The same as _retry_call, but for coroutine functions."""
+        slots = cost(*args, **kwargs) if callable(cost) else cost
+        attempt = 1
+        while True:
+            requested = self.clock.monotonic()
+            await self.aacquire(slots, priority=priority, timeout=acquire_timeout)
+            try:
+                return await self._acall(requested, slots, func, *args, **kwargs)
+            except Exception as exc:
+                if retry is None or not retry.should_retry(attempt, exc, self.clock.monotonic()):
+                    raise
+                delay = retry.backoff(attempt)
+            with self.sync_lock:
+                self.metrics.retried += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _acall(
+        self, requested: float, cost: int, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any
+    ) -> Any:
+        """Awaits the call which already got its slots, requested is the time the slots were requested at."""
+        started = self.clock.monotonic()
+        error: Optional[BaseException] = None
+        try:
+            res = await func(*args, **kwargs)
+        except BaseException as exc:
+            error = exc
+            if isinstance(exc, Exception):
+                self._adapt(started, exc=exc)
+            raise
+        finally:
+            self.release()
+            if self.on_call is not None:
+                outcome = self.on_call(CallStats(cost, started - requested, self.clock.monotonic() - started, error))
+                if inspect.isawaitable(outcome):
+                    await outcome
+        self._adapt(started, result=res)
+        if self.callback is not None:
+            self.callback()
+        return res
+
+    def __call__(
+        self,
+        f: Optional[Callable[..., Any]] = None,
+        *,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        retry: Optional[RetryPolicy] = None,
+        cache: Optional[CallCache] = None,
+    ) -> Any:
+        if f is None:  # decorator is used with params, e.g. @limiter(cost=5)
+            return partial(
+                self.__call__, cost=cost, priority=priority, acquire_timeout=acquire_timeout, retry=retry, cache=cache
+            )
+        if not asyncio.iscoroutinefunction(f):
+            return super().__call__(
+                f, cost=cost, priority=priority, acquire_timeout=acquire_timeout, retry=retry, cache=cache
+            )
+        if retry is None:
+            retry = self.retry
+        else:
+            retry.attach(self.max_size / self.recovery_time, self.max_size, self.clock.monotonic())
+
+        @wraps(f)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            self.activate()
+            if cache is None:
+                return await self._aretry_call(retry, f, args, kwargs, cost, priority, acquire_timeout)
+            call = partial(self._aretry_call, retry, f, args, kwargs, cost, priority, acquire_timeout)
+            return await cache.acall(call, args, kwargs, self.clock.monotonic)
+
+        return wrapper
+
+    async def __aenter__(self) -> "HybridBucketTimeRateLimiter":
+        self.activate()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.deactivate()
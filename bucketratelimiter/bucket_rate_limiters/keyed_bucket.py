@@ -0,0 +1,178 @@
+import asyncio
+import threading as th
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Coroutine, Hashable, Optional, Union
+
+from .algorithms import EPSILON
+from .clock import REAL_CLOCK, Clock
+
+AsyncFuncType = Callable[..., Union[Awaitable[Any], Coroutine[Any, Any, Any]]]
+KeyFuncType = Callable[..., Hashable]
+
+
+def _first_argument(*args: Any, **kwargs: Any) -> Hashable:
+    return args[0]  # type: ignore[no-any-return]
+
+
+class _KeyState:
+    """Compact state of the key bucket: number of tokens and time of the last refill."""
+
+    __slots__ = ("tokens", "last")
+
+    def __init__(self, tokens: float, last: float) -> None:
+        self.tokens: float = tokens
+        self.last: float = last
+
+
+class KeyedRateLimiter:
+    """
+    Registry of lazily refilled token buckets (max_size tokens per recovery_time), one bucket per key,
+    e.g. per tenant, per host or per API key. Bucket state is created on the first use of the key,
+    it is only two floats, nothing runs in background and the instance does not need activation.
+    Idle keys are evicted after ttl seconds, the least recently used keys are evicted if there are
+    more than max_keys keys. Keys are evicted only when their buckets are full again, so eviction never
+    lets a key exceed its limit. Lookup, acquire and eviction cost is O(1) and does not depend on number of keys.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4,
+        recovery_time: float = 1.0,
+        max_keys: int = 100_000,
+        ttl: Optional[float] = None,
+        key_func: Optional[KeyFuncType] = None,
+        clock: Optional[Clock] = None,
+    ) -> None:
+        """
+        :param max_size: max size of every key Bucket.
+        :param recovery_time: time in seconds to recover key Bucket to full size.
+        :param max_keys: max number of keys to keep in memory, the least recently used key is evicted
+        if the number is exceeded. Evicted key starts with full Bucket if it is used again, so the key
+        is evicted only when its Bucket is refilled, meanwhile the number of keys can exceed max_keys.
+        :param ttl: time in seconds after the last use of the key, when the key can be evicted.
+        Bucket of the key is full again after recovery_time, so by default ttl = recovery_time
+        and eviction of idle keys does not affect the rate limit.
+        :param key_func: function which receives args and kwargs of the decorated function
+        and returns the key, by default the first positional argument is the key.
+        :param clock: source of time, e.g. VirtualClock in tests, by default the real monotonic clock.
+        """
+        self.max_size: int = max_size
+        self.recovery_time: float = recovery_time
+        self.max_keys: int = max_keys
+        self.ttl: float = recovery_time if ttl is None else ttl
+        self.key_func: KeyFuncType = _first_argument if key_func is None else key_func
+        self.clock: Clock = REAL_CLOCK if clock is None else clock
+        self._rate: float = max_size / recovery_time  # tokens per second
+        # keys are ordered from the least recently used to the most recently used
+        self._states: "OrderedDict[Hashable, _KeyState]" = OrderedDict()
+        self.sync_lock = th.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._states
+
+    def _evict(self, now: float) -> None:
+        """Removes idle keys, the caller must hold self.sync_lock."""
+        states = self._states
+        while states:
+            key, state = next(iter(states.items()))
+            # key which still has debt of reserved tokens or is not refilled yet is kept even above max_keys,
+            # otherwise it would come back with full bucket and could burst past its limit
+            if state.tokens + (now - state.last) * self._rate < self.max_size:
+                return
+            if len(states) < self.max_keys and now - state.last < self.ttl:
+                return
+            del states[key]
+
+    def _get_state(self, key: Hashable, now: float) -> _KeyState:
+        """Returns refilled state of the key, the caller must hold self.sync_lock."""
+        state = self._states.get(key)
+        if state is None:
+            self._evict(now)
+            state = self._states[key] = _KeyState(float(self.max_size), now)
+            return state
+        self._states.move_to_end(key)
+        if now > state.last:
+            state.tokens = min(float(self.max_size), state.tokens + (now - state.last) * self._rate)
+            state.last = now
+        return state
+
+    def _reserve(self, key: Hashable, cost: float = 1) -> float:
+        """
+        Takes cost tokens from the key Bucket and returns time to wait until the tokens are refilled,
+        0.0 means the tokens are available right now. Tokens are reserved in FIFO order,
+        so waiters of the key do not need any queue and are not woken up more than once.
+        """
+        now = self.clock.monotonic()
+        with self.sync_lock:
+            state = self._get_state(key, now)
+            state.tokens -= cost
+            if state.tokens + EPSILON >= 0:
+                return 0.0
+            return -state.tokens / self._rate
+
+    def _refund(self, key: Hashable, cost: float = 1) -> None:
+        """Returns reserved but not used tokens back to the key Bucket."""
+        with self.sync_lock:
+            state = self._states.get(key)
+            if state is not None:
+                state.tokens = min(float(self.max_size), state.tokens + cost)
+
+
+class AsyncioKeyedRateLimiter(KeyedRateLimiter):
+    async def _acquire(self, key: Hashable) -> None:
+        wait = self._reserve(key)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._refund(key)
+                raise
+
+    async def wrap_operation(self, key: Hashable, func: AsyncFuncType, *args: Any, **kwargs: Any) -> Any:
+        """
+        Wrapper around some async function, limits number of calls per key.
+        :param key: key of the bucket to use, e.g. tenant id or host name.
+        :param func: async function we would like to limit.
+        :param args: this async function args.
+        :param kwargs: this async function kwargs.
+        :return: returns the same result as func is supposed to return.
+        """
+        await self._acquire(key)
+        return await func(*args, **kwargs)
+
+    def __call__(self, f: AsyncFuncType) -> AsyncFuncType:
+        @wraps(f)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return await self.wrap_operation(self.key_func(*args, **kwargs), f, *args, **kwargs)
+
+        return wrapper
+
+
+class MThreadedKeyedRateLimiter(KeyedRateLimiter):
+    def _acquire(self, key: Hashable) -> None:
+        wait = self._reserve(key)
+        if wait:
+            self.clock.sleep(wait)
+
+    def wrap_operation(self, key: Hashable, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Wrapper around some sync function, limits number of calls per key.
+        :param key: key of the bucket to use, e.g. tenant id or host name.
+        :param func: some sync function we would like to apply rate limit to.
+        :param args: the sync function args.
+        :param kwargs: the sync function kwargs.
+        :return: returns the same result as the func is supposed to return.
+        """
+        self._acquire(key)
+        return func(*args, **kwargs)
+
+    def __call__(self, f: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(f)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return self.wrap_operation(self.key_func(*args, **kwargs), f, *args, **kwargs)
+
+        return wrapper
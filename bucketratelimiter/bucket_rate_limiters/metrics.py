@@ -0,0 +1,142 @@
+import math
+from bisect import bisect_left
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# upper bounds of the wait time histogram buckets in seconds, there is one more bucket for longer waits
+WAIT_TIME_BUCKETS: Tuple[float, ...] = (0.0, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+class CallStats(NamedTuple):
+    """Timing of the call which is passed to on_call hook of the limiter."""
+
+    cost: int  # number of slots the call took
+    wait_time: float  # time in seconds the call waited for the slots
+    call_time: float  # time in seconds the call itself took
+    exception: Optional[BaseException]  # exception the call raised, None if it succeeded
+
+
+class LimiterMetrics:
+    """
+    Counters of the limiter, they are updated in the hot path, so they are plain integers and floats.
+    """
+
+    __slots__ = (
+        "granted",
+        "granted_slots",
+        "waited",
+        "rejected",
+        "timed_out",
+        "shed",
+        "retried",
+        "refills",
+        "wait_time",
+        "wait_buckets",
+    )
+
+    def __init__(self) -> None:
+        self.granted: int = 0  # number of granted acquires
+        self.granted_slots: int = 0  # number of granted slots (tokens)
+        self.waited: int = 0  # number of acquires which had to wait, the limit was reached
+        self.rejected: int = 0  # number of try_acquire calls which did not get slots
+        self.timed_out: int = 0  # number of acquires which did not get slots before timeout or deadline
+        self.shed: int = 0  # number of acquires which were rejected by max_waiters or max_wait
+        self.retried: int = 0  # number of retries of the failed calls made by retry policy
+        self.refills: int = 0  # number of refills of fixed window bucket
+        self.wait_time: float = 0.0  # total time acquires waited for slots
+        self.wait_buckets: List[int] = [0] * (len(WAIT_TIME_BUCKETS) + 1)  # not cumulative
+
+    def grant(self, cost: int, wait: float) -> None:
+        """Counts acquire which got cost slots after it waited wait seconds."""
+        self.granted += 1
+        self.granted_slots += cost
+        if wait <= 0.0:
+            self.wait_buckets[0] += 1
+            return
+        self.waited += 1
+        self.wait_time += wait
+        self.wait_buckets[bisect_left(WAIT_TIME_BUCKETS, wait)] += 1
+
+    def merge(self, other: "LimiterMetrics") -> None:
+        """Adds counters of other metrics, e.g. of the stripes of the limiter."""
+        self.granted += other.granted
+        self.granted_slots += other.granted_slots
+        self.waited += other.waited
+        self.rejected += other.rejected
+        self.timed_out += other.timed_out
+        self.shed += other.shed
+        self.retried += other.retried
+        self.refills += other.refills
+        self.wait_time += other.wait_time
+        self.wait_buckets = [a + b for a, b in zip(self.wait_buckets, other.wait_buckets)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = []
+        count = 0
+        for n in self.wait_buckets:
+            count += n
+            cumulative.append(count)
+        return {
+            "granted": self.granted,
+            "granted_slots": self.granted_slots,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "shed": self.shed,
+            "retried": self.retried,
+            "refills": self.refills,
+            "wait_time_sum": self.wait_time,
+            # upper bound of the bucket -> number of acquires which waited not longer than the bound
+            "wait_time_buckets": dict(zip(WAIT_TIME_BUCKETS + (math.inf,), cumulative)),
+        }
+
+
+# name, type, help, key of stats
+_PROMETHEUS_METRICS = (
+    ("granted_total", "counter", "Number of granted acquires.", "granted"),
+    ("granted_slots_total", "counter", "Number of granted slots.", "granted_slots"),
+    ("waited_total", "counter", "Number of acquires which waited for slots.", "waited"),
+    ("rejected_total", "counter", "Number of try_acquire calls which did not get slots.", "rejected"),
+    ("timed_out_total", "counter", "Number of acquires which timed out.", "timed_out"),
+    ("shed_total", "counter", "Number of acquires which were rejected by load shedding.", "shed"),
+    ("retried_total", "counter", "Number of retries of the failed calls.", "retried"),
+    ("refills_total", "counter", "Number of refills of fixed window bucket.", "refills"),
+    ("waiters", "gauge", "Number of waiters in the queue.", "waiters"),
+    ("queued_slots", "gauge", "Number of slots the waiters wait for.", "queued_slots"),
+    ("in_flight", "gauge", "Number of calls in progress, if max_concurrency is set.", "in_flight"),
+    ("rate", "gauge", "Current rate of the limiter, slots per second.", "rate"),
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(value)
+
+
+def prometheus_text(*limiters: Any, namespace: str = "bucketratelimiter") -> str:
+    """
+    Returns stats of the limiters in Prometheus text exposition format, limiter name is used as "limiter" label.
+    :param limiters: limiters which have stats method.
+    :param namespace: prefix of the metrics names.
+    """
+    all_stats = [limiter.stats() for limiter in limiters]
+    lines = []
+    for name, kind, description, key in _PROMETHEUS_METRICS:
+        lines.append(f"# HELP {namespace}_{name} {description}")
+        lines.append(f"# TYPE {namespace}_{name} {kind}")
+        for stats in all_stats:
+            lines.append(f'{namespace}_{name}{{limiter="{_escape(stats["name"])}"}} {_number(stats[key])}')
+    name = f"{namespace}_wait_seconds"
+    lines.append(f"# HELP {name} Time acquires waited for slots.")
+    lines.append(f"# TYPE {name} histogram")
+    for stats in all_stats:
+        label = f'limiter="{_escape(stats["name"])}"'
+        for bound, count in stats["wait_time_buckets"].items():
+            lines.append(f'{name}_bucket{{{label},le="{_number(bound)}"}} {count}')
+        lines.append(f"{name}_sum{{{label}}} {_number(stats['wait_time_sum'])}")
+        lines.append(f"{name}_count{{{label}}} {stats['granted']}")
+    return "\n".join(lines) + "\n"
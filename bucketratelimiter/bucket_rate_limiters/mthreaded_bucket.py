@@ -1,9 +1,175 @@
+import itertools
+import math
 import threading as th
-from functools import wraps
-from time import sleep
-from typing import Any, Callable, Optional
+from collections import deque
+from concurrent import futures
+from functools import partial, wraps
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from .bucket_abc import BucketTimeRateLimiterABC, MThreadedBucketTimeRateLimiterABC
+from .adaptive import AdaptiveRate
+from .algorithms import ALGORITHMS, EPSILON, MIN_WAIT_TIME, LazyBucket, TokenBucket, lazy_bucket
+from .backends import BackendBucket
+from .cache import CallCache
+from .bucket_abc import BucketTimeRateLimiterABC, CostType, MThreadedBucketTimeRateLimiterABC, StorageBackendABC
+from .clock import REAL_CLOCK, Clock
+from .exceptions import AcquireTimeoutError, LimiterOverloadedError
+from .metrics import CallStats, LimiterMetrics
+from .retry import RetryPolicy
+from .waiters import WaitQueue
+
+
+class _Ticket:
+    """Place of the blocked thread in the waiters queue."""
+
+    __slots__ = ("event", "granted", "cost", "queued_at")
+
+    def __init__(self, cost: int, event: Optional[th.Event] = None) -> None:
+        self.event: th.Event = th.Event() if event is None else event  # is set when the waiter should check the queue
+        self.granted: bool = False  # slots are already taken for the thread
+        self.cost: int = cost  # number of slots the thread waits for
+        self.queued_at: float = 0.0  # time the ticket was queued at
+
+
+class _Slot:
+    """Context manager which takes slots from the limiter on enter."""
+
+    __slots__ = ("limiter", "cost", "priority", "timeout")
+
+    def __init__(
+        self, limiter: "MThreadedBucketTimeRateLimiter", cost: int, priority: int, timeout: Optional[float]
+    ) -> None:
+        self.limiter = limiter
+        self.cost = cost
+        self.priority = priority
+        self.timeout = timeout
+
+    def __enter__(self) -> None:
+        self.limiter.activate()
+        self.limiter.acquire(self.cost, priority=self.priority, timeout=self.timeout)
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.limiter.release()
+
+
+class _Stripe:
+    """Part of striped token bucket, it has its own lock and counters."""
+
+    __slots__ = ("lock", "bucket", "metrics")
+
+    def __init__(self, capacity: float, recovery_time: float, now: float) -> None:
+        self.lock = th.Lock()
+        self.bucket = TokenBucket(capacity, recovery_time, now)
+        self.metrics = LimiterMetrics()  # grants and rejections of the fast path, is updated under self.lock
+
+
+class _StripedBucket:
+    """
+    Token bucket split into stripes with their own locks, so threads which take tokens do not contend for one lock.
+    Thread takes tokens from its home stripe and gathers them from other stripes if the home one does not have
+    enough, so the stripes together have capacity and refill rate of one bucket. Methods are thread safe.
+    """
+
+    __slots__ = ("stripes", "_local", "_counter")
+
+    def __init__(self, max_size: int, recovery_time: float, now: float, stripes: int) -> None:
+        self.stripes: List[_Stripe] = [_Stripe(max_size / stripes, recovery_time, now) for _ in range(stripes)]
+        self._local = th.local()  # index of the home stripe of the thread
+        self._counter = itertools.count()  # threads get home stripes in round-robin order
+
+    def _home(self) -> int:
+        try:
+            return self._local.index  # type: ignore[no-any-return]
+        except AttributeError:
+            index = self._local.index = next(self._counter) % len(self.stripes)
+            return index
+
+    @property
+    def rate(self) -> float:
+        return sum(stripe.bucket.rate for stripe in self.stripes)
+
+    def set_rate(self, now: float, rate: float) -> None:
+        for stripe in self.stripes:
+            with stripe.lock:
+                stripe.bucket.set_rate(now, rate / len(self.stripes))
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        available = 0.0
+        for stripe in self.stripes:
+            with stripe.lock:
+                available += stripe.bucket.available(now)
+        if available + EPSILON >= cost:
+            return 0.0
+        return (cost - available) / self.rate
+
+    def consume(self, now: float, cost: float = 1) -> None:
+        stripe = self.stripes[self._home()]
+        with stripe.lock:
+            stripe.bucket.consume(now, cost)
+
+    def take(self, now: float, cost: float = 1) -> float:
+        home = self._home()
+        stripe = self.stripes[home]
+        with stripe.lock:
+            if not stripe.bucket.take(now, cost):
+                return 0.0
+        return self._gather(now, cost, home)
+
+    def admit(self, now: float, cost: int) -> bool:
+        """Takes cost tokens and counts the grant in the home stripe, returns False if there are not enough tokens."""
+        home = self._home()
+        stripe = self.stripes[home]
+        with stripe.lock:
+            if not stripe.bucket.take(now, cost):
+                stripe.metrics.grant(cost, 0.0)
+                return True
+        if self._gather(now, cost, home):
+            return False
+        with stripe.lock:
+            stripe.metrics.grant(cost, 0.0)
+        return True
+
+    def refund(self, now: float, cost: float = 1) -> None:
+        """Returns cost tokens to the home stripe, tokens which do not fit into it are spilled into other stripes."""
+        home = self._home()
+        count = len(self.stripes)
+        for i in range(count):
+            stripe = self.stripes[(home + i) % count]
+            with stripe.lock:
+                part = min(stripe.bucket.capacity - stripe.bucket.available(now), cost)
+                if part > 0:
+                    stripe.bucket.refund(now, part)
+                    cost -= part
+            if cost <= EPSILON:
+                return
+
+    def reject(self) -> None:
+        stripe = self.stripes[self._home()]
+        with stripe.lock:
+            stripe.metrics.rejected += 1
+
+    def _gather(self, now: float, cost: float, home: int) -> float:
+        """
+        Takes cost tokens from several stripes starting from the home one, nothing is taken if the stripes
+        do not have enough tokens together.
+        :return: time to wait for the missing tokens, 0.0 if the tokens were taken.
+        """
+        taken: List[Tuple[_Stripe, float]] = []
+        needed = float(cost)
+        count = len(self.stripes)
+        for i in range(count):
+            stripe = self.stripes[(home + i) % count]
+            with stripe.lock:
+                part = min(stripe.bucket.available(now), needed)
+                if part > 0:
+                    stripe.bucket.tokens -= part
+                    taken.append((stripe, part))
+                    needed -= part
+            if needed <= EPSILON:
+                return 0.0
+        for stripe, part in taken:  # return the tokens, the call waits for all of them
+            with stripe.lock:
+                stripe.bucket.refund(now, part)
+        return needed / self.rate
 
 
 class MThreadedBucketTimeRateLimiter(BucketTimeRateLimiterABC, MThreadedBucketTimeRateLimiterABC):
@@ -13,11 +179,52 @@ class MThreadedBucketTimeRateLimiter(BucketTimeRateLimiterABC, MThreadedBucketTi
         recovery_time: float = 1.0,
         rest_time: float = 0.2,
         callback: Optional[Callable[..., Any]] = None,
+        algorithm: Optional[str] = None,
+        backend: Optional[StorageBackendABC] = None,
+        name: str = "default",
+        max_concurrency: Optional[int] = None,
+        adaptive: Optional[AdaptiveRate] = None,
+        aging: Optional[float] = None,
+        on_call: Optional[Callable[[CallStats], Any]] = None,
+        clock: Optional[Clock] = None,
+        burst: Optional[int] = None,
+        max_waiters: Optional[int] = None,
+        max_wait: Optional[float] = None,
+        retry: Optional[RetryPolicy] = None,
+        stripes: int = 1,
     ) -> None:
+        """
+        :param stripes: number of parts of the token bucket with their own locks. Threads take tokens from
+        the stripes without the limiter lock while nobody waits, so many threads do not contend for one lock,
+        e.g. on free-threaded Python. The stripes together keep the same limit. Requires local "token_bucket"
+        algorithm without max_concurrency. By default the bucket is not striped.
+        Other params are described in BucketTimeRateLimiterABC.
+        """
+        if algorithm is None:
+            algorithm = "fixed_window" if backend is None and adaptive is None else "token_bucket"
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm!r}, expected one of {ALGORITHMS}")
+        if backend is not None and algorithm != "token_bucket":
+            raise ValueError("Storage backend keeps token buckets, algorithm should be 'token_bucket'")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency should be positive integer number, got {max_concurrency}")
+        if adaptive is not None and (backend is not None or algorithm != "token_bucket"):
+            raise ValueError("Adaptive rate changes the rate of local token bucket, algorithm should be 'token_bucket'")
+        if burst is not None and (algorithm != "leaky_bucket" or not 1 <= burst <= max_size):
+            raise ValueError(f"burst should be from 1 to max_size and requires 'leaky_bucket' algorithm, got {burst}")
+        if max_waiters is not None and max_waiters < 0:
+            raise ValueError(f"max_waiters should be non-negative integer number, got {max_waiters}")
+        if max_wait is not None and (max_wait < 0 or backend is not None):
+            raise ValueError(f"max_wait should be non-negative number and requires local bucket, got {max_wait}")
+        if stripes < 1:
+            raise ValueError(f"stripes should be positive integer number, got {stripes}")
+        if stripes > 1 and (backend is not None or algorithm != "token_bucket" or max_concurrency is not None):
+            raise ValueError("Striped bucket requires local 'token_bucket' algorithm without max_concurrency")
+        self.clock: Clock = REAL_CLOCK if clock is None else clock
         self.max_size: int = max_size
         self.active_slots: int = max_size  # number of active slots at the moment
         self.recovery_time: float = recovery_time
-        self.rest_time: float = rest_time
+        self.rest_time: float = rest_time  # not used anymore, waiters are woken up by _reactivate_slots
         # used to signal "external" workers that bucket is "empty"
         self.event_bucket_empty: th.Event = th.Event()
         # separate asyncio task to return bucket to full size
@@ -25,49 +232,612 @@ class MThreadedBucketTimeRateLimiter(BucketTimeRateLimiterABC, MThreadedBucketTi
         self.callback: Optional[Callable[..., Any]] = callback
         self.sync_lock = th.Lock()
         self.event_full_stop = th.Event()
+        self.algorithm: str = algorithm
+        self.name: str = name  # key of the bucket in the storage backend
+        self._backend: Optional[StorageBackendABC] = backend
+        # lazily refilled bucket, is used instead of self.active_slots and self.reactivate_task
+        self._bucket: Optional[Union[LazyBucket, BackendBucket, _StripedBucket]] = None
+        self._striped: Optional[_StripedBucket] = None  # the same as self._bucket if it is striped
+        if backend is not None:
+            self._bucket = BackendBucket(backend, name, max_size, recovery_time)
+        elif stripes > 1:
+            self._bucket = self._striped = _StripedBucket(max_size, recovery_time, self.clock.monotonic(), stripes)
+        elif algorithm != "fixed_window":
+            self._bucket = lazy_bucket(algorithm, max_size, recovery_time, self.clock.monotonic(), burst)
+        # queue of "tickets" of threads which wait for a free slot
+        self._waiters: WaitQueue[_Ticket] = WaitQueue(aging, self.clock.monotonic)
+        self._queued_cost: int = 0  # total number of slots the waiters wait for
+        # local queue of waiters for their turn to take tokens from the storage backend
+        self._backend_waiters: WaitQueue[_Ticket] = WaitQueue(aging, self.clock.monotonic)
+        self._backend_busy: bool = False  # someone waits for tokens of the storage backend
+        self._next_refill: float = math.inf  # time of the next refill by self.reactivate_task
+        self.max_concurrency: Optional[int] = max_concurrency
+        self.in_flight: int = 0  # number of calls in progress, is counted only if max_concurrency is set
+        self.adaptive: Optional[AdaptiveRate] = adaptive
+        self.on_call: Optional[Callable[[CallStats], Any]] = on_call
+        self.max_waiters: Optional[int] = max_waiters
+        self.max_wait: Optional[float] = max_wait
+        self.retry: Optional[RetryPolicy] = retry
+        self.metrics: LimiterMetrics = LimiterMetrics()  # is updated under self.sync_lock
+        if retry is not None:
+            retry.attach(max_size / recovery_time, max_size, self.clock.monotonic())
+        if adaptive is not None and isinstance(self._bucket, (TokenBucket, _StripedBucket)):
+            self._bucket.set_rate(self.clock.monotonic(), adaptive.attach(self._bucket.rate))
+
+    def _take_slot(self, cost: int = 1) -> None:
+        """Decrements self.active_slots by cost, the caller must hold self.sync_lock."""
+        if self._bucket is not None:
+            self._bucket.consume(self.clock.monotonic(), cost)
+            return
+        self.active_slots = max(self.active_slots - cost, 0)
+        if self.active_slots == 0:
+            self.event_bucket_empty.clear()
 
-    def _decrement(self) -> None:
+    def _decrement(self, cost: int = 1) -> None:
         with self.sync_lock:
-            if self.active_slots > 0:
-                self.active_slots -= 1
+            self._take_slot(cost)
+
+    def _wait_time(self, cost: int = 1) -> float:
+        """
+        Returns time to wait until cost slots are available, 0.0 - right now, inf - limiter is not activated.
+        The caller must hold self.sync_lock.
+        """
+        if self._bucket is not None:
+            return self._bucket.wait_time(self.clock.monotonic(), cost)
+        if self.event_bucket_empty.is_set() and self.active_slots >= cost:
+            return 0.0
+        # refill can be a bit late, do not let waiters spin
+        return max(self._next_refill - self.clock.monotonic(), MIN_WAIT_TIME)
+
+    def _try_take(self, cost: int = 1) -> float:
+        """
+        Takes cost slots if they are available, otherwise returns time to wait for them.
+        The caller must hold self.sync_lock.
+        """
+        if self._bucket is not None:
+            return self._bucket.take(self.clock.monotonic(), cost)
+        wait = self._wait_time(cost)
+        if not wait:
+            self._take_slot(cost)
+        return wait
+
+    def _try_admit(self, cost: int) -> float:
+        """
+        Takes cost slots and concurrency slot if both are available, otherwise returns time to wait for them.
+        Zero cost takes only concurrency slot. The caller must hold self.sync_lock.
+        """
+        if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+            return math.inf  # waiters are woken up by release
+        wait = self._try_take(cost) if cost else 0.0
+        if not wait and self.max_concurrency is not None:
+            self.in_flight += 1
+        return wait
+
+    def _estimate_wait(self, cost: int) -> float:
+        """
+        Returns time to wait until cost slots are refilled, cost can be greater than max_size.
+        The caller must hold self.sync_lock.
+        """
+        if self._bucket is not None:
+            return self._bucket.wait_time(self.clock.monotonic(), cost)
+        if self.event_bucket_empty.is_set() and self.active_slots >= cost:
+            return 0.0
+        refills = math.ceil(cost / self.max_size)
+        return max(self._next_refill - self.clock.monotonic(), 0.0) + (refills - 1) * self.recovery_time
+
+    def _wake_waiters(self) -> float:
+        """
+        Hands over free slots to the waiting threads in FIFO order, the caller must hold self.sync_lock.
+        :return: time the first waiter should wait for slots.
+        """
+        granted = False
+        while self._waiters:
+            ticket = self._waiters.head()
+            wait = self._try_admit(ticket.cost)
+            if wait:
+                if granted:  # wake up new first waiter, so it can wait for tokens with timeout
+                    ticket.event.set()
+                return wait
+            self._waiters.popleft()
+            self._queued_cost -= ticket.cost
+            ticket.granted = granted = True
+            ticket.event.set()
+        return 0.0
 
     def _reactivate_slots(self) -> None:
-        while self.event_full_stop.is_set():
-            sleep(self.recovery_time)
+        running = self.event_full_stop  # event of this activation, it is cleared by deactivate
+        while True:
+            with self.sync_lock:
+                if not running.is_set():
+                    return
+                self._next_refill = self.clock.monotonic() + self.recovery_time
+            self.clock.sleep(self.recovery_time)
             with self.sync_lock:
+                if not running.is_set():  # deactivated while it slept
+                    return
                 self.active_slots = self.max_size
                 self.event_bucket_empty.set()
+                self.metrics.refills += 1
+                self._wake_waiters()
 
-    def wrap_operation(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
-        while True:
-            if self.event_bucket_empty.is_set():  # if bucket is not empty do work
-                if self.active_slots == 0:
-                    self.event_bucket_empty.clear()
-                else:
-                    self._decrement()
-                    res = func(*args, **kwargs)
-                    if self.callback is not None:
-                        self.callback()
-                    return res
+    def acquire(
+        self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None, deadline: Optional[float] = None
+    ) -> None:
+        if cost > self.max_size:
+            raise ValueError(f"cost {cost} is greater than max_size {self.max_size}, it can not be acquired")
+        if self._backend is not None:
+            self._acquire_with_backend(self._backend, cost, priority, self._deadline(timeout, deadline))
+            return
+        striped = self._striped
+        if striped is not None and not self._waiters and striped.admit(self.clock.monotonic(), cost):
+            return  # fast path without the limiter lock, the stripes take tokens atomically
+        self._admit(cost, priority, timeout, deadline)
+
+    def _admit(
+        self, cost: int, priority: int, timeout: Optional[float], deadline: Optional[float]
+    ) -> Optional[_Ticket]:
+        """
+        Waits in the queue until cost slots and concurrency slot are available and takes them.
+        :return: ticket of the caller, None if the slots were taken right away.
+        """
+        with self.sync_lock:  # check and take the slots atomically
+            # if nobody waits and bucket is not empty do work
+            if not self._waiters and not self._try_admit(cost):
+                if cost:
+                    self.metrics.grant(cost, 0.0)
+                return None
+            until = self._deadline(timeout, deadline)
+            self._shed(cost, until)
+            ticket = _Ticket(cost)
+            wait = self._enqueue(ticket, priority)
+
+        # only the first waiter waits with timeout until the slot is available, others wait for their turn
+        while wait:
+            self.clock.wait(ticket.event, min(wait, until - self.clock.monotonic()))
+            with self.sync_lock:
+                ticket.event.clear()
+                wait = self._serve(ticket)
+                if wait and self.clock.monotonic() >= until:
+                    self._time_out(ticket)
+        return ticket
+
+    def _acquire_with_backend(self, backend: StorageBackendABC, cost: int, priority: int, deadline: float) -> None:
+        """Takes concurrency slot (if max_concurrency is set) and then cost tokens from the storage backend."""
+        waited = 0.0
+        if self.max_concurrency is not None:
+            # concurrency slot is taken before tokens of the storage backend
+            ticket = self._admit(0, priority, None, deadline)
+            if ticket is not None:
+                waited = self.clock.monotonic() - ticket.queued_at
+        try:
+            waited += self._acquire_from_backend(backend, cost, priority, deadline)
+        except BaseException:
+            self.release()
+            raise
+        with self.sync_lock:
+            self.metrics.grant(cost, waited)
+
+    def _acquire_from_backend(self, backend: StorageBackendABC, cost: int, priority: int, deadline: float) -> float:
+        """
+        Takes cost tokens from the storage backend. Round-trips to the backend are made without self.sync_lock:
+        waiters are queued locally, only the first one calls the backend and sleeps until the backend has
+        tokens for it. AcquireTimeoutError is raised right away if the backend tokens are not refilled
+        before the deadline.
+        :return: time the caller waited, 0.0 if the tokens were taken right away.
+        """
+        key, max_size, recovery_time = self.name, self.max_size, self.recovery_time
+        ready_at = 0.0  # tokens are not available before the time
+        if not self._backend_busy:  # if nobody waits try to take tokens right now
+            wait = backend.update(key, max_size, recovery_time, cost, "try")
+            if not wait:
+                return 0.0
+            ready_at = self.clock.monotonic() + wait
+        queued_at = self.clock.monotonic()
+        ticket: Optional[_Ticket] = None
+        with self.sync_lock:
+            self._shed(cost, deadline, len(self._backend_waiters) + self._backend_busy)
+            if not self._backend_busy:
+                self._backend_busy = True
             else:
-                sleep(self.rest_time)
+                ticket = _Ticket(cost)
+                ticket.queued_at = queued_at
+                self._backend_waiters.append(ticket, priority)
+        while ticket is not None and not ticket.granted:  # _pass_backend_turn gives us the turn
+            self.clock.wait(ticket.event, deadline - self.clock.monotonic())
+            with self.sync_lock:
+                if not ticket.granted and self.clock.monotonic() >= deadline:
+                    self._backend_waiters.remove(ticket)
+                    self.metrics.timed_out += 1
+                    raise AcquireTimeoutError(f"{cost} slots of limiter {self.name!r} were not acquired in time")
+        try:
+            while True:
+                if ready_at > self.clock.monotonic():
+                    if ready_at > deadline:
+                        with self.sync_lock:
+                            self.metrics.timed_out += 1
+                        raise AcquireTimeoutError(
+                            f"tokens of limiter {self.name!r} are not refilled in storage backend before the deadline"
+                        )
+                    self.clock.sleep(ready_at - self.clock.monotonic())
+                wait = backend.update(key, max_size, recovery_time, cost, "try")
+                if not wait:
+                    return self.clock.monotonic() - queued_at
+                ready_at = self.clock.monotonic() + wait
+        finally:
+            with self.sync_lock:
+                self._pass_backend_turn()
+
+    def _pass_backend_turn(self) -> None:
+        """Gives the turn to take tokens from the storage backend to the next waiter, the caller must hold the lock."""
+        if self._backend_waiters:
+            ticket = self._backend_waiters.popleft()
+            ticket.granted = True
+            ticket.event.set()
+            return
+        self._backend_busy = False
+
+    def _deadline(self, timeout: Optional[float], deadline: Optional[float]) -> float:
+        """Returns the earlier of deadline and now + timeout, inf if both are None."""
+        if timeout is not None:
+            moment = self.clock.monotonic() + timeout
+            return moment if deadline is None else min(moment, deadline)
+        return math.inf if deadline is None else deadline
+
+    def _shed(self, cost: int, deadline: float, waiters: Optional[int] = None) -> None:
+        """
+        Raises if the caller who should wait for cost slots behind waiters others (the local queue by default)
+        is rejected right away, the caller must hold self.sync_lock: AcquireTimeoutError - deadline has passed,
+        LimiterOverloadedError - max_waiters or max_wait is exceeded.
+        """
+        if deadline <= self.clock.monotonic():
+            self.metrics.timed_out += 1
+            raise AcquireTimeoutError(f"{cost} slots of limiter {self.name!r} are not available before the deadline")
+        if waiters is None:
+            waiters = len(self._waiters)
+        if self.max_waiters is not None and waiters >= self.max_waiters:
+            self.metrics.shed += 1
+            raise LimiterOverloadedError(f"{waiters} callers already wait for slots of limiter {self.name!r}")
+        if self.max_wait is not None:
+            wait = self._estimate_wait(self._queued_cost + cost)
+            if wait > self.max_wait:
+                self.metrics.shed += 1
+                raise LimiterOverloadedError(
+                    f"estimated wait {wait:.3f} is longer than max_wait {self.max_wait} of limiter {self.name!r}"
+                )
+
+    def _time_out(self, ticket: _Ticket) -> None:
+        """Takes the ticket out of the queue and raises AcquireTimeoutError, the caller must hold self.sync_lock."""
+        self._withdraw(ticket)
+        self.metrics.timed_out += 1
+        raise AcquireTimeoutError(f"{ticket.cost} slots of limiter {self.name!r} were not acquired in time")
+
+    def _withdraw(self, ticket: _Ticket) -> None:
+        """
+        Takes the ticket of the waiter which does not wait anymore out of the queue in O(1),
+        slots which were already taken for it are returned. The caller must hold self.sync_lock.
+        """
+        if ticket.granted:
+            if ticket.cost:
+                self._release_slot(ticket.cost)
+            if self.max_concurrency is not None:
+                self.in_flight -= 1
+        elif self._waiters.remove(ticket):
+            self._queued_cost -= ticket.cost
+        self._wake_waiters()
+        if self._waiters:  # the first waiter could be changed, it should wait with timeout
+            self._waiters.head().event.set()
+
+    def _release_slot(self, cost: int = 1) -> None:
+        """Returns unused slots back to the bucket, the caller must hold self.sync_lock."""
+        if self._bucket is not None:
+            self._bucket.refund(self.clock.monotonic(), cost)
+        else:
+            self.active_slots = min(self.max_size, self.active_slots + cost)
+            self.event_bucket_empty.set()
+
+    def _refund(self, cost: int = 1) -> None:
+        """Returns cost slots which were taken by acquire for the call which is not made, e.g. cancelled one."""
+        if self._backend is not None:  # round-trip is made without the lock
+            self._backend.update(self.name, self.max_size, self.recovery_time, -cost, "reserve")
+            return
+        with self.sync_lock:
+            self._release_slot(cost)
+            self._wake_waiters()
+            if self._waiters:  # the first waiter can get the slots earlier than it waits for
+                self._waiters.head().event.set()
+
+    def _enqueue(self, ticket: _Ticket, priority: int) -> float:
+        """
+        Puts the ticket into the waiters queue, the caller must hold self.sync_lock.
+        :return: time the ticket should wait for, see _serve.
+        """
+        ticket.queued_at = self.clock.monotonic()
+        self._waiters.append(ticket, priority)
+        self._queued_cost += ticket.cost
+        return self._serve(ticket)
+
+    def _serve(self, ticket: _Ticket) -> float:
+        """
+        Hands over free slots to the waiters and counts the grant of the ticket, the caller must hold self.sync_lock.
+        :return: time the ticket should wait for: 0.0 - slots are taken for it, inf - until its event is set.
+        Only the first waiter waits with timeout until its slots are available.
+        """
+        if not ticket.granted:  # slots could be already taken for the ticket by _wake_waiters
+            wait = self._wake_waiters()
+            if not ticket.granted:
+                return wait if self._waiters.head() is ticket else math.inf
+        if ticket.cost:  # zero cost ticket waits only for concurrency slot before tokens of the storage backend
+            self.metrics.grant(ticket.cost, self.clock.monotonic() - ticket.queued_at)
+        return 0.0
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        if self._backend is not None:
+            return self._try_acquire_from_backend(self._backend, cost)
+        striped = self._striped
+        if striped is not None:
+            if not self._waiters and striped.admit(self.clock.monotonic(), cost):
+                return True
+            striped.reject()
+            return False
+        with self.sync_lock:
+            if not self._waiters and not self._try_admit(cost):
+                self.metrics.grant(cost, 0.0)
+                return True
+            self.metrics.rejected += 1
+            return False
+
+    def _try_acquire_from_backend(self, backend: StorageBackendABC, cost: int) -> bool:
+        """The same as try_acquire, but the round-trip to the storage backend is made without self.sync_lock."""
+        with self.sync_lock:
+            admitted = not self._waiters and not self._backend_busy and not self._try_admit(0)
+            if not admitted:
+                self.metrics.rejected += 1
+                return False
+        if not backend.update(self.name, self.max_size, self.recovery_time, cost, "try"):
+            with self.sync_lock:
+                self.metrics.grant(cost, 0.0)
+            return True
+        self.release()  # concurrency slot
+        with self.sync_lock:
+            self.metrics.rejected += 1
+        return False
+
+    @property
+    def rate(self) -> float:
+        if isinstance(self._bucket, (TokenBucket, _StripedBucket)):
+            return self._bucket.rate
+        return self.max_size / self.recovery_time
+
+    def _adapt(self, started: float, exc: Optional[BaseException] = None, result: Any = None) -> None:
+        """Updates the rate by the outcome of the call if adaptive rate is used."""
+        if self.adaptive is None or not isinstance(self._bucket, (TokenBucket, _StripedBucket)):
+            return
+        with self.sync_lock:
+            now = self.clock.monotonic()
+            rate = self.adaptive.observe(started, now, exc, result)
+            if rate is None:
+                return
+            self._bucket.set_rate(now, rate)
+            if self._waiters:  # the first waiter waits for tokens at the old rate
+                self._waiters.head().event.set()
+
+    def release(self) -> None:
+        if self.max_concurrency is None:
+            return
+        with self.sync_lock:
+            self.in_flight -= 1
+            if 0.0 < self._wake_waiters() < math.inf:
+                # the first waiter could wait for concurrency slot without timeout, now it waits for tokens
+                self._waiters.head().event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        metrics = LimiterMetrics()
+        for stripe in self._striped.stripes if self._striped is not None else ():
+            with stripe.lock:
+                metrics.merge(stripe.metrics)
+        with self.sync_lock:
+            metrics.merge(self.metrics)
+            stats = metrics.snapshot()
+            stats.update(
+                name=self.name,
+                waiters=len(self._waiters) + len(self._backend_waiters),
+                queued_slots=self._queued_cost,
+                in_flight=self.in_flight,
+                rate=self.rate,
+            )
+        return stats
+
+    def reserve(self, cost: int = 1) -> float:
+        if self._backend is not None:  # the round-trip is made without the lock
+            return self._backend.update(self.name, self.max_size, self.recovery_time, cost, "peek")
+        with self.sync_lock:
+            return self._estimate_wait(self._queued_cost + cost)
+
+    def slot(self, cost: int = 1, *, priority: int = 0, timeout: Optional[float] = None) -> _Slot:
+        return _Slot(self, cost, priority, timeout)
+
+    def wrap_operation(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Any:
+        return self._retry_call(self.retry, func, args, kwargs, cost, priority, acquire_timeout)
+
+    def _retry_call(
+        self,
+        retry: Optional[RetryPolicy],
+        func: Callable[..., Any],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        cost: CostType,
+        priority: int,
+        acquire_timeout: Optional[float],
+    ) -> Any:
+        """Acquires the slots and calls func, the failed call is retried by retry policy."""
+        slots = cost(*args, **kwargs) if callable(cost) else cost
+        attempt = 1
+        while True:
+            requested = self.clock.monotonic()
+            self.acquire(slots, priority=priority, timeout=acquire_timeout)
+            try:
+                return self._call(requested, slots, func, *args, **kwargs)
+            except Exception as exc:
+                if retry is None or not retry.should_retry(attempt, exc, self.clock.monotonic()):
+                    raise
+                delay = retry.backoff(attempt)
+            with self.sync_lock:
+                self.metrics.retried += 1
+            self.clock.sleep(delay)
+            attempt += 1
+
+    def _call(self, requested: float, cost: int, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Calls func which has already taken cost slots, releases concurrency slot when func is finished.
+        requested is the time the slots were requested at.
+        """
+        started = self.clock.monotonic()
+        error: Optional[BaseException] = None
+        try:
+            res = func(*args, **kwargs)
+        except BaseException as exc:
+            error = exc
+            if isinstance(exc, Exception):
+                self._adapt(started, exc=exc)
+            raise
+        finally:
+            self.release()
+            if self.on_call is not None:
+                self.on_call(CallStats(cost, started - requested, self.clock.monotonic() - started, error))
+        self._adapt(started, result=res)
+        if self.callback is not None:
+            self.callback()
+        return res
+
+    def map(
+        self,
+        func: Callable[..., Any],
+        iterable: Iterable[Any],
+        *,
+        concurrency: Optional[int] = None,
+        cost: CostType = 1,
+        priority: int = 0,
+    ) -> Iterator[Any]:
+        return self._pipeline(func, iterable, self._pipeline_limit(concurrency), cost, priority, ordered=True)
+
+    def as_completed(
+        self,
+        func: Callable[..., Any],
+        iterable: Iterable[Any],
+        *,
+        concurrency: Optional[int] = None,
+        cost: CostType = 1,
+        priority: int = 0,
+    ) -> Iterator[Any]:
+        return self._pipeline(func, iterable, self._pipeline_limit(concurrency), cost, priority, ordered=False)
+
+    def _pipeline_limit(self, concurrency: Optional[int]) -> int:
+        limit = concurrency or self.max_concurrency or self.max_size
+        if limit < 1:
+            raise ValueError(f"concurrency should be positive integer number, got {concurrency}")
+        return limit
+
+    def _pipeline(
+        self,
+        func: Callable[..., Any],
+        iterable: Iterable[Any],
+        limit: int,
+        cost: CostType,
+        priority: int,
+        ordered: bool,
+    ) -> Iterator[Any]:
+        """Runs func for the items in limit threads and yields the results."""
+        self.activate()
+        items = iter(iterable)
+        pending: Deque["futures.Future[Any]"] = deque()  # calls in the order of the items, or finished calls
+        running: Set["futures.Future[Any]"] = set()  # calls which are not finished, is used if not ordered
+        exhausted = False
+        # exit of the executor waits for the calls in progress
+        with futures.ThreadPoolExecutor(max_workers=limit) as executor:
+            try:
+                while True:
+                    # backpressure: the next item is pulled only when the result of the previous one is taken
+                    while not exhausted and len(pending) + len(running) < limit:
+                        try:
+                            item = next(items)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        call = executor.submit(self.wrap_operation, func, item, cost=cost, priority=priority)
+                        if ordered:
+                            pending.append(call)
+                        else:
+                            running.add(call)
+                    if ordered:
+                        if not pending:
+                            return
+                        yield pending.popleft().result()
+                    else:
+                        if not running:
+                            return
+                        done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                        pending.extend(done)
+                        while pending:
+                            yield pending.popleft().result()
+            finally:
+                for call in (*pending, *running):
+                    call.cancel()
 
     def activate(self) -> None:
-        if self.reactivate_task is None:  # prevents creation of several activate tasks
-            self.event_full_stop.set()  # prepare full stop event
-            self.event_bucket_empty.set()  # set event flag that bucket is ready
+        if self._bucket is not None:  # lazily refilled bucket does not need any background thread
+            return
+        # prevents creation of several activate threads, the thread of the previous activation stops by itself
+        if self.reactivate_task is None or not self.event_full_stop.is_set():
+            self.event_full_stop = th.Event()  # prepare full stop event of the new thread
+            self.event_full_stop.set()
+            with self.sync_lock:
+                if self.active_slots > 0:
+                    self.event_bucket_empty.set()  # set event flag that bucket is ready
+                self._next_refill = self.clock.monotonic() + self.recovery_time
+                self._wake_waiters()  # someone could start to wait before activation
             self.reactivate_task = th.Thread(target=self._reactivate_slots, daemon=True)
             self.reactivate_task.start()
 
     def deactivate(self) -> None:
         if self.reactivate_task is not None:
-            self.event_full_stop.clear()
+            with self.sync_lock:
+                self.event_full_stop.clear()
+                self._next_refill = math.inf  # the bucket is not refilled anymore
+
+    def __call__(
+        self,
+        f: Optional[Callable[..., Any]] = None,
+        *,
+        cost: CostType = 1,
+        priority: int = 0,
+        acquire_timeout: Optional[float] = None,
+        retry: Optional[RetryPolicy] = None,
+        cache: Optional[CallCache] = None,
+    ) -> Any:
+        if f is None:  # decorator is used with params, e.g. @limiter(cost=5)
+            return partial(
+                self.__call__, cost=cost, priority=priority, acquire_timeout=acquire_timeout, retry=retry, cache=cache
+            )
+        if retry is None:
+            retry = self.retry
+        else:
+            retry.attach(self.max_size / self.recovery_time, self.max_size, self.clock.monotonic())
 
-    def __call__(self, f: Callable[..., Any]) -> Callable[..., Any]:
         @wraps(f)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
             self.activate()
-            return self.wrap_operation(f, *args, **kwargs)
+            if cache is None:
+                return self._retry_call(retry, f, args, kwargs, cost, priority, acquire_timeout)
+            call = partial(self._retry_call, retry, f, args, kwargs, cost, priority, acquire_timeout)
+            return cache.call(call, args, kwargs, self.clock.monotonic)
 
         return wrapper
 
@@ -0,0 +1,230 @@
+import hashlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading as th
+from functools import partial, wraps
+from time import monotonic, sleep
+from typing import Any, Callable, Optional
+
+from .algorithms import EPSILON
+from .bucket_abc import CostType
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
+# max_size, recovery_time, number of tokens, time of the last refill
+_STATE = struct.Struct("dddd")
+
+
+def default_directory() -> str:
+    # /dev/shm is memory backed file system, so the file is never written to disk
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _file_name(key: str) -> str:
+    """
+    Returns name of the file of the bucket. The key can come from outside (e.g. tenant id), so only safe
+    characters of the key are kept for readability, and the hash of the key keeps the names unique.
+    """
+    readable = re.sub(r"[^A-Za-z0-9_.-]", "_", key)[:64]
+    return f"bucketratelimiter-{readable}-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+
+
+class SharedBucketFile:
+    """
+    Lazily refilled token bucket (max_size tokens per recovery_time) which lives in memory mapped file,
+    so it is shared by all the processes (and threads) on the host which open the same file.
+    The state is changed under exclusive file lock. Requires POSIX file locks (fcntl).
+    """
+
+    def __init__(self, path: str, max_size: int, recovery_time: float) -> None:
+        """
+        :param path: path to the file which keeps Bucket state.
+        All the processes should use the same max_size and recovery_time, otherwise ValueError is raised.
+        :param max_size: max size of the shared Bucket.
+        :param recovery_time: time in seconds to recover the shared Bucket to full size.
+        """
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError("Shared Bucket requires POSIX file locks (fcntl module)")
+        self.path: str = path
+        self.max_size: int = max_size
+        self.recovery_time: float = recovery_time
+        self._rate: float = max_size / recovery_time  # tokens per second
+        # file locks do not exclude threads of the same process from each other
+        self.sync_lock = th.Lock()
+        self._fd: int = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < _STATE.size:  # the first process initializes the Bucket
+                os.ftruncate(self._fd, _STATE.size)
+                self._mmap = mmap.mmap(self._fd, _STATE.size)
+                _STATE.pack_into(self._mmap, 0, max_size, recovery_time, max_size, monotonic())
+            else:
+                self._mmap = mmap.mmap(self._fd, _STATE.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        shared_max_size, shared_recovery_time, _, _ = _STATE.unpack_from(self._mmap)
+        if (shared_max_size, shared_recovery_time) != (max_size, recovery_time):
+            self.close()
+            raise ValueError(
+                f"Bucket {path!r} is shared with max_size={shared_max_size:g}, recovery_time={shared_recovery_time:g}"
+            )
+
+    def update(self, cost: int, mode: str) -> float:
+        """
+        Refills the shared Bucket and takes cost tokens from it depending on mode:
+        "reserve" - always takes the tokens, Bucket can go into debt, "try" - takes the tokens
+        only if they are available right now, "peek" - never takes the tokens.
+        Negative cost returns tokens back to the Bucket.
+        :return: time to wait until the tokens are refilled, 0.0 means the tokens are available right now.
+        """
+        with self.sync_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = monotonic()
+                _, _, tokens, last = _STATE.unpack_from(self._mmap)
+                if now > last:
+                    tokens = min(float(self.max_size), tokens + (now - last) * self._rate)
+                    last = now
+                wait = 0.0 if tokens + EPSILON >= cost else (cost - tokens) / self._rate
+                if mode == "reserve" or (mode == "try" and not wait):
+                    tokens = min(float(self.max_size), tokens - cost)
+                _STATE.pack_into(self._mmap, 0, self.max_size, self.recovery_time, tokens, last)
+                return wait
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        """Closes the file of the shared Bucket, the file is kept for other processes."""
+        if not self._mmap.closed:
+            self._mmap.close()
+            os.close(self._fd)
+
+
+class _ProcessSlot:
+    """Context manager which takes slots from the limiter on enter."""
+
+    __slots__ = ("limiter", "cost")
+
+    def __init__(self, limiter: "ProcessBucketTimeRateLimiter", cost: int) -> None:
+        self.limiter = limiter
+        self.cost = cost
+
+    def __enter__(self) -> None:
+        self.limiter.acquire(self.cost)
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        pass
+
+
+class ProcessBucketTimeRateLimiter:
+    """
+    Lazily refilled token bucket (max_size tokens per recovery_time) which is shared by all the processes
+    (and threads) on the host which use the same name, e.g. gunicorn or multiprocessing workers.
+    Bucket state lives in memory mapped file, it is changed under exclusive file lock.
+    Waiters reserve tokens in advance and sleep exactly until the reserved tokens are refilled,
+    so blocked processes are served in FIFO order and never poll the shared state.
+    Nothing runs in background, hereby the limiter does not need activation.
+    Requires POSIX file locks (fcntl).
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4,
+        recovery_time: float = 1.0,
+        name: str = "default",
+        directory: Optional[str] = None,
+        callback: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        """
+        :param max_size: max size of the shared Bucket.
+        :param recovery_time: time in seconds to recover the shared Bucket to full size.
+        :param name: name of the shared Bucket, all the processes which use the name share the Bucket.
+        Processes should use the same max_size and recovery_time, otherwise ValueError is raised.
+        :param directory: directory of the file which keeps Bucket state, /dev/shm or temp directory by default.
+        :param callback: not "awaitable" function which is called when any of workers have finished task.
+        """
+        self.max_size: int = max_size
+        self.recovery_time: float = recovery_time
+        self.callback: Optional[Callable[..., Any]] = callback
+        self.path: str = os.path.join(directory or default_directory(), _file_name(name))
+        self._shared: SharedBucketFile = SharedBucketFile(self.path, max_size, recovery_time)
+
+    def _update(self, cost: int, mode: str) -> float:
+        return self._shared.update(cost, mode)
+
+    def _decrement(self, cost: int = 1) -> None:
+        self._update(cost, "reserve")
+
+    def acquire(self, cost: int = 1) -> None:
+        """Blocks until cost tokens (one by default) are available in the shared Bucket and takes them."""
+        if cost > self.max_size:
+            raise ValueError(f"cost {cost} is greater than max_size {self.max_size}, it can not be acquired")
+        wait = self._update(cost, "reserve")
+        if wait:
+            sleep(wait)
+
+    def try_acquire(self, cost: int = 1) -> bool:
+        """Takes cost tokens if they are available right now, never blocks."""
+        return not self._update(cost, "try")
+
+    def reserve(self, cost: int = 1) -> float:
+        """Returns time to wait until cost tokens are available for a new call, tokens are not taken."""
+        return self._update(cost, "peek")
+
+    def slot(self, cost: int = 1) -> _ProcessSlot:
+        return _ProcessSlot(self, cost)
+
+    def wrap_operation(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        cost: CostType = 1,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Wrapper around some sync function, limits number of calls of all the processes which share the Bucket.
+        :param func: some sync function we would like to apply rate limit to.
+        :param args: the sync function args.
+        :param cost: number of tokens the call takes (one by default), or function which receives args and kwargs
+        and returns the number. The param is not passed to func.
+        :param kwargs: the sync function kwargs.
+        :return: returns the same result as the func is supposed to return.
+        """
+        self.acquire(cost(*args, **kwargs) if callable(cost) else cost)
+        res = func(*args, **kwargs)
+        if self.callback is not None:
+            self.callback()
+        return res
+
+    def activate(self) -> None:
+        """Shared Bucket is refilled lazily and does not need activation, the method exists for compatibility."""
+
+    def deactivate(self) -> None:
+        """Shared Bucket is refilled lazily and does not need activation, the method exists for compatibility."""
+
+    def close(self) -> None:
+        """Closes the file of the shared Bucket, the file is kept for other processes."""
+        self._shared.close()
+
+    def __call__(self, f: Optional[Callable[..., Any]] = None, *, cost: CostType = 1) -> Any:
+        if f is None:  # decorator is used with params, e.g. @limiter(cost=5)
+            return partial(self.__call__, cost=cost)
+
+        @wraps(f)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return self.wrap_operation(f, *args, cost=cost, **kwargs)
+
+        return wrapper
+
+    def __enter__(self) -> "ProcessBucketTimeRateLimiter":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.close()
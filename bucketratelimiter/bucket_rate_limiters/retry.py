@@ -0,0 +1,83 @@
+import random
+import threading as th
+from typing import Optional
+
+from .adaptive import ExceptionTypes
+from .algorithms import TokenBucket
+
+
+class RetryPolicy:
+    """
+    Retries of the calls made by wrap_operation or decorator of the limiter which fail with transient errors.
+    Every retry waits for the slots of the limiter again after exponential backoff with jitter, so retries
+    of many callers are spread in time instead of hitting the upstream together right after its hiccup.
+    Retries can be limited by budget: share of the limiter rate the retries can use. Retry which does not
+    fit into the budget is not made and the error is raised, so retries do not crowd out fresh calls.
+    One instance should be used by one limiter.
+    """
+
+    def __init__(
+        self,
+        exceptions: ExceptionTypes,
+        max_attempts: int = 3,
+        base_delay: float = 0.1,
+        max_delay: float = 10.0,
+        multiplier: float = 2.0,
+        jitter: float = 1.0,
+        budget: Optional[float] = None,
+    ) -> None:
+        """
+        :param exceptions: exception types which are retried, e.g. ConnectionError. Other exceptions are raised.
+        :param max_attempts: max number of attempts including the first call.
+        :param base_delay: delay in seconds before the first retry, every next delay is multiplier times longer.
+        :param max_delay: delay is never longer than the value.
+        :param multiplier: factor the delay grows by with every retry.
+        :param jitter: share of the delay which is random, 1.0 - delay is random from 0 to the backoff ("full
+        jitter"), 0.0 - delay is exactly the backoff.
+        :param budget: share of the limiter rate the retries can use, e.g. 0.1 - not more than 10% of the calls
+        are retries (bucket of 10% of max_size slots refilled at 10% of the rate). By default retries are not
+        limited by the budget, but every retry takes the slots of the limiter as any call does.
+        """
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts should be positive integer number, got {max_attempts}")
+        if base_delay < 0 or max_delay < base_delay:
+            raise ValueError(f"delays should satisfy 0 <= base_delay <= max_delay, got {base_delay}, {max_delay}")
+        if multiplier < 1:
+            raise ValueError(f"multiplier should not be less than 1, got {multiplier}")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"jitter should be between 0 and 1, got {jitter}")
+        if budget is not None and not 0 < budget <= 1:
+            raise ValueError(f"budget should be between 0 and 1, got {budget}")
+        self.exceptions: ExceptionTypes = exceptions
+        self.max_attempts: int = max_attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.multiplier: float = multiplier
+        self.jitter: float = jitter
+        self.budget: Optional[float] = budget
+        self._budget_bucket: Optional[TokenBucket] = None  # is created by attach
+        self._lock = th.Lock()  # the policy can be used by threads
+
+    def attach(self, rate: float, max_size: int, now: float) -> None:
+        """Is called by the limiter with its rate and max_size, creates the retry budget."""
+        if self.budget is None or self._budget_bucket is not None:
+            return
+        capacity = max(max_size * self.budget, 1.0)
+        self._budget_bucket = TokenBucket(capacity, capacity / (rate * self.budget), now)
+
+    def should_retry(self, attempt: int, exc: BaseException, now: float) -> bool:
+        """
+        Is called when the attempt (1 - the first call) failed with exc, takes a token of the retry budget.
+        :return: True if the call should be retried.
+        """
+        if attempt >= self.max_attempts or not isinstance(exc, self.exceptions):
+            return False
+        if self._budget_bucket is None:
+            return True
+        with self._lock:
+            return not self._budget_bucket.take(now)
+
+    def backoff(self, attempt: int) -> float:
+        """Returns time in seconds to wait before the retry of the failed attempt (1 - the first call)."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1.0 - self.jitter * random.random())
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class WaitQueue(Generic[T]):
+    """
+    Queue of waiters split into priority lanes, lower priority value is served first,
+    waiters with the same priority are served in FIFO order.
+    If aging is set, priority of the waiter is improved by one every aging seconds it waits,
+    so waiters with low priority are not starved by the endless stream of high priority waiters.
+    All the waiters age at the same pace, so the order of the queued waiters is never changed,
+    only new waiters can overtake the queued ones. Waiters should be unique hashable objects,
+    append, popleft and removal of the waiter from the middle of its lane take O(1) time.
+    """
+
+    __slots__ = ("aging", "_timer", "_lanes", "_priorities", "_head")
+
+    def __init__(self, aging: Optional[float] = None, timer: Callable[[], float] = monotonic) -> None:
+        """
+        :param aging: time in seconds after which the waiter priority is improved by one.
+        :param timer: function which returns current time, is used to know how long the waiters wait.
+        """
+        if aging is not None and aging <= 0:
+            raise ValueError(f"aging should be positive number, got {aging}")
+        self.aging: Optional[float] = aging
+        self._timer: Callable[[], float] = timer
+        # priority -> FIFO queue of waiters, waiter -> time it was queued at
+        self._lanes: Dict[int, "OrderedDict[T, float]"] = {}
+        self._priorities: Dict[T, int] = {}  # waiter -> priority it was queued with
+        self._head: Optional[int] = None  # lane of the first waiter, is cached until the queue is changed
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+    def __bool__(self) -> bool:
+        return bool(self._priorities)
+
+    def append(self, waiter: T, priority: int = 0) -> None:
+        lane = self._lanes.get(priority)
+        if lane is None:
+            lane = self._lanes[priority] = OrderedDict()
+        lane[waiter] = self._timer()
+        self._priorities[waiter] = priority
+        self._head = None
+
+    def _head_lane(self) -> int:
+        if self._head is None:
+            if self.aging is None:
+                self._head = min(self._lanes)
+            else:
+                # priority of the waiter at the moment is priority - (now - queued_at) / aging,
+                # every lane is FIFO, so its first waiter has the best priority in the lane
+                aging = self.aging
+                lanes = self._lanes
+                self._head = min(lanes, key=lambda p: (p + next(iter(lanes[p].values())) / aging, p))
+        return self._head
+
+    def head(self) -> T:
+        """Returns the waiter which should be served first, raises IndexError if the queue is empty."""
+        if not self._priorities:
+            raise IndexError("head of empty queue")
+        return next(iter(self._lanes[self._head_lane()]))
+
+    def popleft(self) -> T:
+        """Removes and returns the waiter which should be served first, raises IndexError if the queue is empty."""
+        if not self._priorities:
+            raise IndexError("pop from empty queue")
+        priority = self._head_lane()
+        lane = self._lanes[priority]
+        waiter, _ = lane.popitem(last=False)
+        if not lane:
+            del self._lanes[priority]
+        del self._priorities[waiter]
+        self._head = None
+        return waiter
+
+    def remove(self, waiter: T) -> bool:
+        """Removes the waiter which does not wait anymore, e.g. it was cancelled. Returns False if it is not queued."""
+        priority = self._priorities.pop(waiter, None)
+        if priority is None:
+            return False
+        lane = self._lanes[priority]
+        del lane[waiter]
+        if not lane:
+            del self._lanes[priority]
+        self._head = None
+        return True
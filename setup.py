@@ -37,7 +37,7 @@ setup(
         "Programming Language :: Python :: 3.10",
         "Programming Language :: Python :: Implementation :: CPython",
     ],
-    packages=find_packages(exclude=["tests", "examples"]),
+    packages=find_packages(exclude=["tests", "examples", "benchmarks"]),
     package_data={"bucketratelimiter": ["py.typed"]},
     install_requires=[],
     python_requires=">=3.6, <4",
@@ -46,6 +46,11 @@ setup(
             "mypy",
             "pytest-cov",
             "pytest-asyncio",
+            "fakeredis",
+            "lupa",
+        ],
+        "redis": [
+            "redis>=4.2",
         ],
     },
     project_urls={
@@ -0,0 +1,85 @@
+import asyncio
+from threading import Thread
+
+import pytest
+
+from bucketratelimiter import AdaptiveRate, AsyncioBucketTimeRateLimiter, MThreadedBucketTimeRateLimiter, VirtualClock
+
+
+class Throttled(Exception):
+    pass
+
+
+def test_additive_increase_multiplicative_decrease():
+    adaptive = AdaptiveRate(min_rate=2, increase=4, exceptions=Throttled)
+    assert adaptive.attach(10) == 10
+    assert adaptive.observe(0, 1, exc=Throttled()) == 5
+    assert adaptive.observe(0.5, 1.5, exc=Throttled()) is None  # the call was made at the old rate
+    assert adaptive.observe(1, 2, exc=Throttled()) == 2.5
+    assert adaptive.observe(2, 3, exc=Throttled()) == 2  # min_rate
+    assert adaptive.observe(3, 4, exc=ValueError()) is None  # other errors do not change the rate
+    assert adaptive.observe(4, 5) == 4  # 2 + 4 / 2
+    assert adaptive.observe(5, 6) == 5
+    for i in range(20):
+        adaptive.observe(6, 7)
+    assert adaptive.rate == 10  # max_rate
+
+
+def test_classifier_and_latency_target():
+    adaptive = AdaptiveRate(max_rate=8, classifier=lambda status: status == 429, latency_target=0.5)
+    assert adaptive.attach(100) == 8
+    assert adaptive.observe(0, 0.1, result=429) == 4
+    assert adaptive.observe(1, 1.6, result=200) == 2  # slow response
+    assert adaptive.observe(2, 2.1, result=200) == 2.5
+
+    with pytest.raises(ValueError):
+        AdaptiveRate(decrease=1)
+    with pytest.raises(ValueError):
+        AsyncioBucketTimeRateLimiter(algorithm="fixed_window", adaptive=AdaptiveRate())
+
+
+def test_asyncio_limiter_adapts_rate():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = AsyncioBucketTimeRateLimiter(
+            max_size=2, recovery_time=0.1, adaptive=AdaptiveRate(exceptions=Throttled, increase=0), clock=clock
+        )
+        assert limiter.rate == 20
+
+        @limiter
+        async def some_func(throttled: bool) -> None:
+            if throttled:
+                raise Throttled
+
+        with pytest.raises(Throttled):
+            await some_func(True)
+        assert limiter.rate == 10
+
+        await some_func(False)  # the bucket is empty now
+        await some_func(False)
+        assert clock.monotonic() == pytest.approx(0.1)  # one slot per 0.1 second at the new rate
+
+    clock.run(scenario())
+
+
+def test_mthreaded_limiter_adapts_rate():
+    clock = VirtualClock()
+    limiter = MThreadedBucketTimeRateLimiter(
+        max_size=2, recovery_time=0.1, adaptive=AdaptiveRate(latency_target=0.02, increase=0), clock=clock
+    )
+    assert limiter.rate == 20
+
+    started = []
+
+    @limiter
+    def some_func(duration: float) -> None:
+        started.append(clock.monotonic())
+        clock.sleep(duration)
+
+    some_func(0.03)  # too slow
+    assert limiter.rate == 10
+    threads = [Thread(target=some_func, args=(0,)) for _ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert started[-1] - started[-2] == pytest.approx(0.1)  # one slot per 0.1 second at the new rate
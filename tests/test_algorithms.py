@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from bucketratelimiter import AsyncioBucketTimeRateLimiter, MThreadedBucketTimeRateLimiter, VirtualClock
+from bucketratelimiter.bucket_rate_limiters.algorithms import Gcra, SlidingWindowCounter, SlidingWindowLog, TokenBucket
+
+
+def test_token_bucket_fractional_refill():
+    bucket = TokenBucket(max_size=4, recovery_time=1.0, now=0.0)
+    for _ in range(4):
+        assert bucket.take(0.0) == 0.0
+    assert bucket.take(0.0) == pytest.approx(0.25)
+    assert bucket.take(0.125) == pytest.approx(0.125)  # half of token is already refilled
+    assert bucket.take(0.25) == 0.0
+    assert bucket.take(10.0, cost=4) == 0.0  # bucket can not hold more than max_size tokens
+    assert bucket.take(10.0) == pytest.approx(0.25)
+
+
+def test_token_bucket_refund():
+    bucket = TokenBucket(max_size=2, recovery_time=1.0, now=0.0)
+    bucket.consume(0.0, cost=2)
+    bucket.refund(0.0)
+    assert bucket.take(0.0) == 0.0
+    bucket.refund(0.0, cost=10)
+    assert bucket.tokens == 2.0
+
+
+def test_sliding_window_counter():
+    bucket = SlidingWindowCounter(max_size=4, recovery_time=1.0, now=0.5)
+    bucket.consume(0.5, cost=4)
+    assert bucket.take(0.9) == pytest.approx(0.35)  # the calls of the window slide out in the next window
+    # at 1.25 3/4 of the previous window is still in the sliding window: 3 calls, so 1 call is allowed
+    assert bucket.wait_time(1.0) == pytest.approx(0.25)
+    assert bucket.take(1.25) == 0.0
+    assert bucket.take(1.25) == pytest.approx(0.25)
+    bucket.refund(1.25)
+    assert bucket.take(1.25) == 0.0
+    assert bucket.wait_time(1.25, cost=8) == pytest.approx(1.75 + 1.0)  # 4 calls at 3.0, 4 more in a second
+
+
+def test_sliding_window_log():
+    bucket = SlidingWindowLog(max_size=3, recovery_time=1.0, now=0.0)
+    for moment in (0.0, 0.2, 0.2):
+        assert bucket.take(moment) == 0.0
+    assert bucket.take(0.5) == pytest.approx(0.5)  # the call at 0.0 slides out at 1.0
+    assert bucket.take(0.5, cost=2) == pytest.approx(0.7)
+    assert bucket.take(1.0) == 0.0
+    bucket.refund(1.0, cost=2)  # the call at 1.0 and one call at 0.2 are removed
+    assert bucket.count == 1
+    assert bucket.take(1.0, cost=2) == 0.0
+    assert bucket.wait_time(1.0, cost=5) == pytest.approx(1.0 + 2 / 3)
+
+
+def test_gcra_matches_token_bucket():
+    gcra = Gcra(max_size=4, recovery_time=1.0, now=0.0)
+    bucket = TokenBucket(max_size=4, recovery_time=1.0, now=0.0)
+    for moment, cost in ((0.0, 3), (0.0, 1), (0.0, 1), (0.1, 1), (0.3, 2), (2.0, 4), (2.0, 1)):
+        assert gcra.take(moment, cost) == pytest.approx(bucket.take(moment, cost))
+    gcra.refund(2.0, cost=2)
+    assert gcra.take(2.0, cost=2) == 0.0
+    assert gcra.rate == 4.0
+
+
+def test_no_burst_at_window_boundary():
+    clock = VirtualClock(start=0.99)
+    limiter = MThreadedBucketTimeRateLimiter(
+        max_size=4, recovery_time=1.0, algorithm="sliding_window_log", clock=clock
+    )
+    granted = []
+    for _ in range(12):
+        limiter.acquire()
+        granted.append(clock.monotonic())
+    # not more than 4 calls in any second, fixed window would grant 8 calls between 0.99 and 1.0
+    assert granted == [0.99] * 4 + [1.99] * 4 + [2.99] * 4
+
+
+@pytest.mark.parametrize(
+    "algorithm, expected",
+    [
+        ("sliding_window_counter", [0.0] * 4 + [1.25, 1.5, 1.75, 2.0]),
+        ("sliding_window_log", [0.0] * 4 + [1.0] * 4),
+        ("gcra", [0.0] * 4 + [0.25, 0.5, 0.75, 1.0]),
+    ],
+)
+def test_asyncio_limiter_algorithms(algorithm, expected):
+    clock = VirtualClock()
+
+    async def scenario() -> list:
+        limiter = AsyncioBucketTimeRateLimiter(max_size=4, recovery_time=1.0, algorithm=algorithm, clock=clock)
+        granted = []
+
+        async def call() -> None:
+            await limiter.acquire()
+            granted.append(clock.monotonic())
+
+        await asyncio.gather(*(call() for _ in range(8)))
+        return granted
+
+    assert clock.run(scenario()) == pytest.approx(expected)
+
+
+def test_leaky_bucket_paces_calls():
+    bucket = Gcra(max_size=4, recovery_time=1.0, now=0.0, burst=2)
+    assert bucket.take(0.0) == 0.0
+    assert bucket.take(0.0) == 0.0  # burst of two calls after idle time
+    assert bucket.take(0.0) == pytest.approx(0.25)
+    assert bucket.take(0.25) == 0.0
+    assert bucket.take(0.3) == pytest.approx(0.2)
+    assert bucket.take(5.0, cost=3) == 0.0  # weighted call which costs more than burst goes after idle time
+    assert bucket.take(5.0) == pytest.approx(0.5)  # and the next call waits for its intervals
+
+
+def test_leaky_bucket_limiters():
+    clock = VirtualClock()
+    limiter = MThreadedBucketTimeRateLimiter(max_size=4, recovery_time=1.0, algorithm="leaky_bucket", clock=clock)
+    granted = []
+    for _ in range(4):
+        limiter.acquire()
+        granted.append(clock.monotonic())
+    assert granted == pytest.approx([0.0, 0.25, 0.5, 0.75])
+    # calls which cost more than burst are allowed when the bucket is idle
+    assert limiter.reserve(2) == pytest.approx(0.25)
+    assert not limiter.try_acquire(2)
+    clock.sleep(0.25)
+    assert limiter.reserve(2) == 0.0
+    assert limiter.try_acquire(2)
+    limiter.acquire(3)
+    assert clock.monotonic() == pytest.approx(1.5)
+
+    async def scenario() -> list:
+        limiter = AsyncioBucketTimeRateLimiter(
+            max_size=10, recovery_time=1.0, algorithm="leaky_bucket", burst=3, clock=clock
+        )
+        started = []
+
+        @limiter
+        async def call() -> None:
+            started.append(asyncio.get_event_loop().time())
+
+        await asyncio.gather(*(call() for _ in range(5)))
+        return started
+
+    start = clock.monotonic()
+    assert clock.run(scenario()) == pytest.approx([start] * 3 + [start + 0.1, start + 0.2])
+
+    with pytest.raises(ValueError):
+        AsyncioBucketTimeRateLimiter(max_size=4, algorithm="gcra", burst=2)
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(max_size=4, algorithm="leaky_bucket", burst=5)
@@ -1,10 +1,16 @@
 import asyncio
-from time import monotonic
+import math
 from typing import NamedTuple, Callable, Union, Awaitable, Coroutine
 
 import pytest
 
-from bucketratelimiter import AsyncioBucketTimeRateLimiter
+from bucketratelimiter import (
+    AcquireTimeoutError,
+    AsyncioBucketTimeRateLimiter,
+    InMemoryBackend,
+    LimiterOverloadedError,
+    VirtualClock,
+)
 
 
 AsyncFuncType = Callable[..., Union[Awaitable, Coroutine]]
@@ -31,23 +37,26 @@ async def worker(q: asyncio.Queue, func: AsyncioBucketTimeRateLimiter, sleep_tim
         q.task_done()
 
 
-async def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task: bool = False) -> int:
-    """Main entry point of our asyncio tests."""
+async def main_entry_point(
+    env_params: EnvironmentParams, clock: VirtualClock, broken_reactivate_task: bool = False
+) -> float:
+    """Main entry point of our asyncio tests, runs in virtual time of the clock."""
     e = env_params
 
     callback = None
     if e.use_callback_func:
         callback = callback_func
 
-    bucket = AsyncioBucketTimeRateLimiter(max_size=e.max_bucket_size, recovery_time=e.recovery_time, callback=callback)
+    bucket = AsyncioBucketTimeRateLimiter(
+        max_size=e.max_bucket_size, recovery_time=e.recovery_time, callback=callback, clock=clock
+    )
 
     @bucket
     async def some_func_to_limit(sleep_time: float = 1.0) -> None:
         await asyncio.sleep(sleep_time)
         return
 
-    start = monotonic()
-    print(start)
+    start = clock.monotonic()
     q = asyncio.Queue()
     for task in range(e.tasks_number):
         await q.put(task)  # send all tasks to the Queue
@@ -64,11 +73,10 @@ async def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task
             bucket.reactivate_task = None
 
     [i.cancel() for i in asyncio_tasks_to_cancel]
-    return int(monotonic() - start)
+    return clock.monotonic() - start
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_1():
+def test_wrapper_main_entry_point_1():
     e = EnvironmentParams(
         max_bucket_size=4,
         recovery_time=1.0,
@@ -78,12 +86,12 @@ async def test_wrapper_main_entry_point_1():
         time_to_finish_one_task=1.0,
         expected_finish_time=5,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_2():
+def test_wrapper_main_entry_point_2():
     e = EnvironmentParams(
         max_bucket_size=10,
         recovery_time=1.0,
@@ -93,12 +101,12 @@ async def test_wrapper_main_entry_point_2():
         time_to_finish_one_task=1.0,
         expected_finish_time=2,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_3():
+def test_wrapper_main_entry_point_3():
     e = EnvironmentParams(
         max_bucket_size=2,
         recovery_time=1.0,
@@ -108,12 +116,12 @@ async def test_wrapper_main_entry_point_3():
         time_to_finish_one_task=1.0,
         expected_finish_time=10,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_4():
+def test_wrapper_main_entry_point_4():
     e = EnvironmentParams(
         max_bucket_size=10,
         recovery_time=1.0,
@@ -123,12 +131,12 @@ async def test_wrapper_main_entry_point_4():
         time_to_finish_one_task=1.0,
         expected_finish_time=2,
     )
-    res = await main_entry_point(e, broken_reactivate_task=True)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock, broken_reactivate_task=True))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_5():
+def test_wrapper_main_entry_point_5():
     e = EnvironmentParams(
         max_bucket_size=10,
         recovery_time=1.0,
@@ -138,12 +146,12 @@ async def test_wrapper_main_entry_point_5():
         time_to_finish_one_task=1.0,
         expected_finish_time=6,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_6():
+def test_wrapper_main_entry_point_6():
     e = EnvironmentParams(
         max_bucket_size=10,
         recovery_time=1.0,
@@ -153,12 +161,12 @@ async def test_wrapper_main_entry_point_6():
         time_to_finish_one_task=2.0,
         expected_finish_time=3,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_7():
+def test_wrapper_main_entry_point_7():
     e = EnvironmentParams(
         max_bucket_size=10,
         recovery_time=1.0,
@@ -168,12 +176,12 @@ async def test_wrapper_main_entry_point_7():
         time_to_finish_one_task=5.0,
         expected_finish_time=6,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
-@pytest.mark.asyncio
-async def test_wrapper_main_entry_point_8():
+def test_wrapper_main_entry_point_8():
     e = EnvironmentParams(
         max_bucket_size=5,
         recovery_time=1.0,
@@ -183,7 +191,8 @@ async def test_wrapper_main_entry_point_8():
         time_to_finish_one_task=5.0,
         expected_finish_time=8,
     )
-    res = await main_entry_point(e)
+    clock = VirtualClock()
+    res = clock.run(main_entry_point(e, clock))
     assert e.expected_finish_time == res
 
 
@@ -191,3 +200,416 @@ def test__decrement():
     bucket = AsyncioBucketTimeRateLimiter(max_size=1)
     for i in range(10):
         bucket._decrement()
+
+
+def test_waiters_are_woken_right_after_refill():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        # rest_time is huge, waiters must not depend on it anymore
+        bucket = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.3, rest_time=10.0, clock=clock)
+        started = []
+
+        async def some_func(n: int) -> None:
+            started.append((n, clock.monotonic()))
+
+        async with bucket:
+            await asyncio.gather(*[bucket.wrap_operation(some_func, n) for n in range(6)])
+
+        assert [n for n, _ in started] == list(range(6))  # FIFO order
+        assert [t for _, t in started] == pytest.approx([0.0, 0.0, 0.3, 0.3, 0.6, 0.6])
+
+    clock.run(scenario())
+
+
+def test_cancelled_waiter_does_not_consume_slot():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=0.2, clock=clock)
+        started = []
+
+        async def some_func(n: int) -> None:
+            started.append(n)
+
+        async with bucket:
+            await bucket.wrap_operation(some_func, 0)
+            cancelled = asyncio.ensure_future(bucket.wrap_operation(some_func, 1))
+            waiting = asyncio.ensure_future(bucket.wrap_operation(some_func, 2))
+            await asyncio.sleep(0.05)
+            cancelled.cancel()
+            await waiting
+
+        assert started == [0, 2]
+        assert clock.monotonic() == pytest.approx(0.2)  # the cancelled waiter did not take the refilled slot
+        assert bucket.active_slots == 0
+
+    clock.run(scenario())
+
+
+def test_token_bucket_algorithm_without_activation():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+        started = []
+
+        async def some_func(n: int) -> None:
+            started.append((n, clock.monotonic()))
+
+        await asyncio.gather(*[bucket.wrap_operation(some_func, n) for n in range(6)])
+
+        assert bucket.reactivate_task is None
+        assert [n for n, _ in started] == list(range(6))
+        # 2 calls at once, then the bucket is refilled continuously with one token every 0.1 second
+        assert [t for _, t in started] == pytest.approx([0.0, 0.0, 0.1, 0.2, 0.3, 0.4])
+
+    clock.run(scenario())
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        AsyncioBucketTimeRateLimiter(algorithm="unknown")
+
+
+def test_weighted_calls():
+    clock = VirtualClock()
+
+    async def scenario() -> list:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=10, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+        started = []
+
+        async def record(items: list) -> None:
+            started.append((len(items), clock.monotonic()))
+
+        bulk = bucket(cost=lambda items: len(items))(record)
+        await asyncio.gather(bulk([1] * 8), bulk([1] * 5), bucket.wrap_operation(record, [1], cost=3))
+        return started
+
+    started = clock.run(scenario())
+    # 8 slots at once, then 5 slots are refilled after 3 / 50 seconds, then 3 slots after 3 / 50 seconds more
+    assert [n for n, _ in started] == [8, 5, 1]
+    assert [t for _, t in started] == pytest.approx([0.0, 0.06, 0.12])
+
+
+def test_weighted_calls_fixed_window():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=4, recovery_time=0.2, clock=clock)
+        async with bucket:
+            await bucket.acquire(3)
+            await bucket.acquire(2)  # waits for the refill, one slot is not enough
+            assert clock.monotonic() == pytest.approx(0.2)
+            assert bucket.active_slots == 2
+            with pytest.raises(ValueError):
+                await bucket.acquire(5)
+
+    clock.run(scenario())
+
+
+def test_try_acquire_reserve_and_slot():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+        assert bucket.reserve() == 0.0
+        assert bucket.try_acquire(2)
+        assert not bucket.try_acquire()
+        assert bucket.reserve() == pytest.approx(0.1)
+
+        async with bucket.slot():
+            assert clock.monotonic() == pytest.approx(0.1)
+        waiter = asyncio.ensure_future(bucket.acquire(2))
+        await asyncio.sleep(0)
+        assert bucket.reserve() == pytest.approx(0.3)  # the waiter ahead waits for 2 slots
+        await waiter
+        assert bucket.reserve() == pytest.approx(0.1)
+
+    clock.run(scenario())
+
+
+def test_reserve_fixed_window():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.2, clock=clock)
+        assert bucket.reserve() == math.inf  # the limiter is not activated
+        async with bucket:
+            assert bucket.try_acquire(2)
+            assert bucket.reserve() == pytest.approx(0.2)
+            assert bucket.reserve(3) == pytest.approx(0.4)
+
+    clock.run(scenario())
+
+
+@pytest.mark.parametrize("with_backend", [False, True])
+def test_max_concurrency(with_backend):
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(
+            max_size=10,
+            recovery_time=1,
+            algorithm="token_bucket",
+            backend=InMemoryBackend(clock) if with_backend else None,
+            max_concurrency=2,
+            clock=clock,
+        )
+        in_flight = []
+
+        @bucket
+        async def some_func(fail: bool) -> None:
+            in_flight.append(bucket.in_flight)
+            await asyncio.sleep(0.05)
+            if fail:
+                raise RuntimeError
+
+        results = await asyncio.gather(*[some_func(i % 2 == 0) for i in range(6)], return_exceptions=True)
+        assert clock.monotonic() == pytest.approx(0.15)  # 3 rounds of 2 concurrent calls
+        assert max(in_flight) == 2
+        assert sum(isinstance(res, RuntimeError) for res in results) == 3
+        assert bucket.in_flight == 0  # failed calls released their slots too
+
+        async with bucket.slot():
+            assert await bucket.atry_acquire()
+            assert not await bucket.atry_acquire()  # tokens are available, but concurrency slots are not
+            bucket.release()
+        assert bucket.in_flight == 0
+
+    clock.run(scenario())
+    with pytest.raises(ValueError):
+        AsyncioBucketTimeRateLimiter(max_concurrency=0)
+
+
+def test_max_concurrency_with_rate_limit():
+    clock = VirtualClock()
+
+    async def scenario() -> list:
+        bucket = AsyncioBucketTimeRateLimiter(
+            max_size=2, recovery_time=0.2, algorithm="token_bucket", max_concurrency=1, clock=clock
+        )
+        started = []
+
+        async def some_func(duration: float) -> None:
+            started.append(clock.monotonic())
+            await asyncio.sleep(duration)
+
+        # the first call blocks the others by concurrency, then the calls wait for tokens
+        await asyncio.gather(*[bucket.wrap_operation(some_func, d) for d in (0.15, 0.0, 0.0, 0.0)])
+        return started
+
+    assert clock.run(scenario()) == pytest.approx([0.0, 0.15, 0.15, 0.25])
+
+
+@pytest.mark.parametrize("with_backend", [False, True])
+def test_priority(with_backend):
+    clock = VirtualClock()
+
+    async def scenario() -> list:
+        bucket = AsyncioBucketTimeRateLimiter(
+            max_size=2,
+            recovery_time=0.1,
+            algorithm="token_bucket",
+            backend=InMemoryBackend(clock) if with_backend else None,
+            clock=clock,
+        )
+        assert await bucket.atry_acquire(2)
+        order = []
+
+        async def some_func(name: str) -> None:
+            order.append(name)
+
+        tasks = []
+        for name, priority in (("backfill 1", 10), ("backfill 2", 10), ("user 1", 0), ("user 2", 0)):
+            tasks.append(asyncio.ensure_future(bucket.wrap_operation(some_func, name, priority=priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert clock.monotonic() == pytest.approx(0.2)
+        return order
+
+    # user calls overtake the backfill calls which are already waiting, but the waiter which already sleeps
+    # until the storage backend has tokens for it is not overtaken
+    expected = ["user 1", "user 2", "backfill 1", "backfill 2"]
+    if with_backend:
+        expected = ["backfill 1", "user 1", "user 2", "backfill 2"]
+    assert clock.run(scenario()) == expected
+
+
+def test_high_priority_waiter_does_not_wait_for_low_priority_one():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=4, recovery_time=0.4, algorithm="token_bucket", clock=clock)
+        assert bucket.try_acquire(4)
+        heavy = asyncio.ensure_future(bucket.acquire(4, priority=1))
+        await asyncio.sleep(0)
+        async with bucket.slot(priority=0):
+            assert clock.monotonic() == pytest.approx(0.1)  # overtakes the heavy call, which waits 0.4 second
+        await heavy
+
+    clock.run(scenario())
+
+
+def test_map_and_as_completed():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+        pulled = []
+
+        def items():
+            for i in range(5):
+                pulled.append(i)
+                yield i
+
+        async def some_func(i: int) -> int:
+            await asyncio.sleep(0.01 * (5 - i))
+            return i
+
+        results = []
+        async for res in bucket.map(some_func, items(), concurrency=2):
+            results.append(res)
+            assert len(pulled) <= len(results) + 2  # items are pulled lazily
+        assert results == [0, 1, 2, 3, 4]
+        assert clock.monotonic() == pytest.approx(0.16)  # 2 calls at once, then one call every 0.05 second
+
+        async def async_items():
+            for i in range(4):
+                yield i
+
+        bucket = AsyncioBucketTimeRateLimiter(max_size=10, recovery_time=1, algorithm="token_bucket", clock=clock)
+        # the calls of the later items are shorter
+        assert [res async for res in bucket.as_completed(some_func, async_items())] == [3, 2, 1, 0]
+
+    clock.run(scenario())
+
+
+def test_map_raises_and_cancels_the_calls():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=10, recovery_time=1, algorithm="token_bucket", clock=clock)
+        finished = []
+
+        async def some_func(i: int) -> int:
+            if i == 0:
+                raise RuntimeError
+            await asyncio.sleep(0.05)
+            finished.append(i)
+            return i
+
+        with pytest.raises(RuntimeError):
+            async for _ in bucket.map(some_func, range(10), concurrency=3):
+                pass
+        await asyncio.sleep(0.1)
+        assert finished == []  # the calls in progress were cancelled
+
+        with pytest.raises(ValueError):
+            bucket.map(some_func, range(10), concurrency=-1)
+
+    clock.run(scenario())
+
+
+def test_acquire_timeout_and_deadline():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=1.0, algorithm="token_bucket", clock=clock)
+        await bucket.acquire()
+        with pytest.raises(AcquireTimeoutError):
+            await bucket.acquire(timeout=0.5)  # the slot is refilled at 1.0
+        assert clock.monotonic() == 0.5
+        first = asyncio.ensure_future(bucket.acquire())
+        second = asyncio.ensure_future(bucket.acquire(deadline=1.5))  # would get the slot at 2.0
+        await asyncio.sleep(0)
+        assert bucket.stats()["waiters"] == 2
+        with pytest.raises(AcquireTimeoutError):
+            await second
+        assert first.done() and clock.monotonic() == 1.5
+        await bucket.acquire()  # the timed out waiter has not taken the slot
+        assert clock.monotonic() == 2.0
+        with pytest.raises(AcquireTimeoutError):
+            await bucket.acquire(deadline=1.0)  # the deadline has already passed
+
+        @bucket(acquire_timeout=0.1)
+        async def some_func() -> None:
+            pass
+
+        with pytest.raises(AcquireTimeoutError):
+            await some_func()
+        with pytest.raises(AcquireTimeoutError):
+            async with bucket.slot(timeout=0.1):
+                pass
+        stats = bucket.stats()
+        assert (stats["timed_out"], stats["waiters"], stats["queued_slots"], stats["granted"]) == (5, 0, 0, 3)
+
+    clock.run(scenario())
+
+
+def test_load_shedding():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(
+            max_size=2, recovery_time=1.0, algorithm="token_bucket", max_waiters=2, max_wait=1.0, clock=clock
+        )
+        await bucket.acquire(2)
+        waiters = [asyncio.ensure_future(bucket.acquire()) for _ in range(2)]  # estimated waits 0.5 and 1.0
+        await asyncio.sleep(0)
+        with pytest.raises(LimiterOverloadedError):
+            await bucket.acquire()  # queue is full
+        waiters[1].cancel()
+        await asyncio.sleep(0)
+        assert bucket.stats()["waiters"] == 1  # the cancelled waiter left the queue
+        with pytest.raises(LimiterOverloadedError):
+            await bucket.acquire(2)  # estimated wait is 1.5
+        await asyncio.gather(waiters[0], bucket.acquire())
+        assert clock.monotonic() == 1.0
+        assert bucket.stats()["shed"] == 2
+
+    clock.run(scenario())
+    with pytest.raises(ValueError):
+        AsyncioBucketTimeRateLimiter(backend=InMemoryBackend(), max_wait=1.0)
+
+
+def test_storage_backend_acquire_timeout():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        bucket = AsyncioBucketTimeRateLimiter(
+            max_size=1, recovery_time=1.0, backend=InMemoryBackend(clock), max_waiters=1, clock=clock
+        )
+        await bucket.acquire()
+        with pytest.raises(AcquireTimeoutError):
+            await bucket.acquire(timeout=0.5)  # the backend refills the token in 1 second, there is no point to wait
+        assert clock.monotonic() == 0.0
+        assert bucket.stats()["timed_out"] == 1
+
+    clock.run(scenario())
+
+
+@pytest.mark.asyncio
+async def test_deactivated_limiter_is_not_polled():
+    bucket = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=0.1)
+    bucket.activate()
+    await bucket.acquire()
+    bucket.deactivate()
+    assert bucket.reserve() == math.inf  # the bucket is not refilled anymore
+    wakeups = 0
+    on_wakeup = bucket._on_wakeup
+
+    def counting_on_wakeup() -> None:
+        nonlocal wakeups
+        wakeups += 1
+        on_wakeup()
+
+    bucket._on_wakeup = counting_on_wakeup
+    waiter = asyncio.ensure_future(bucket.acquire())
+    await asyncio.sleep(0.3)
+    assert not waiter.done()
+    assert wakeups == 0  # the waiter is woken up by the refill after activation instead of polling the bucket
+    bucket.activate()
+    assert 0.1 < bucket.reserve() <= 0.2  # the waiter ahead takes the first refill
+    await asyncio.wait_for(waiter, 1)
+    bucket.deactivate()
@@ -0,0 +1,263 @@
+import asyncio
+from functools import partial
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+from bucketratelimiter import (
+    AcquireTimeoutError,
+    AsyncioBucketTimeRateLimiter,
+    InMemoryBackend,
+    LeasingBackend,
+    MThreadedBucketTimeRateLimiter,
+    RedisBackend,
+    SharedMemoryBackend,
+    StorageBackendABC,
+    VirtualClock,
+)
+
+
+def redis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis needs lupa to run Lua scripts
+    server = fakeredis.FakeServer()
+    return RedisBackend(
+        client=fakeredis.FakeRedis(server=server),
+        async_client=fakeredis.FakeAsyncRedis(server=server),
+    )
+
+
+class CountingBackend(StorageBackendABC):
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = 0
+
+    def update(self, key, max_size, recovery_time, cost, mode):
+        self.calls += 1
+        return self.backend.update(key, max_size, recovery_time, cost, mode)
+
+
+@pytest.fixture(params=["memory", "shared_memory", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBackend()
+    if request.param == "shared_memory":
+        return SharedMemoryBackend(directory=str(tmp_path))
+    return redis_backend()
+
+
+def test_backend_update(backend):
+    # the backends use their own clocks, time passes between the calls, so the waits can only be shorter
+    assert backend.update("key", 2, 0.2, 1, "peek") == 0.0
+    assert backend.update("key", 2, 0.2, 2, "try") == 0.0
+    assert 0.0 < backend.update("key", 2, 0.2, 1, "try") <= 0.1
+    assert 0.0 < backend.update("key", 2, 0.2, 1, "reserve") <= 0.1  # goes into debt
+    assert 0.1 < backend.update("key", 2, 0.2, 1, "peek") <= 0.2
+    backend.update("key", 2, 0.2, -2, "reserve")  # return tokens back
+    assert backend.update("key", 2, 0.2, 1, "peek") == 0.0
+    assert backend.update("other", 2, 0.2, 2, "try") == 0.0  # keys have separate buckets
+
+
+def test_mthreaded_limiters_share_backend_bucket(backend):
+    limiters = [
+        MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.2, backend=backend, name="api") for _ in range(2)
+    ]
+    started = []
+    start = monotonic()
+    threads = [
+        Thread(target=limiter.wrap_operation, args=(started.append, 1)) for limiter in limiters for _ in range(3)
+    ]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    # 2 calls at once, then one call every 0.1 second for both limiters together
+    assert 0.4 <= monotonic() - start < 0.5
+    assert len(started) == 6
+
+
+@pytest.mark.asyncio
+async def test_asyncio_limiter_with_backend(backend):
+    limiter = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.2, backend=backend)
+    started = []
+
+    async def some_func() -> None:
+        started.append(monotonic())
+
+    start = monotonic()
+    await asyncio.gather(*[limiter.wrap_operation(some_func) for _ in range(5)])
+
+    for t, expected in zip(sorted(started), [0.0, 0.0, 0.1, 0.2, 0.3]):
+        assert expected <= t - start < expected + 0.05
+    assert not await limiter.atry_acquire()
+    assert 0 < await limiter.areserve() <= 0.1
+    with pytest.raises(RuntimeError):
+        limiter.try_acquire()  # sync call to the backend would block the event loop
+    with pytest.raises(RuntimeError):
+        limiter.reserve()
+
+
+def test_backend_requires_token_bucket():
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(backend=InMemoryBackend(), algorithm="fixed_window")
+
+
+def test_shared_memory_backend_keeps_files_in_its_directory(tmp_path):
+    directory = tmp_path / "buckets"
+    directory.mkdir()
+    backend = SharedMemoryBackend(directory=str(directory))
+    keys = ["../escape", "a/b", "a_b", "/absolute", "..", "x" * 1000]
+    for key in keys:
+        assert backend.update(key, 1, 100, 1, "try") == 0.0
+    backend.close()
+    assert [path.name for path in tmp_path.iterdir()] == ["buckets"]
+    assert len(list(directory.iterdir())) == len(keys)  # keys which look alike do not share the bucket
+
+
+def test_leasing_backend_serves_calls_locally():
+    shared = CountingBackend(InMemoryBackend())
+    backend = LeasingBackend(shared, max_lease=8, lease_ttl=10)
+    assert all(backend.update("key", 100, 10, 1, "try") == 0.0 for _ in range(50))
+    # leases of 1, 2, 4, 8, 8, ... tokens
+    assert shared.calls == 9
+    assert shared.backend.update("key", 100, 10, 1, "peek") == 0.0
+    assert shared.backend.update("key", 100, 10, 47, "peek") > 0  # 6 leased tokens are not used yet
+
+    backend.close()
+    assert shared.backend.update("key", 100, 10, 50, "peek") == 0.0
+
+
+def test_leasing_backend_returns_expired_lease():
+    clock = VirtualClock()
+    shared = InMemoryBackend(clock)
+    backend = LeasingBackend(shared, min_lease=4, lease_ttl=10, clock=clock)
+    assert backend.update("key", 4, 100, 1, "try") == 0.0
+    assert shared.update("key", 4, 100, 1, "peek") > 0  # all tokens are leased
+
+    clock.advance(9.9)
+    assert backend.update("key", 4, 100, 0, "peek") == 0.0
+    assert shared.update("key", 4, 100, 1, "peek") > 0  # the lease has not expired yet
+    clock.advance(0.1)
+    assert backend.update("key", 4, 100, 0, "peek") == 0.0
+    assert shared.update("key", 4, 100, 3, "peek") == 0.0  # unused tokens are returned
+
+
+class InterleavingBackend(StorageBackendABC):
+    """Makes the call of on_update once before its first round-trip, e.g. the call of another thread."""
+
+    def __init__(self, backend, on_update):
+        self.backend = backend
+        self.on_update = on_update
+
+    def update(self, key, max_size, recovery_time, cost, mode):
+        on_update, self.on_update = self.on_update, None
+        if on_update is not None:
+            on_update()
+        return self.backend.update(key, max_size, recovery_time, cost, mode)
+
+
+def test_leasing_backend_does_not_spend_local_tokens_twice():
+    shared = InterleavingBackend(InMemoryBackend(), None)
+    backend = LeasingBackend(shared, min_lease=2, max_lease=2, lease_ttl=1000)
+    granted = []
+
+    def call(cost: int) -> None:
+        if not backend.update("key", 3, 1000, cost, "try"):
+            granted.append(cost)
+
+    call(1)  # 2 tokens are leased, 1 is left locally
+    # the call of 2 tokens takes the local token, and another call comes while it asks the shared backend
+    shared.on_update = partial(call, 1)
+    call(2)
+    for _ in range(3):
+        call(1)
+    assert sum(granted) == 3  # the shared bucket has 3 tokens
+
+    backend = LeasingBackend(InMemoryBackend(), max_lease=1)
+    assert backend.update("key", 3, 1000, 3, "try") == 0.0  # the call costs more than max_lease
+    assert backend.update("key", 3, 1000, 1, "try") > 0
+
+
+def test_leasing_backends_share_limit(backend):
+    leasing = [LeasingBackend(backend, max_lease=4) for _ in range(3)]
+    taken = sum(not b.update("key", 10, 100, 1, "try") for _ in range(10) for b in leasing)
+    assert taken == 10
+    wait = leasing[0].update("key", 10, 100, 1, "reserve")
+    assert wait == pytest.approx(10, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_asyncio_limiter_with_leasing_backend():
+    shared = CountingBackend(InMemoryBackend())
+    limiter = AsyncioBucketTimeRateLimiter(max_size=100, recovery_time=1, backend=LeasingBackend(shared))
+    await asyncio.gather(*[limiter.acquire() for _ in range(100)])
+    assert shared.calls < 10
+    assert not await limiter.atry_acquire()
+
+
+@pytest.mark.asyncio
+async def test_asyncio_limiter_with_async_only_redis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    limiter = AsyncioBucketTimeRateLimiter(
+        max_size=1, recovery_time=1.0, backend=RedisBackend(async_client=fakeredis.FakeAsyncRedis())
+    )
+    assert await limiter.areserve() == 0.0
+    assert await limiter.atry_acquire()
+    assert not await limiter.atry_acquire()
+    assert await limiter.areserve() == pytest.approx(1.0, abs=0.1)
+
+
+class LockCheckingBackend(StorageBackendABC):
+    """Fails if the round-trip is made while the limiter lock is held."""
+
+    def __init__(self):
+        self.backend = InMemoryBackend()
+        self.limiter = None
+
+    def update(self, key, max_size, recovery_time, cost, mode):
+        assert not self.limiter.sync_lock.locked()
+        sleep(0.001)  # network round-trip
+        return self.backend.update(key, max_size, recovery_time, cost, mode)
+
+
+def test_mthreaded_backend_round_trips_without_lock():
+    backend = LockCheckingBackend()
+    limiter = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.1, backend=backend, max_concurrency=2)
+    backend.limiter = limiter
+    errors = []
+
+    def call() -> None:
+        try:
+            limiter.wrap_operation(sleep, 0.01)
+        except BaseException as exc:  # assertion of the backend
+            errors.append(exc)
+
+    threads = [Thread(target=call) for _ in range(6)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert errors == []
+    stats = limiter.stats()
+    assert (stats["granted"], stats["waiters"], stats["in_flight"]) == (6, 0, 0)
+    assert limiter.reserve() > 0 or limiter.try_acquire()
+
+
+def test_mthreaded_backend_acquire_timeout():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=10.0, backend=InMemoryBackend())
+    limiter.acquire()
+    errors = []
+
+    def call() -> None:
+        try:
+            limiter.acquire(timeout=0.05)
+        except AcquireTimeoutError as exc:
+            errors.append(exc)
+
+    start = monotonic()
+    threads = [Thread(target=call) for _ in range(3)]  # one waits for the tokens, others for their turn
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(errors) == 3
+    assert monotonic() - start < 1
+    stats = limiter.stats()
+    assert (stats["timed_out"], stats["waiters"]) == (3, 0)
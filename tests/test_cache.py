@@ -0,0 +1,120 @@
+import asyncio
+import threading as th
+from time import sleep
+
+import pytest
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    CallCache,
+    HybridBucketTimeRateLimiter,
+    MThreadedBucketTimeRateLimiter,
+    VirtualClock,
+)
+
+
+def test_identical_coroutines_share_one_call_and_token():
+    clock = VirtualClock()
+    cache = CallCache(ttl=10.0)
+
+    async def scenario() -> list:
+        limiter = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=1.0, algorithm="token_bucket", clock=clock)
+        calls = []
+
+        @limiter(cache=cache)
+        async def lookup(user_id: int, fail: bool = False) -> str:
+            calls.append((user_id, clock.monotonic()))
+            await asyncio.sleep(0.5)
+            if fail:
+                raise LookupError
+            return f"user {user_id}"
+
+        assert await asyncio.gather(*(lookup(1) for _ in range(5))) == ["user 1"] * 5
+        assert await lookup(1) == "user 1"  # the kept result takes no token
+        assert await lookup(2) == "user 2"  # waits for the token
+        await asyncio.sleep(10.0)
+        assert await lookup(1) == "user 1"  # the result has expired
+        results = await asyncio.gather(*(lookup(3, fail=True) for _ in range(2)), return_exceptions=True)
+        assert [type(res) for res in results] == [LookupError, LookupError]
+        with pytest.raises(LookupError):
+            await lookup(3, fail=True)  # the exception is not kept
+        assert limiter.stats()["granted"] == 5
+        return calls
+
+    assert clock.run(scenario()) == [(1, 0.0), (2, 1.0), (1, 11.5), (3, 12.5), (3, 13.5)]
+    assert cache.stats() == {"hits": 1, "shared": 5, "misses": 5, "size": 2}
+
+
+def test_identical_thread_calls_share_one_call():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=10, recovery_time=1.0, algorithm="token_bucket")
+    cache = CallCache(ttl=0)  # only concurrent calls are shared
+    calls = []
+
+    @limiter(cache=cache)
+    def lookup(user_id: int) -> int:
+        calls.append(user_id)
+        sleep(0.1)
+        return user_id * 2
+
+    results = []
+    threads = [th.Thread(target=lambda: results.append(lookup(7))) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert (calls, results) == ([7], [14] * 8)
+    assert lookup(7) == 14
+    assert calls == [7, 7]
+    assert limiter.stats()["granted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_unhashable_args():
+    limiter = HybridBucketTimeRateLimiter(max_size=100, recovery_time=1.0, algorithm="token_bucket")
+    cache = CallCache(ttl=60.0, max_size=2, key=lambda items, **kwargs: tuple(items))
+
+    @limiter(cache=cache)
+    async def total(items: list) -> int:
+        return sum(items)
+
+    for items in ([1], [2], [1], [3], [1], [2]):  # [2] is evicted by [3] as the least recently used
+        await total(items)
+    assert cache.stats() == {"hits": 2, "shared": 0, "misses": 4, "size": 2}
+    cache.clear()
+    assert cache.stats()["size"] == 0
+
+    @limiter(cache=CallCache(ttl=60.0))
+    def length(items: list) -> int:
+        return len(items)
+
+    assert length([1, 2]) == length([1, 2]) == 2  # unhashable args, the calls are made without the cache
+    assert limiter.stats()["granted"] == 6
+
+    with pytest.raises(ValueError):
+        CallCache(ttl=-1)
+    with pytest.raises(ValueError):
+        CallCache(ttl=1, max_size=0)
+
+
+@pytest.mark.asyncio
+async def test_waiter_makes_the_call_when_the_call_is_cancelled():
+    limiter = AsyncioBucketTimeRateLimiter(max_size=10, recovery_time=1.0, algorithm="token_bucket")
+    cache = CallCache(ttl=10.0)
+    calls = 0
+
+    @limiter(cache=cache)
+    async def lookup(user_id: int) -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return user_id
+
+    leader = asyncio.ensure_future(lookup(1))
+    await asyncio.sleep(0)  # the leader has started the call
+    waiters = [asyncio.ensure_future(lookup(1)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert await asyncio.gather(*waiters) == [1, 1, 1]  # the waiters are not cancelled
+    assert calls == 2
+    assert await lookup(1) == 1  # the result of the second call is kept
+    assert calls == 2
@@ -0,0 +1,105 @@
+import asyncio
+import threading as th
+from time import monotonic
+
+import pytest
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    InMemoryBackend,
+    MThreadedBucketTimeRateLimiter,
+    MThreadedKeyedRateLimiter,
+    VirtualClock,
+)
+
+
+def test_advance_wakes_up_sleeping_threads():
+    clock = VirtualClock(start=10.0, autojump_threshold=None)
+    woken = []
+
+    def sleeper(seconds: float) -> None:
+        clock.sleep(seconds)
+        woken.append(clock.monotonic())
+
+    threads = [th.Thread(target=sleeper, args=(seconds,)) for seconds in (2, 1)]
+    [t.start() for t in threads]
+    clock.advance(0.5)
+    assert woken == []
+    clock.advance(0.5)
+    threads[1].join()
+    assert woken == [11.0]
+    clock.advance(5)
+    threads[0].join()
+    assert woken == [11.0, 16.0]
+
+    with pytest.raises(ValueError):
+        clock.advance(-1)
+    with pytest.raises(ValueError):
+        VirtualClock(autojump_threshold=0)
+
+
+def test_autojump_of_waiting_threads():
+    clock = VirtualClock()
+    event = th.Event()
+    start = monotonic()
+    clock.sleep(3600)
+    assert clock.monotonic() == 3600
+    th.Timer(0.01, event.set).start()
+    clock.wait(event, 3600)  # the event is set before the deadline
+    assert clock.monotonic() == 3600
+    assert monotonic() - start < 1
+
+
+def test_mthreaded_limiter_in_virtual_time():
+    clock = VirtualClock()
+    limiter = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=1.0, algorithm="token_bucket", clock=clock)
+    started = []
+
+    @limiter
+    def some_func() -> None:
+        started.append(clock.monotonic())
+
+    threads = [th.Thread(target=some_func) for _ in range(6)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert started == [0.0, 0.0, 0.5, 1.0, 1.5, 2.0]
+    assert limiter.stats()["wait_time_sum"] == 5.0
+
+
+def test_asyncio_limiter_in_virtual_time():
+    clock = VirtualClock()
+
+    async def scenario() -> list:
+        limiter = AsyncioBucketTimeRateLimiter(max_size=3, recovery_time=3.0, clock=clock)
+        started = []
+
+        @limiter
+        async def some_func() -> None:
+            started.append(asyncio.get_event_loop().time())
+            await asyncio.sleep(10)
+
+        async with limiter:
+            await asyncio.gather(*(some_func() for _ in range(7)))
+        return started
+
+    start = monotonic()
+    assert clock.run(scenario()) == [0.0] * 3 + [3.0] * 3 + [6.0]
+    assert clock.monotonic() == 16.0
+    assert monotonic() - start < 1
+
+
+def test_backend_and_keyed_limiter_in_virtual_time():
+    clock = VirtualClock(autojump_threshold=None)
+    limiter = MThreadedBucketTimeRateLimiter(
+        max_size=1, recovery_time=2.0, backend=InMemoryBackend(clock=clock), clock=clock
+    )
+    assert limiter.try_acquire()
+    assert limiter.reserve() == 2.0
+    clock.advance(2.0)
+    assert limiter.try_acquire()
+
+    keyed = MThreadedKeyedRateLimiter(max_size=1, recovery_time=1.0, clock=clock)
+    keyed._acquire("a")
+    th.Timer(0.01, clock.advance, args=(1.0,)).start()
+    keyed._acquire("a")  # sleeps until the time is moved by another thread
+    assert clock.monotonic() == 3.0
@@ -0,0 +1,94 @@
+import asyncio
+from threading import Thread
+
+import pytest
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    AsyncioCompositeRateLimiter,
+    MThreadedBucketTimeRateLimiter,
+    MThreadedCompositeRateLimiter,
+    VirtualClock,
+)
+
+
+def test_asyncio_slots_are_not_burned_by_waiting_calls():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        per_second = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+        per_minute = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=60.0, algorithm="token_bucket", clock=clock)
+        limiter = AsyncioCompositeRateLimiter([per_second, per_minute], clock=clock)
+        started = []
+
+        @limiter
+        async def some_func(n: int) -> None:
+            started.append((n, clock.monotonic()))
+
+        tasks = [asyncio.ensure_future(some_func(n)) for n in range(3)]
+        await asyncio.sleep(0.3)
+
+        assert started == [(0, 0.0), (1, pytest.approx(0.1))]
+        # the third call waits for per_minute limiter and does not burn per_second tokens
+        assert per_second._wait_time() == 0.0
+        [t.cancel() for t in tasks]
+
+    clock.run(scenario())
+
+
+def test_asyncio_composite_waits_for_all_windows():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        fast = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+        slow = AsyncioBucketTimeRateLimiter(max_size=3, recovery_time=0.6, algorithm="token_bucket", clock=clock)
+        limiter = AsyncioCompositeRateLimiter([fast, slow], clock=clock)
+        started = []
+
+        async def some_func() -> None:
+            started.append(clock.monotonic())
+
+        async with limiter:
+            await asyncio.gather(*[limiter.wrap_operation(some_func) for _ in range(4)])
+
+        # 2 calls at once, the third when fast limiter has a token, the fourth when slow limiter has a token
+        assert started == pytest.approx([0.0, 0.0, 0.1, 0.2])
+
+    clock.run(scenario())
+
+
+def test_mthreaded_composite_of_fixed_windows():
+    clock = VirtualClock()
+    per_second = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.2, clock=clock)
+    per_minute = MThreadedBucketTimeRateLimiter(max_size=3, recovery_time=0.6, clock=clock)
+    limiter = MThreadedCompositeRateLimiter([per_second, per_minute], clock=clock)
+    started = []
+
+    with limiter:
+        threads = [Thread(target=limiter.wrap_operation, args=(started.append, n), daemon=True) for n in range(4)]
+        [t.start() for t in threads]
+        clock.sleep(0.5)
+        assert sorted(started) == [0, 1, 2]
+        # the fourth call waits for per_minute limiter and does not burn per_second slots
+        assert per_second.active_slots == 2
+        [t.join() for t in threads]
+
+    assert clock.monotonic() == pytest.approx(0.6)
+
+
+def test_mthreaded_composite_returns_slots_to_its_limiters():
+    per_second = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=1.0, algorithm="token_bucket")
+    per_minute = MThreadedBucketTimeRateLimiter(max_size=3, recovery_time=60.0, algorithm="token_bucket")
+    limiter = MThreadedCompositeRateLimiter([per_second, per_minute])
+    assert limiter.try_acquire(2)
+    assert not limiter.try_acquire()
+    with limiter.sync_lock:
+        limiter._release_slot(2)  # e.g. the waiter which was granted the slots does not wait anymore
+    assert limiter.try_acquire(2)  # the slots were returned to both limiters
+    assert per_minute.try_acquire()
+    assert not per_minute.try_acquire()
+
+
+def test_composite_requires_limiters():
+    with pytest.raises(ValueError):
+        MThreadedCompositeRateLimiter([])
@@ -0,0 +1,108 @@
+from concurrent.futures import wait
+from time import sleep
+
+import pytest
+
+from bucketratelimiter import (
+    InMemoryBackend,
+    LimiterOverloadedError,
+    MThreadedBucketTimeRateLimiter,
+    RateLimitedExecutor,
+    StorageBackendABC,
+    VirtualClock,
+)
+
+
+def test_submit_with_limiter_rate():
+    clock = VirtualClock()
+    limiter = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+    started = []
+
+    def some_func(i: int) -> int:
+        started.append(clock.monotonic())
+        return i * 2
+
+    with RateLimitedExecutor(limiter, max_workers=2) as executor:
+        fs = [executor.submit(some_func, i) for i in range(6)]
+        assert [f.result() for f in fs] == [0, 2, 4, 6, 8, 10]
+    # 2 calls at once, then one call every 0.05 second
+    assert sorted(started) == pytest.approx([0.0, 0.0, 0.05, 0.1, 0.15, 0.2])
+
+
+def test_threads_do_not_wait_for_slots():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=0.2, algorithm="token_bucket")
+    executor = RateLimitedExecutor(limiter, max_workers=1)
+    assert executor.submit(sleep, 0).result() is None  # the only slot is taken
+    waiting = executor.submit(lambda: "waited for the slot")
+    sleep(0.01)
+    # the only thread of the pool is free while the call waits for the slot in the executor queue
+    assert executor._pool.submit(lambda: "free").result(timeout=0.05) == "free"
+    assert not waiting.done()
+    assert waiting.result() == "waited for the slot"
+    executor.shutdown()
+
+
+def test_map_exceptions_and_shutdown():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=10, recovery_time=0.1, algorithm="token_bucket")
+    executor = RateLimitedExecutor(limiter, max_workers=2)
+    assert list(executor.map(abs, [-1, -2, 3])) == [1, 2, 3]
+
+    def fail() -> None:
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        executor.submit(fail).result()
+
+    fs = [executor.submit(sleep, 0.05) for _ in range(4)]
+    executor.shutdown(wait=True, cancel_futures=True)
+    wait(fs)
+    assert sum(f.cancelled() for f in fs) >= 2  # 2 calls are already running
+    with pytest.raises(RuntimeError):
+        executor.submit(abs, 1)
+
+
+def test_shed_calls_fail_and_dispatcher_goes_on():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=0.2, algorithm="token_bucket", max_wait=0.1)
+    with RateLimitedExecutor(limiter, max_workers=2) as executor:
+        fs = [executor.submit(lambda: "ok") for _ in range(3)]
+        assert fs[0].result(timeout=1) == "ok"
+        for f in fs[1:]:  # the calls should wait 0.2 second for the slot, longer than max_wait
+            assert isinstance(f.exception(timeout=1), LimiterOverloadedError)
+        sleep(0.2)
+        assert executor.submit(lambda: "ok").result(timeout=1) == "ok"
+    assert limiter.stats()["shed"] == 2
+
+
+class FailingBackend(StorageBackendABC):
+    """Fails the first round-trip, e.g. the connection to the storage is lost."""
+
+    def __init__(self):
+        self.backend = InMemoryBackend()
+        self.failed = False
+
+    def update(self, key, max_size, recovery_time, cost, mode):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError
+        return self.backend.update(key, max_size, recovery_time, cost, mode)
+
+
+def test_backend_errors_fail_calls_and_dispatcher_goes_on():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=10, recovery_time=1.0, backend=FailingBackend())
+    with RateLimitedExecutor(limiter, max_workers=1) as executor:
+        fs = [executor.submit(lambda: "ok") for _ in range(2)]
+        assert isinstance(fs[0].exception(timeout=1), ConnectionError)
+        assert fs[1].result(timeout=1) == "ok"
+
+
+def test_cancelled_call_returns_its_slot():
+    clock = VirtualClock()
+    limiter = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=100.0, algorithm="token_bucket", clock=clock)
+    assert limiter.try_acquire()
+    with RateLimitedExecutor(limiter, max_workers=1) as executor:
+        cancelled = executor.submit(lambda: "cancelled")
+        while not limiter.stats()["waiters"]:  # the dispatcher waits for the slot of the call
+            sleep(0.001)
+        assert cancelled.cancel()
+        assert executor.submit(lambda: "ok").result() == "ok"
+    assert clock.monotonic() == pytest.approx(100.0)  # the slot of the cancelled call is not burned
@@ -0,0 +1,149 @@
+import asyncio
+import threading as th
+
+import pytest
+
+from bucketratelimiter import (
+    AcquireTimeoutError,
+    HybridBucketTimeRateLimiter,
+    InMemoryBackend,
+    LimiterOverloadedError,
+    VirtualClock,
+)
+
+
+def test_threads_and_event_loops_share_one_budget():
+    clock = VirtualClock()
+    limiter = HybridBucketTimeRateLimiter(max_size=2, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+    granted = []
+
+    async def coroutines() -> None:
+        async def call() -> None:
+            await limiter.aacquire()
+            granted.append(clock.monotonic())
+
+        await asyncio.gather(*(call() for _ in range(3)))
+
+    def thread_with_loop() -> None:
+        loop = clock.new_event_loop()
+        try:
+            loop.run_until_complete(coroutines())
+        finally:
+            loop.close()
+
+    def blocking_thread() -> None:
+        for _ in range(3):
+            limiter.acquire()
+            granted.append(clock.monotonic())
+
+    threads = [th.Thread(target=target) for target in (thread_with_loop, thread_with_loop, blocking_thread)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 2 slots right away, 7 more at 20 slots per second
+    assert sorted(granted) == pytest.approx([0.0, 0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35])
+    assert limiter.stats()["granted"] == 9
+
+
+def test_coroutine_is_woken_up_by_thread():
+    clock = VirtualClock()
+
+    def release_later(limiter: HybridBucketTimeRateLimiter) -> None:
+        clock.sleep(0.05)
+        limiter.release()
+
+    async def scenario() -> None:
+        limiter = HybridBucketTimeRateLimiter(
+            max_size=10, recovery_time=1.0, algorithm="token_bucket", max_concurrency=1, clock=clock
+        )
+        limiter.acquire()  # concurrency slot is taken by the thread
+        th.Thread(target=release_later, args=(limiter,), daemon=True).start()
+        await limiter.aacquire()  # waits without timeout until release is called by another thread
+        assert clock.monotonic() == pytest.approx(0.05)
+        assert limiter.in_flight == 1
+
+    clock.run(scenario())
+
+
+def test_cancelled_coroutine_leaves_the_queue():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = HybridBucketTimeRateLimiter(max_size=1, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+        assert limiter.try_acquire()
+        first = asyncio.ensure_future(limiter.aacquire())
+        second = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, 0.2)  # the second waiter becomes the first one and waits with timeout
+        assert clock.monotonic() == pytest.approx(0.1)
+        stats = limiter.stats()
+        assert (stats["waiters"], stats["queued_slots"], stats["granted"]) == (0, 0, 2)
+
+    clock.run(scenario())
+
+
+def test_decorator_of_functions_and_coroutine_functions():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = HybridBucketTimeRateLimiter(max_size=2, recovery_time=0.1, clock=clock)  # refilled by thread
+
+        @limiter
+        async def async_func(x: int) -> int:
+            await asyncio.sleep(0)
+            return x * 2
+
+        @limiter(cost=2)
+        def sync_func(x: int) -> int:
+            return x + 1
+
+        async with limiter:
+            assert await async_func(1) == 2
+            assert await asyncio.get_event_loop().run_in_executor(None, sync_func, 1) == 2  # waits in the thread
+            assert clock.monotonic() == pytest.approx(0.1)
+            async with limiter.slot():
+                pass
+            # the window is refilled at 0.2 by the thread, the coroutine may notice it a bit later
+            assert 0.2 - 1e-9 <= clock.monotonic() < 0.3
+
+    clock.run(scenario())
+    with pytest.raises(ValueError):
+        HybridBucketTimeRateLimiter(backend=InMemoryBackend())
+    with pytest.raises(ValueError):
+        HybridBucketTimeRateLimiter(2, 0.1, 0.2, None, "token_bucket", InMemoryBackend())
+
+
+def test_positional_params():
+    limiter = HybridBucketTimeRateLimiter(3, 0.3, 0.2, None, "token_bucket")
+    assert (limiter.max_size, limiter.recovery_time, limiter.algorithm) == (3, 0.3, "token_bucket")
+    assert limiter.try_acquire(3)
+    assert not limiter.try_acquire()
+    with pytest.raises(TypeError):
+        HybridBucketTimeRateLimiter(3, max_size=3)
+
+
+def test_acquire_timeout_of_coroutine():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = HybridBucketTimeRateLimiter(
+            max_size=1, recovery_time=0.2, algorithm="token_bucket", max_waiters=1, clock=clock
+        )
+        await limiter.aacquire()
+        with pytest.raises(AcquireTimeoutError):
+            await limiter.aacquire(timeout=0.05)
+        assert clock.monotonic() == pytest.approx(0.05)
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        with pytest.raises(LimiterOverloadedError):
+            await limiter.aacquire()
+        await waiter
+        assert clock.monotonic() == pytest.approx(0.2)  # the timed out coroutine has not taken the slot
+        stats = limiter.stats()
+        assert (stats["timed_out"], stats["shed"], stats["waiters"]) == (1, 1, 0)
+
+    clock.run(scenario())
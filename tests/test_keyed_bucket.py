@@ -0,0 +1,104 @@
+import asyncio
+from threading import Thread
+from time import sleep
+
+import pytest
+
+from bucketratelimiter import AsyncioKeyedRateLimiter, KeyedRateLimiter, MThreadedKeyedRateLimiter, VirtualClock
+
+
+def test_asyncio_keys_are_limited_independently():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = AsyncioKeyedRateLimiter(max_size=2, recovery_time=0.2, clock=clock)
+        started = []
+
+        @limiter
+        async def fetch(tenant: str, n: int) -> None:
+            started.append((tenant, n, clock.monotonic()))
+
+        await asyncio.gather(*[fetch(tenant, n) for n in range(4) for tenant in ("a", "b")])
+
+        assert len(limiter) == 2
+        for tenant in ("a", "b"):
+            times = [t for key, _, t in started if key == tenant]
+            assert times == pytest.approx([0.0, 0.0, 0.1, 0.2])
+
+    clock.run(scenario())
+
+
+def test_asyncio_cancelled_waiter_returns_token():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = AsyncioKeyedRateLimiter(max_size=1, recovery_time=0.2, clock=clock)
+        await limiter.wrap_operation("a", asyncio.sleep, 0)
+        task = asyncio.ensure_future(limiter.wrap_operation("a", asyncio.sleep, 0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        await limiter.wrap_operation("a", asyncio.sleep, 0)
+        assert clock.monotonic() == pytest.approx(0.2)  # waits only for the first call token
+
+    clock.run(scenario())
+
+
+def test_mthreaded_key_func():
+    clock = VirtualClock()
+    limiter = MThreadedKeyedRateLimiter(max_size=1, recovery_time=0.2, key_func=lambda url, host: host, clock=clock)
+    started = []
+
+    @limiter
+    def fetch(url: str, host: str) -> None:
+        started.append((host, clock.monotonic()))
+
+    threads = [Thread(target=fetch, args=("/", host)) for host in ("x", "y", "x")]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert sorted(host for host, _ in started) == ["x", "x", "y"]
+    assert sorted(t for host, t in started if host == "x") == pytest.approx([0.0, 0.2])
+
+
+def test_least_recently_used_keys_are_evicted():
+    clock = VirtualClock()
+    limiter = KeyedRateLimiter(max_size=1, recovery_time=60.0, max_keys=3, ttl=3600.0, clock=clock)
+    for key in ("a", "b", "c"):
+        limiter._reserve(key)
+    clock.advance(60.0)  # the buckets are full again, but the keys are not idle for ttl
+    limiter._reserve("a")  # "a" becomes the most recently used key
+    limiter._reserve("d")
+
+    assert len(limiter) == 3
+    assert "b" not in limiter
+    assert "a" in limiter
+
+
+def test_keys_with_debt_are_not_evicted():
+    clock = VirtualClock()
+    limiter = KeyedRateLimiter(max_size=1, recovery_time=60.0, max_keys=2, clock=clock)
+    limiter._reserve("a")
+    limiter._reserve("a")  # "a" has debt of one token
+    limiter._reserve("b")
+    limiter._reserve("c")
+
+    assert len(limiter) == 3  # max_keys is exceeded while the buckets are not refilled
+    assert limiter._reserve("a") == pytest.approx(120.0)  # the debt is not forgotten
+    clock.advance(180.0)
+    limiter._reserve("d")
+    assert len(limiter) == 1
+
+
+def test_idle_keys_are_evicted_after_ttl():
+    limiter = KeyedRateLimiter(max_size=1, recovery_time=0.1)
+    limiter._reserve("a")
+    limiter._reserve("b")
+    limiter._reserve("b")  # "b" has debt of one token
+    sleep(0.15)
+    limiter._reserve("c")
+
+    assert "a" not in limiter
+    assert "b" in limiter  # its bucket is not full yet, eviction would forget the debt
@@ -0,0 +1,111 @@
+import asyncio
+import math
+from threading import Thread
+
+import pytest
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    CallStats,
+    MThreadedBucketTimeRateLimiter,
+    RateLimitedExecutor,
+    VirtualClock,
+    prometheus_text,
+)
+
+
+def test_asyncio_limiter_stats():
+    clock = VirtualClock()
+
+    async def scenario() -> None:
+        limiter = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=0.1, name="api", clock=clock)
+        limiter.activate()
+        await asyncio.gather(*(limiter.acquire() for _ in range(3)))  # the third acquire waits for the refill
+        assert limiter.try_acquire()  # the last slot of the refill
+        assert not limiter.try_acquire()
+        stats = limiter.stats()
+        limiter.deactivate()
+        assert stats["name"] == "api"
+        assert (stats["granted"], stats["granted_slots"], stats["waited"], stats["rejected"]) == (4, 4, 1, 1)
+        assert stats["refills"] == 1
+        assert stats["wait_time_sum"] == pytest.approx(0.1)
+        buckets = stats["wait_time_buckets"]
+        assert buckets[0.0] == 3 and buckets[0.05] == 3 and buckets[0.5] == 4
+        assert buckets[math.inf] == stats["granted"]
+        assert (stats["waiters"], stats["queued_slots"], stats["in_flight"], stats["rate"]) == (0, 0, 0, 20)
+
+    clock.run(scenario())
+
+
+def test_mthreaded_limiter_stats():
+    limiter = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.1, algorithm="token_bucket", name="api")
+    threads = [Thread(target=limiter.acquire, args=(cost,)) for cost in (2, 1, 1)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert not limiter.try_acquire(2)
+    stats = limiter.stats()
+    assert (stats["granted"], stats["granted_slots"], stats["waited"], stats["rejected"]) == (3, 4, 2, 1)
+    assert stats["wait_time_buckets"][0.0] == 1
+    assert stats["wait_time_buckets"][math.inf] == 3
+
+
+@pytest.mark.asyncio
+async def test_prometheus_text():
+    first = AsyncioBucketTimeRateLimiter(max_size=2, recovery_time=1.0, algorithm="token_bucket", name="first")
+    second = AsyncioBucketTimeRateLimiter(max_size=1, recovery_time=1.0, algorithm="token_bucket", name='"2nd"')
+    await first.acquire(2)
+    assert not second.try_acquire(2)
+    lines = prometheus_text(first, second, namespace="app").splitlines()
+    assert "# TYPE app_granted_total counter" in lines
+    assert 'app_granted_slots_total{limiter="first"} 2' in lines
+    assert 'app_rejected_total{limiter="\\"2nd\\""} 1' in lines
+    assert 'app_rate{limiter="first"} 2.0' in lines
+    assert "# TYPE app_wait_seconds histogram" in lines
+    assert 'app_wait_seconds_bucket{limiter="first",le="0.0"} 1' in lines
+    assert 'app_wait_seconds_bucket{limiter="first",le="+Inf"} 1' in lines
+    assert 'app_wait_seconds_count{limiter="\\"2nd\\""} 0' in lines
+
+
+def test_asyncio_on_call_hook():
+    clock = VirtualClock()
+    calls = []
+
+    async def on_call(stats: CallStats) -> None:
+        await asyncio.sleep(0)
+        calls.append(stats)
+
+    async def scenario() -> None:
+        limiter = AsyncioBucketTimeRateLimiter(
+            max_size=1, recovery_time=0.1, algorithm="token_bucket", on_call=on_call, clock=clock
+        )
+
+        @limiter(cost=1)
+        async def some_func(fail: bool) -> None:
+            await asyncio.sleep(0.02)
+            if fail:
+                raise RuntimeError
+
+        await some_func(False)
+        with pytest.raises(RuntimeError):
+            await some_func(True)
+
+    clock.run(scenario())
+    assert [(c.cost, c.exception is None) for c in calls] == [(1, True), (1, False)]
+    assert isinstance(calls[1].exception, RuntimeError)
+    # the slot is refilled 0.1 second after the first call, which takes 0.02 second
+    assert [c.wait_time for c in calls] == pytest.approx([0.0, 0.08])
+    assert [c.call_time for c in calls] == pytest.approx([0.02, 0.02])
+
+
+def test_mthreaded_on_call_hook():
+    clock = VirtualClock()
+    calls = []
+    limiter = MThreadedBucketTimeRateLimiter(
+        max_size=2, recovery_time=0.1, algorithm="token_bucket", on_call=calls.append, clock=clock
+    )
+    assert limiter.wrap_operation(clock.sleep, 0.01, cost=2) is None
+    with RateLimitedExecutor(limiter, max_workers=1) as executor:
+        executor.submit(clock.sleep, 0).result()
+    assert [c.cost for c in calls] == [2, 1]
+    assert (calls[0].wait_time, calls[0].call_time) == (0.0, pytest.approx(0.01))
+    assert calls[1].wait_time == pytest.approx(0.04)  # one slot per 0.05 second
@@ -1,9 +1,25 @@
+import math
 from queue import Queue
 from typing import NamedTuple
-from time import sleep, monotonic
+from time import sleep
 from threading import Thread
 
-from bucketratelimiter import MThreadedBucketTimeRateLimiter
+import pytest
+
+from bucketratelimiter import (
+    AcquireTimeoutError,
+    Clock,
+    InMemoryBackend,
+    LimiterOverloadedError,
+    MThreadedBucketTimeRateLimiter,
+    VirtualClock,
+)
+
+
+def wait_for_waiters(bucket: MThreadedBucketTimeRateLimiter, number: int) -> None:
+    """Waits in real time until number of threads are queued in the limiter, e.g. to keep the order of calls."""
+    while bucket.stats()["waiters"] < number:
+        sleep(0.001)
 
 
 def test__decrement():
@@ -33,8 +49,9 @@ def worker(q: Queue, func: MThreadedBucketTimeRateLimiter, sleep_time: float = 1
         q.task_done()
 
 
-def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task: bool = False) -> int:
-    """Main entry point of our asyncio tests."""
+def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task: bool = False) -> float:
+    """Main entry point of our threaded tests, runs in virtual time."""
+    clock = VirtualClock()
     e = env_params
 
     callback = None
@@ -45,14 +62,15 @@ def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task: bool
         max_size=e.max_bucket_size,
         recovery_time=e.recovery_time,
         callback=callback,
+        clock=clock,
     )
 
     @bucket
     def some_func_to_limit(sleep_time: float = 1.0) -> None:
-        sleep(sleep_time)
+        clock.sleep(sleep_time)
         return
 
-    start = monotonic()
+    start = clock.monotonic()
     q = Queue()
     for task in range(e.tasks_number):
         q.put(task)  # send all tasks to the Queue
@@ -67,7 +85,7 @@ def main_entry_point(env_params: EnvironmentParams, broken_reactivate_task: bool
             bucket.event_full_stop.clear()
             bucket.reactivate_task = None
 
-    return int(monotonic() - start)
+    return clock.monotonic() - start
 
 
 def test_wrapper_main_entry_point_1():
@@ -180,3 +198,358 @@ def test_wrapper_main_entry_point_8():
     )
     res = main_entry_point(e)
     assert e.expected_finish_time == res
+
+
+def test_waiters_are_woken_right_after_refill_in_fifo_order():
+    clock = VirtualClock()
+    # rest_time is huge, waiters must not depend on it anymore
+    bucket = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.3, rest_time=10.0, clock=clock)
+    started = []
+
+    def some_func(n: int) -> None:
+        started.append((n, clock.monotonic()))
+
+    with bucket:
+        threads = []
+        for n in range(6):
+            t = Thread(target=bucket.wrap_operation, args=(some_func, n), daemon=True)
+            t.start()
+            threads.append(t)
+            if n < 2:
+                t.join()
+            else:
+                wait_for_waiters(bucket, n - 1)  # make sure threads are queued one by one
+        [t.join() for t in threads]
+
+    started.sort()  # woken threads may run in any order, but slots are handed over in FIFO order
+    assert [t for _, t in started] == pytest.approx([0.0, 0.0, 0.3, 0.3, 0.6, 0.6])
+
+
+def test_no_over_admission_under_contention():
+    bucket = MThreadedBucketTimeRateLimiter(max_size=5, recovery_time=60.0)
+    started = []
+
+    with bucket:
+        for _ in range(100):
+            Thread(target=bucket.wrap_operation, args=(started.append, 1), daemon=True).start()
+        sleep(0.3)
+
+    assert len(started) == 5
+    assert bucket.active_slots == 0
+
+
+def test_striped_bucket_does_not_over_admit():
+    bucket = MThreadedBucketTimeRateLimiter(max_size=50, recovery_time=3600.0, algorithm="token_bucket", stripes=4)
+    granted = []
+
+    def worker() -> None:
+        granted.extend(bucket.try_acquire() for _ in range(100))
+
+    threads = [Thread(target=worker) for _ in range(16)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert sum(granted) == 50  # tokens of all the stripes are used, but not more
+    stats = bucket.stats()
+    assert (stats["granted"], stats["rejected"]) == (50, 1600 - 50)
+
+    bucket = MThreadedBucketTimeRateLimiter(max_size=8, recovery_time=3600.0, algorithm="token_bucket", stripes=4)
+    assert bucket.try_acquire(7)  # gathered from all the stripes
+    assert not bucket.try_acquire(2)
+    assert bucket.try_acquire()
+    assert bucket.rate == pytest.approx(8 / 3600)
+    bucket._refund(7)  # does not fit into the home stripe
+    assert bucket.try_acquire(7)
+
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(stripes=2)  # fixed_window
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(algorithm="token_bucket", max_concurrency=2, stripes=2)
+
+
+def test_striped_bucket_rate():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(
+        max_size=4, recovery_time=1.0, algorithm="token_bucket", stripes=2, clock=clock
+    )
+    started = []
+
+    @bucket
+    def some_func() -> None:
+        started.append(clock.monotonic())
+
+    threads = [Thread(target=some_func) for _ in range(10)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert started == pytest.approx([0.0] * 4 + [0.25, 0.5, 0.75, 1.0, 1.25, 1.5])
+
+
+def test_token_bucket_algorithm_without_activation():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+    started = []
+
+    def some_func(n: int) -> None:
+        started.append((n, clock.monotonic()))
+
+    threads = [Thread(target=bucket.wrap_operation, args=(some_func, n), daemon=True) for n in range(6)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    assert bucket.reactivate_task is None
+    # 2 calls at once, then the bucket is refilled continuously with one token every 0.1 second
+    assert sorted(t for _, t in started) == pytest.approx([0.0, 0.0, 0.1, 0.2, 0.3, 0.4])
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(algorithm="unknown")
+
+
+def test_weighted_calls():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=10, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+    started = []
+
+    def record(items: list) -> None:
+        started.append((len(items), clock.monotonic()))
+
+    bulk = bucket(cost=lambda items: len(items))(record)
+
+    bulk([1] * 8)
+    threads = [
+        Thread(target=bulk, args=([1] * 5,)),
+        Thread(target=bucket.wrap_operation, args=(record, [1]), kwargs={"cost": 3}),
+    ]
+    for t in threads:
+        t.start()
+        sleep(0.01)  # keep the order of the calls
+    [t.join() for t in threads]
+
+    # 8 slots at once, then 5 slots are refilled after 3 / 50 seconds, then 3 slots after 3 / 50 seconds more
+    assert [n for n, _ in started] == [8, 5, 1]
+    assert [t for _, t in started] == pytest.approx([0.0, 0.06, 0.12])
+
+    with pytest.raises(ValueError):
+        bucket.acquire(11)
+
+
+def test_try_acquire_reserve_and_slot():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.2, algorithm="token_bucket", clock=clock)
+    assert bucket.reserve() == 0.0
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire()
+    assert bucket.reserve() == pytest.approx(0.1)
+
+    with bucket.slot():
+        assert clock.monotonic() == pytest.approx(0.1)
+    waiter = Thread(target=bucket.acquire, args=(2,))
+    waiter.start()
+    wait_for_waiters(bucket, 1)
+    assert bucket.reserve() == pytest.approx(0.3)  # the waiter ahead waits for 2 slots
+    waiter.join()
+    assert bucket.reserve() == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize("with_backend", [False, True])
+def test_max_concurrency(with_backend):
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(
+        max_size=10,
+        recovery_time=1,
+        algorithm="token_bucket",
+        backend=InMemoryBackend(clock) if with_backend else None,
+        max_concurrency=2,
+        clock=clock,
+    )
+    in_flight = Queue()
+
+    @bucket
+    def some_func(fail: bool) -> None:
+        in_flight.put(bucket.in_flight)
+        clock.sleep(0.05)
+        if fail:
+            raise RuntimeError
+
+    def worker(fail: bool) -> None:
+        try:
+            some_func(fail)
+        except RuntimeError:
+            pass
+
+    threads = [Thread(target=worker, args=(i % 2 == 0,)) for i in range(6)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert clock.monotonic() == pytest.approx(0.15)  # 3 rounds of 2 concurrent calls
+    assert max(in_flight.queue) == 2
+    assert bucket.in_flight == 0  # failed calls released their slots too
+
+    with bucket.slot():
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()  # tokens are available, but concurrency slots are not
+        bucket.release()
+    assert bucket.in_flight == 0
+
+    with pytest.raises(ValueError):
+        MThreadedBucketTimeRateLimiter(max_concurrency=0)
+
+
+def test_max_concurrency_with_rate_limit():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(
+        max_size=2, recovery_time=0.2, algorithm="token_bucket", max_concurrency=1, clock=clock
+    )
+    started = Queue()
+
+    def some_func(duration: float) -> None:
+        started.put(clock.monotonic())
+        clock.sleep(duration)
+
+    # the first call blocks the others by concurrency, then the calls wait for tokens
+    threads = [Thread(target=bucket.wrap_operation, args=(some_func, d)) for d in (0.15, 0.0, 0.0, 0.0)]
+    for t in threads:
+        t.start()
+        sleep(0.01)  # keep the order of the calls
+    [t.join() for t in threads]
+    assert sorted(started.queue) == pytest.approx([0.0, 0.15, 0.15, 0.25])
+
+
+@pytest.mark.parametrize("with_backend", [False, True])
+def test_priority(with_backend):
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(
+        max_size=2,
+        recovery_time=0.2,
+        algorithm="token_bucket",
+        backend=InMemoryBackend(clock) if with_backend else None,
+        clock=clock,
+    )
+    assert bucket.try_acquire(2)
+    order = Queue()
+
+    threads = []
+    for name, priority in (("backfill 1", 10), ("backfill 2", 10), ("user 1", 0), ("user 2", 0)):
+        threads.append(Thread(target=bucket.wrap_operation, args=(order.put, name), kwargs={"priority": priority}))
+        threads[-1].start()
+        wait_for_waiters(bucket, len(threads) - with_backend)  # the first one waits out of the queue
+    [t.join() for t in threads]
+    # user calls overtake the backfill calls which are already waiting, but the waiter which already sleeps
+    # until the storage backend has tokens for it is not overtaken
+    expected = ["user 1", "user 2", "backfill 1", "backfill 2"]
+    if with_backend:
+        expected = ["backfill 1", "user 1", "user 2", "backfill 2"]
+    assert list(order.queue) == expected
+    assert clock.monotonic() == pytest.approx(0.4)
+
+
+def test_high_priority_waiter_does_not_wait_for_low_priority_one():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=4, recovery_time=0.4, algorithm="token_bucket", clock=clock)
+    assert bucket.try_acquire(4)
+    heavy = Thread(target=bucket.acquire, args=(4,), kwargs={"priority": 1})
+    heavy.start()
+    wait_for_waiters(bucket, 1)
+    with bucket.slot(priority=0):
+        assert clock.monotonic() == pytest.approx(0.1)  # overtakes the heavy call, which waits 0.4 second
+    heavy.join()
+
+
+def test_map_and_as_completed():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=0.1, algorithm="token_bucket", clock=clock)
+    pulled = []
+
+    def items():
+        for i in range(5):
+            pulled.append(i)
+            yield i
+
+    def some_func(i: int) -> int:
+        clock.sleep(0.02 * (5 - i))
+        return i
+
+    results = []
+    for res in bucket.map(some_func, items(), concurrency=2):
+        results.append(res)
+        assert len(pulled) <= len(results) + 2  # items are pulled lazily
+    assert results == [0, 1, 2, 3, 4]
+    # items 2 and 3 are pulled when 0 and 1 are taken at 0.1, item 4 when 2 is taken at 0.16
+    assert clock.monotonic() == pytest.approx(0.18)
+
+    bucket = MThreadedBucketTimeRateLimiter(max_size=10, recovery_time=1, algorithm="token_bucket", clock=clock)
+    # the calls of the later items are shorter
+    assert list(bucket.as_completed(lambda i: clock.sleep(0.05 * (4 - i)) or i, range(4))) == [3, 2, 1, 0]
+
+    def fail(i: int) -> None:
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        list(bucket.map(fail, range(10)))
+
+
+def test_acquire_timeout_and_deadline():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=1.0, algorithm="token_bucket", clock=clock)
+    bucket.acquire()
+    first = Thread(target=bucket.acquire)  # the first waiter gets the slot at 1.0
+    first.start()
+    while not bucket.stats()["waiters"]:
+        sleep(0.001)
+    with pytest.raises(AcquireTimeoutError):
+        bucket.acquire(timeout=0.3)
+    assert clock.monotonic() == 0.3
+    first.join()
+    with pytest.raises(AcquireTimeoutError):
+        bucket.acquire(deadline=1.5)  # the slot is refilled at 2.0
+    assert clock.monotonic() == 1.5
+    with pytest.raises(AcquireTimeoutError):
+        bucket.wrap_operation(sleep, 0, acquire_timeout=0.0)
+    bucket.acquire()  # the timed out waiters have not taken the slot
+    assert clock.monotonic() == 2.0
+    stats = bucket.stats()
+    assert (stats["timed_out"], stats["waiters"], stats["queued_slots"], stats["granted"]) == (3, 0, 0, 3)
+
+
+def test_load_shedding():
+    clock = VirtualClock()
+    bucket = MThreadedBucketTimeRateLimiter(
+        max_size=2, recovery_time=1.0, algorithm="token_bucket", max_waiters=0, clock=clock
+    )
+    bucket.acquire(2)
+    with pytest.raises(LimiterOverloadedError):
+        bucket.acquire()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=2, recovery_time=1.0, max_wait=0.5, clock=clock)
+    with bucket:
+        bucket.acquire(2)
+        with pytest.raises(LimiterOverloadedError):
+            bucket.acquire()  # the fixed window is refilled in a second
+    assert bucket.stats()["shed"] == 1
+
+
+class CountingClock(Clock):
+    def __init__(self) -> None:
+        self.waits = 0
+
+    def wait(self, event, timeout=None) -> None:
+        self.waits += 1
+        super().wait(event, timeout)
+
+
+def test_deactivated_limiter_is_not_polled():
+    clock = CountingClock()
+    bucket = MThreadedBucketTimeRateLimiter(max_size=1, recovery_time=0.1, clock=clock)
+    bucket.activate()
+    bucket.acquire()
+    bucket.deactivate()
+    assert bucket.reserve() == math.inf  # the bucket is not refilled anymore
+    waiter = Thread(target=bucket.acquire)
+    waiter.start()
+    sleep(0.3)
+    assert waiter.is_alive()
+    assert clock.waits == 1  # the waiter sleeps until activation instead of polling the bucket
+    bucket.activate()
+    assert 0.1 < bucket.reserve() <= 0.2  # the waiter ahead takes the first refill
+    waiter.join(timeout=1)
+    assert not waiter.is_alive()
+    bucket.deactivate()
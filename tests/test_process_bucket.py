@@ -0,0 +1,65 @@
+import multiprocessing as mp
+import os
+from time import monotonic
+
+import pytest
+
+from bucketratelimiter import ProcessBucketTimeRateLimiter
+
+
+def worker(directory: str, calls: int, q: mp.Queue) -> None:
+    limiter = ProcessBucketTimeRateLimiter(max_size=2, recovery_time=0.2, name="test", directory=directory)
+
+    @limiter
+    def some_func() -> None:
+        q.put(monotonic())
+
+    for _ in range(calls):
+        some_func()
+    limiter.close()
+
+
+def test_processes_share_one_bucket(tmp_path):
+    q = mp.Queue()
+    # the first limiter creates the Bucket, so the processes do not compete for initialization
+    ProcessBucketTimeRateLimiter(max_size=2, recovery_time=0.2, name="test", directory=str(tmp_path)).close()
+    processes = [mp.Process(target=worker, args=(str(tmp_path), 3, q)) for _ in range(3)]
+    [p.start() for p in processes]
+    [p.join() for p in processes]
+
+    started = sorted(q.get() for _ in range(9))
+    # 2 calls at once, then one call every 0.1 second for all the processes together: the calls can be late
+    # on a busy machine, but any window can not have more calls than the bucket admits,
+    # 0.05 second is given for the time between the admission and the record of the call
+    for i in range(len(started)):
+        for j in range(i + 1, len(started)):
+            assert j - i + 1 <= 2 + (started[j] - started[i] + 0.05) / 0.1
+
+
+def test_try_acquire_and_reserve(tmp_path):
+    with ProcessBucketTimeRateLimiter(max_size=2, recovery_time=0.2, directory=str(tmp_path)) as limiter:
+        other = ProcessBucketTimeRateLimiter(max_size=2, recovery_time=0.2, directory=str(tmp_path))
+        assert limiter.try_acquire(2)
+        assert not other.try_acquire()
+        assert other.reserve() == pytest.approx(0.1, abs=0.01)
+        start = monotonic()
+        with other.slot():
+            assert 0.09 <= monotonic() - start < 0.5  # the slot is not taken early, it can be late on a busy machine
+        other.close()
+
+
+def test_shared_params_mismatch(tmp_path):
+    with ProcessBucketTimeRateLimiter(max_size=2, recovery_time=0.2, directory=str(tmp_path)):
+        with pytest.raises(ValueError):
+            ProcessBucketTimeRateLimiter(max_size=3, recovery_time=0.2, directory=str(tmp_path))
+
+
+def test_names_keep_files_in_the_directory(tmp_path):
+    directory = tmp_path / "buckets"
+    directory.mkdir()
+    for name in ("../escape", "a/b", "a_b", "/absolute", "x" * 1000):
+        limiter = ProcessBucketTimeRateLimiter(max_size=1, recovery_time=100, name=name, directory=str(directory))
+        with limiter:
+            assert limiter.try_acquire()  # names which look alike do not share the bucket
+            assert os.path.dirname(limiter.path) == str(directory)
+    assert [path.name for path in tmp_path.iterdir()] == ["buckets"]
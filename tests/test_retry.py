@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from bucketratelimiter import (
+    AsyncioBucketTimeRateLimiter,
+    HybridBucketTimeRateLimiter,
+    MThreadedBucketTimeRateLimiter,
+    RetryPolicy,
+    VirtualClock,
+)
+
+
+def test_backoff_with_jitter():
+    retry = RetryPolicy(ConnectionError, max_attempts=5, base_delay=1.0, max_delay=5.0, jitter=0)
+    assert [retry.backoff(attempt) for attempt in range(1, 5)] == [1.0, 2.0, 4.0, 5.0]
+    assert retry.should_retry(1, ConnectionResetError(), 0.0)
+    assert not retry.should_retry(1, ValueError(), 0.0)  # not listed exception
+    assert not retry.should_retry(5, ConnectionError(), 0.0)  # the last attempt
+
+    retry = RetryPolicy(ConnectionError, base_delay=1.0, max_delay=5.0, jitter=0.5)
+    delays = [retry.backoff(3) for _ in range(100)]
+    assert 2.0 <= min(delays) and max(delays) <= 4.0
+
+    for params in ({"max_attempts": 0}, {"base_delay": 2, "max_delay": 1}, {"jitter": 2}, {"budget": 0}):
+        with pytest.raises(ValueError):
+            RetryPolicy(ConnectionError, **params)
+
+
+def test_mthreaded_limiter_retries_in_virtual_time():
+    clock = VirtualClock()
+    retry = RetryPolicy(ConnectionError, max_attempts=3, base_delay=1.0, jitter=0)
+    limiter = MThreadedBucketTimeRateLimiter(
+        max_size=1, recovery_time=4.0, algorithm="token_bucket", clock=clock, retry=retry
+    )
+    calls = []
+
+    @limiter
+    def flaky(failures: int) -> str:
+        calls.append(clock.monotonic())
+        if len(calls) <= failures:
+            raise ConnectionError
+        return "ok"
+
+    # every retry waits for the backoff and then for the token: 1 second backoff + 3 seconds of the refill
+    assert flaky(2) == "ok"
+    assert calls == [0.0, 4.0, 8.0]
+    calls.clear()
+    with pytest.raises(ConnectionError):
+        flaky(3)
+    assert len(calls) == 3
+    stats = limiter.stats()
+    assert (stats["granted"], stats["retried"]) == (6, 4)
+
+
+def test_retry_budget_of_asyncio_limiter():
+    clock = VirtualClock()
+
+    async def scenario() -> int:
+        limiter = AsyncioBucketTimeRateLimiter(max_size=10, recovery_time=1.0, algorithm="token_bucket", clock=clock)
+        # 2 retries right away, then 2 retries per second
+        retry = RetryPolicy(ConnectionError, max_attempts=100, base_delay=0.0, max_delay=0.0, budget=0.2)
+        attempts = 0
+
+        @limiter(retry=retry)
+        async def failing() -> None:
+            nonlocal attempts
+            attempts += 1
+            raise ConnectionError
+
+        with pytest.raises(ConnectionError):
+            await failing()
+        assert attempts == 3  # the budget is spent, the error is raised
+        await asyncio.sleep(0.5)
+        with pytest.raises(ConnectionError):
+            await failing()
+        assert limiter.stats()["retried"] == 3
+        return attempts
+
+    assert clock.run(scenario()) == 5
+
+
+@pytest.mark.asyncio
+async def test_hybrid_limiter_retries_coroutines():
+    limiter = HybridBucketTimeRateLimiter(
+        max_size=5, recovery_time=1.0, algorithm="token_bucket", retry=RetryPolicy(ConnectionError, base_delay=0.01)
+    )
+    attempts = 0
+
+    @limiter
+    async def flaky() -> int:
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise ConnectionError
+        return attempts
+
+    assert await flaky() == 3
+    assert limiter.stats()["retried"] == 2
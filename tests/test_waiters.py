@@ -0,0 +1,40 @@
+from time import sleep
+
+import pytest
+
+from bucketratelimiter.bucket_rate_limiters.waiters import WaitQueue
+
+
+def test_priority_order():
+    queue = WaitQueue()
+    for waiter, priority in (("a", 1), ("b", 0), ("c", 1), ("d", 0), ("e", 2)):
+        queue.append(waiter, priority)
+    assert len(queue) == 5
+    assert queue.head() == "b"
+    assert [queue.popleft() for _ in range(5)] == ["b", "d", "a", "c", "e"]
+    assert not queue
+    with pytest.raises(IndexError):
+        queue.head()
+
+
+def test_aging():
+    queue = WaitQueue(aging=0.01)
+    queue.append("background", 2)
+    sleep(0.015)
+    queue.append("user", 1)  # "background" has waited long enough to get priority 1 before "user" came
+    queue.append("other user", 0)
+    assert [queue.popleft() for _ in range(3)] == ["other user", "background", "user"]
+
+    with pytest.raises(ValueError):
+        WaitQueue(aging=0)
+
+
+def test_remove():
+    queue = WaitQueue()
+    for waiter, priority in (("a", 0), ("b", 0), ("c", 1)):
+        queue.append(waiter, priority)
+    assert queue.remove("a")
+    assert queue.head() == "b"
+    assert queue.remove("c")
+    assert not queue.remove("c")
+    assert len(queue) == 1 and queue.popleft() == "b"